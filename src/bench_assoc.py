@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import time
+import numpy as np
+
+from tracker import matching
+from tracking_utils.kalman_filter import KalmanFilter
+
+
+"""(tracks, detections) of crowded scenes, checked by main"""
+SIZES = ((100, 150), (300, 500))
+
+
+def make_scene(kf, num_tracks, num_dets, rng, width=1920, height=1080, reid_dim=128):
+    """Predicted tracks and detections of a frame, most tracks with a detection near them"""
+    xyah = np.stack([rng.uniform(0, width, num_tracks), rng.uniform(0, height, num_tracks),
+                     np.full(num_tracks, 0.4), rng.uniform(40, 300, num_tracks)], axis=1)
+    means, covariances = kf.multi_predict(*kf.multi_initiate(xyah))
+    new = np.stack([rng.uniform(0, width, num_dets - num_tracks), rng.uniform(0, height, num_dets - num_tracks),
+                    np.full(num_dets - num_tracks, 0.4), rng.uniform(40, 300, num_dets - num_tracks)], axis=1)
+    det_xyahs = np.concatenate([xyah + rng.normal(0, 3, xyah.shape), new])
+    track_feats = rng.normal(size=(num_tracks, reid_dim))
+    det_feats = np.concatenate([track_feats + rng.normal(0, 0.3, track_feats.shape),
+                                rng.normal(size=(num_dets - num_tracks, reid_dim))])
+    return (means, covariances), det_xyahs, track_feats, det_feats
+
+
+def dense_assignment(kf, states, det_xyahs, track_feats, det_feats, thresh=0.4):
+    dists = matching.embedding_distance(track_feats, det_feats)
+    dists = matching.fuse_motion(kf, dists, states, det_xyahs)
+    return matching.linear_assignment(dists, thresh)
+
+
+def sparse_assignment(kf, states, det_xyahs, track_feats, det_feats, thresh=0.4):
+    ia, ib = matching.gate_pairs(kf, states, det_xyahs)
+    dists = matching.sparse_embedding_distance(track_feats, det_feats, ia, ib)
+    ia, ib, dists = matching.sparse_fuse_motion(kf, dists, ia, ib, states, det_xyahs)
+    return matching.sparse_linear_assignment(ia, ib, dists, (len(track_feats), len(det_xyahs)), thresh)
+
+
+def timeit(fn, args, repeat=10):
+    fn(*args)
+    t = time.time()
+    for _ in range(repeat):
+        result = fn(*args)
+    return (time.time() - t) / repeat, result
+
+
+def main():
+    """
+    Time the embedding association of --sparse_assoc against the dense one
+    and fail if it is slower or matches differently
+    """
+    kf = KalmanFilter()
+    rng = np.random.RandomState(0)
+    for num_tracks, num_dets in SIZES:
+        args = (kf, ) + make_scene(kf, num_tracks, num_dets, rng)
+        dense_time, (dense_matches, _, _) = timeit(dense_assignment, args)
+        sparse_time, (sparse_matches, _, _) = timeit(sparse_assignment, args)
+        print('{}x{}: dense {:.2f}ms sparse {:.2f}ms'.format(
+            num_tracks, num_dets, dense_time * 1000, sparse_time * 1000))
+        if sorted(map(tuple, np.asarray(dense_matches).tolist())) != \
+                sorted(map(tuple, np.asarray(sparse_matches).tolist())):
+            raise AssertionError('sparse association matches differently at {}x{}'.format(num_tracks, num_dets))
+        if sparse_time > dense_time:
+            raise AssertionError('sparse association is slower than dense at {}x{}'.format(num_tracks, num_dets))
+
+
+if __name__ == '__main__':
+    main()
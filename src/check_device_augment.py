@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import numpy as np
+import torch
+
+from datasets.dataset.device_augment import DeviceAugment
+from datasets.dataset.targets import encode_targets
+from opts import opts
+
+
+def make_batch(opt, rng, batch_size=4, max_objs=500, num_objs=(0, 1, 30, 120)):
+    """Letterboxed uint8 images and padded pixel labels, as JointDataset returns them with --device_augment"""
+    width, height = opt.img_size
+    imgs = rng.randint(0, 256, (batch_size, height, width, 3)).astype(np.uint8)
+    labels = np.zeros((batch_size, max_objs, 6), dtype=np.float32)
+    for i, n in enumerate(num_objs):
+        x1 = rng.uniform(0, width - 20, n)
+        y1 = rng.uniform(0, height - 40, n)
+        labels[i, :n, 1] = rng.randint(-1, 1000, n)
+        labels[i, :n, 2:6] = np.stack([x1, y1, np.minimum(x1 + rng.uniform(4, 200, n), width),
+                                       np.minimum(y1 + rng.uniform(8, 400, n), height)], axis=1)
+    return {'input': torch.from_numpy(imgs), 'labels': torch.from_numpy(labels),
+            'num_objs': torch.tensor(num_objs)}
+
+
+def cpu_targets(opt, batch, max_objs):
+    """encode_targets of every image of `batch`, as JointDataset computes them without --device_augment"""
+    _, height, width, _ = batch['input'].shape
+    targets = []
+    for labels, n in zip(batch['labels'].numpy(), batch['num_objs'].tolist()):
+        labels = labels[:n].copy()
+        boxes = labels[:, 2:6].copy()
+        labels[:, 2] = (boxes[:, 0] + boxes[:, 2]) / 2 / width
+        labels[:, 3] = (boxes[:, 1] + boxes[:, 3]) / 2 / height
+        labels[:, 4] = (boxes[:, 2] - boxes[:, 0]) / width
+        labels[:, 5] = (boxes[:, 3] - boxes[:, 1]) / height
+        targets.append(encode_targets(labels, height // opt.down_ratio, width // opt.down_ratio, max_objs,
+                                      ltrb=opt.ltrb, mse_loss=opt.mse_loss))
+    return {k: np.stack([t[k] for t in targets]) for k in targets[0]}
+
+
+def main(opt):
+    """
+    Run DeviceAugment on the device train.py trains on and fail if the
+    targets without augmentation differ from encode_targets, or if the
+    augmented batch is not on that device or not finite
+    """
+    rng = np.random.RandomState(0)
+    device_augment = DeviceAugment(opt)
+    batch = make_batch(opt, rng)
+    max_objs = batch['labels'].size(1)
+    expected = cpu_targets(opt, batch, max_objs)
+    batch = {k: v.to(opt.device) for k, v in batch.items()}
+
+    ret = device_augment(batch, augment=False)
+    for k, v in expected.items():
+        if not np.allclose(ret[k].cpu().numpy(), v, atol=1e-5):
+            raise AssertionError('{} of DeviceAugment differs from encode_targets on {}'.format(k, opt.device))
+
+    torch.manual_seed(opt.seed)
+    ret = device_augment(batch, augment=True)
+    for k, v in ret.items():
+        if v.device.type != opt.device.type:
+            raise AssertionError('augmented {} is on {}, not {}'.format(k, v.device, opt.device))
+        if v.is_floating_point() and not torch.isfinite(v).all():
+            raise AssertionError('augmented {} is not finite on {}'.format(k, opt.device))
+    print('DeviceAugment on {}: targets match, augmented {} objects'.format(
+        opt.device, int(ret['reg_mask'].sum())))
+
+
+if __name__ == '__main__':
+    opt = opts().init()
+    opt.device = torch.device('cuda' if opt.gpus[0] >= 0 else 'cpu')
+    main(opt)
@@ -22,14 +22,15 @@ def demo(opt):
     mkdir_if_missing(result_root)
 
     logger.info('Starting tracking...')
-    dataloader = datasets.LoadVideo(opt.input_video, opt.img_size)
-    result_filename = os.path.join(result_root, 'results.txt')
+    dataloader = datasets.LoadVideo(opt.input_video, opt.img_size, as_uint8=True)
+    result_filename = os.path.join(result_root, 'results.npy' if opt.results_binary else 'results.txt')
     frame_rate = dataloader.frame_rate
 
     frame_dir = None if opt.output_format == 'text' else osp.join(result_root, 'frame')
     eval_seq(opt, dataloader, 'mot', result_filename,
              save_dir=frame_dir, show_image=False, frame_rate=frame_rate,
-             use_cuda=opt.gpus!=[-1])
+             use_cuda=opt.gpus!=[-1],
+             det_cache_dir=osp.join(result_root, 'dets') if opt.save_det_cache else None)
 
     if opt.output_format == 'video':
         output_video_path = osp.join(result_root, 'MOT16-03-results.mp4')
@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import os
+import torch
+
+from models.model import create_model, load_model
+from models.export import TrackingNet, HeadOutputs, export_torchscript, load_torchscript, export_onnx, load_onnx
+from opts import opts
+
+
+"""Max abs difference of an exported model's outputs to the eager model"""
+PARITY_ATOL = 1e-3
+
+
+def export_filename(opt):
+    if opt.export_path != '':
+        return opt.export_path
+    width, height = opt.img_size
+    ext = '.onnx' if opt.export_format == 'onnx' else '.pt'
+    return '{}_{}x{}{}'.format(os.path.splitext(opt.load_model)[0], width, height, ext)
+
+
+def check_torchscript(model, opt, filename):
+    """
+    Compare the detections and embeddings of the saved model to `model`
+    :return: dict output name -> max abs difference
+    """
+    traced, _ = load_torchscript(filename, opt.device)
+    net = TrackingNet(model, K=opt.K, ltrb=opt.ltrb, reg_offset=opt.reg_offset).eval()
+    width, height = opt.img_size
+    x = torch.rand(1, 3, height, width, device=opt.device)
+    with torch.no_grad():
+        dets, id_feature = net(x)
+        traced_dets, traced_id_feature = traced(x)
+    return {'dets': (dets - traced_dets).abs().max().item(),
+            'id_feature': (id_feature - traced_id_feature).abs().max().item()}
+
+
+def check_onnx(model, opt, filename, batch_size=2):
+    """
+    Compare the head outputs of the ONNX graph run by ONNX Runtime to `model`
+    :return: dict head -> max abs difference
+    """
+    session, _ = load_onnx(filename, opt.device)
+    net = HeadOutputs(model, opt.heads).eval()
+    width, height = opt.img_size
+    x = torch.rand(batch_size, 3, height, width, device=opt.device)
+    with torch.no_grad():
+        outputs = net(x)
+    onnx_output = session(x)[-1]
+    return {head: (output - onnx_output[head]).abs().max().item()
+            for head, output in zip(opt.heads, outputs)}
+
+
+def main(opt):
+    opt.device = torch.device('cuda' if opt.gpus[0] >= 0 else 'cpu')
+    print('Creating model...')
+    model = create_model(opt.arch, opt.heads, opt.head_conv)
+    model = load_model(model, opt.load_model)
+    model = model.to(opt.device)
+    model.eval()
+
+    filename = export_filename(opt)
+    if opt.export_format == 'onnx':
+        export_onnx(model, opt, filename)
+        diffs = check_onnx(model, opt, filename)
+    else:
+        export_torchscript(model, opt, filename)
+        diffs = check_torchscript(model, opt, filename)
+    print('saved {} for input size {}'.format(filename, tuple(opt.img_size)))
+
+    print('max abs difference to the eager model: ' +
+          ', '.join('{} {:.3g}'.format(name, diff) for name, diff in diffs.items()))
+    if max(diffs.values()) > PARITY_ATOL:
+        raise RuntimeError('{} does not match the eager model within {}'.format(filename, PARITY_ATOL))
+
+
+if __name__ == '__main__':
+    opt = opts().init()
+    main(opt)
@@ -0,0 +1,31 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import json
+import time
+
+from datasets.dataset.label_index import read_file_lists
+from datasets.dataset.image_cache import write_image_cache
+from opts import opts
+
+
+def main(opt):
+    with open(opt.data_cfg) as f:
+        data_config = json.load(f)
+    img_files, _ = read_file_lists(data_config['root'], data_config['train'])
+    num_files = sum(len(x) for x in img_files.values())
+    width, height = opt.img_size
+    print('Letterboxing {} images to {}x{} into {}...'.format(num_files, width, height, opt.image_cache_dir))
+    t = time.time()
+    write_image_cache(opt.image_cache_dir, img_files, opt.img_size, fmt=opt.image_cache_format,
+                      quality=opt.image_cache_quality, shard_size=opt.shard_size << 20)
+    print('Done in {:.0f}s'.format(time.time() - t))
+
+
+if __name__ == '__main__':
+    opt = opts().init()
+    if opt.image_cache_dir == '':
+        raise ValueError('--image_cache_dir is required')
+    main(opt)
@@ -0,0 +1,29 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import json
+import time
+
+from datasets.dataset.label_index import read_file_lists
+from datasets.dataset.shards import write_shards
+from opts import opts
+
+
+def main(opt):
+    with open(opt.data_cfg) as f:
+        data_config = json.load(f)
+    img_files, label_files = read_file_lists(data_config['root'], data_config['train'])
+    num_files = sum(len(x) for x in img_files.values())
+    print('Packing {} images into {}...'.format(num_files, opt.shard_dir))
+    t = time.time()
+    write_shards(opt.shard_dir, img_files, label_files, shard_size=opt.shard_size << 20, seed=opt.seed)
+    print('Done in {:.0f}s'.format(time.time() - t))
+
+
+if __name__ == '__main__':
+    opt = opts().init()
+    if opt.shard_dir == '':
+        raise ValueError('--shard_dir is required')
+    main(opt)
@@ -0,0 +1,235 @@
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+"""
+Device-side batch stage of --device_augment. Data loader workers only
+letterbox the images and return them as uint8 with their labels in pixel
+x1, y1, x2, y2. The HSV jitter, the random affine warp, the left-right flip
+and the targets of JointDataset are computed for the whole batch on the
+training device, with the same distributions as on the CPU. Results are not
+bit-identical to the CPU path: HSV is jittered in float rather than in
+OpenCV's uint8 HSV, after the letterbox, and the warp is a bilinear
+grid_sample.
+"""
+
+
+def hsv_jitter(imgs, fraction=0.5):
+    """
+    Scale saturation and value of BGR float images in [0, 255] by random
+    factors in [1 - fraction, 1 + fraction], one pair per image.
+    Scaling V scales every channel; scaling S moves the channels away from
+    V, with S clipped to 1 as the CPU path clips it to 255.
+    :type imgs: torch.Tensor, Bx3xHxW
+    """
+    n = imgs.size(0)
+    a_s, a_v = ((torch.rand(2, n, 1, 1, 1) * 2 - 1) * fraction + 1).to(imgs.device)
+    v = imgs.max(dim=1, keepdim=True)[0]
+    s = 1 - imgs.min(dim=1, keepdim=True)[0] / v.clamp(min=1e-6)
+    a_s = torch.minimum(a_s.expand_as(s), 1 / s.clamp(min=1e-6))
+    imgs = v - a_s * (v - imgs)
+    return (imgs * a_v).clamp(0, 255)
+
+
+def affine_matrices(n, height, width, degrees=(-5, 5), translate=(0.10, 0.10), scale=(0.50, 1.20),
+                    shear=(-2, 2)):
+    """
+    :return: nx3x3 float64 pixel-space matrices drawn as in random_affine, angles in degrees
+    """
+    a = torch.rand(n, dtype=torch.float64) * (degrees[1] - degrees[0]) + degrees[0]
+    s = torch.rand(n, dtype=torch.float64) * (scale[1] - scale[0]) + scale[0]
+    cx, cy = width / 2, height / 2
+    alpha = s * torch.cos(a * math.pi / 180)
+    beta = s * torch.sin(a * math.pi / 180)
+    R = torch.eye(3, dtype=torch.float64).repeat(n, 1, 1)
+    R[:, 0, 0], R[:, 0, 1], R[:, 0, 2] = alpha, beta, (1 - alpha) * cx - beta * cy
+    R[:, 1, 0], R[:, 1, 1], R[:, 1, 2] = -beta, alpha, beta * cx + (1 - alpha) * cy
+
+    # translations as random_affine draws them, x scaled by the height and y by the width
+    T = torch.eye(3, dtype=torch.float64).repeat(n, 1, 1)
+    T[:, 0, 2] = (torch.rand(n, dtype=torch.float64) * 2 - 1) * translate[0] * height
+    T[:, 1, 2] = (torch.rand(n, dtype=torch.float64) * 2 - 1) * translate[1] * width
+
+    S = torch.eye(3, dtype=torch.float64).repeat(n, 1, 1)
+    S[:, 0, 1] = torch.tan((torch.rand(n, dtype=torch.float64) * (shear[1] - shear[0]) + shear[0]) * math.pi / 180)
+    S[:, 1, 0] = torch.tan((torch.rand(n, dtype=torch.float64) * (shear[1] - shear[0]) + shear[0]) * math.pi / 180)
+    return S @ T @ R, a
+
+
+def warp_affine(imgs, M, border_value=127.5):
+    """
+    cv2.warpPerspective of every image with its pixel-space matrix, bilinear,
+    with a constant border
+    :type imgs: torch.Tensor, Bx3xHxW float
+    :type M: torch.Tensor, Bx3x3 float64
+    """
+    n, _, height, width = imgs.shape
+    # pixel centers to the [-1, 1] coordinates of affine_grid with align_corners=False
+    N = torch.tensor([[2. / width, 0, 1. / width - 1], [0, 2. / height, 1. / height - 1], [0, 0, 1]],
+                     dtype=torch.float64, device=M.device)
+    theta = N @ torch.inverse(M) @ torch.inverse(N)
+    grid = F.affine_grid(theta[:, :2].to(imgs), imgs.shape, align_corners=False)
+    warped = F.grid_sample(imgs - border_value, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+    return warped + border_value
+
+
+def warp_boxes(boxes, M, angles, keep):
+    """
+    Boxes after the warp, as random_affine computes them
+    :type boxes: torch.Tensor, BxKx4 x1, y1, x2, y2 in pixels
+    :type keep: torch.Tensor, BxK bool, labels to consider
+    :return: warped boxes, BxK bool mask of the boxes random_affine keeps
+    """
+    M = M.to(boxes)
+    area0 = (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+    corners = boxes[..., [0, 1, 2, 3, 0, 3, 2, 1]].reshape(boxes.size(0), -1, 2)
+    corners = corners @ M[:, :2, :2].transpose(1, 2) + M[:, None, :2, 2]
+    corners = corners.reshape(boxes.size(0), boxes.size(1), 4, 2)
+    x1y1 = corners.min(dim=2)[0]
+    x2y2 = corners.max(dim=2)[0]
+
+    radians = angles.to(boxes) * math.pi / 180
+    reduction = torch.maximum(torch.sin(radians).abs(), torch.cos(radians).abs()).sqrt()[:, None, None]
+    center = (x1y1 + x2y2) / 2
+    size = (x2y2 - x1y1) * reduction
+    boxes = torch.cat([center - size / 2, center + size / 2], dim=2)
+
+    w, h = size[..., 0], size[..., 1]
+    area = w * h
+    ar = torch.maximum(w / (h + 1e-16), h / (w + 1e-16))
+    keep = keep & (w > 4) & (h > 4) & (area / (area0 + 1e-16) > 0.1) & (ar < 10)
+    return boxes, keep
+
+
+def gaussian_radius(height, width, min_overlap=0.7):
+    """utils.image.gaussian_radius of tensors"""
+    b1 = height + width
+    c1 = width * height * (1 - min_overlap) / (1 + min_overlap)
+    r1 = (b1 + torch.sqrt(b1 ** 2 - 4 * c1)) / 2
+    b2 = 2 * (height + width)
+    c2 = (1 - min_overlap) * width * height
+    r2 = (b2 + torch.sqrt(b2 ** 2 - 16 * c2)) / 2
+    a3 = 4 * min_overlap
+    b3 = -2 * min_overlap * (height + width)
+    c3 = (min_overlap - 1) * width * height
+    r3 = (b3 + torch.sqrt(b3 ** 2 - 4 * a3 * c3)) / 2
+    return torch.minimum(torch.minimum(r1, r2), r3)
+
+
+def draw_gaussians(hm, batch_index, cls_ids, centers, radii, sigmas, window):
+    """
+    Draw the gaussians of many objects into `hm` at once, keeping the max
+    where they overlap, like draw_umich_gaussian / draw_msra_gaussian.
+    :type hm: torch.Tensor, BxCxHxW
+    :type centers: torch.Tensor, Nx2 int64 x, y
+    :type radii: torch.Tensor, N int64, half size of the square drawn around each center
+    :type sigmas: torch.Tensor, N float
+    :type window: int, largest radius
+    """
+    _, num_classes, height, width = hm.shape
+    offsets = torch.arange(-window, window + 1, device=hm.device)
+    dy, dx = torch.meshgrid(offsets, offsets, indexing='ij')
+    dx, dy = dx.reshape(1, -1), dy.reshape(1, -1)
+    x = centers[:, 0:1] + dx
+    y = centers[:, 1:2] + dy
+    g = torch.exp(-(dx * dx + dy * dy).to(hm) / (2 * sigmas[:, None] ** 2))
+    inside = (dx.abs() <= radii[:, None]) & (dy.abs() <= radii[:, None]) & \
+        (x >= 0) & (x < width) & (y >= 0) & (y < height) & (g >= np.finfo(np.float64).eps)
+    index = ((batch_index[:, None] * num_classes + cls_ids[:, None]) * height + y) * width + x
+    hm.view(-1).scatter_reduce_(0, index[inside], g[inside], reduce='amax')
+    return hm
+
+
+class DeviceAugment(object):
+    """
+    Turns a batch of letterboxed uint8 images and pixel labels, as JointDataset
+    returns them with --device_augment, into the inputs and targets it
+    returns otherwise, on the device the batch is on.
+    """
+
+    def __init__(self, opt, num_classes=1):
+        self.down_ratio = opt.down_ratio
+        self.ltrb = opt.ltrb
+        self.mse_loss = opt.mse_loss
+        self.num_classes = num_classes
+
+    def __call__(self, batch, augment=True):
+        """
+        :type batch: dict input BxHxWx3 uint8 BGR, labels BxKx6 class, track id,
+                     x1, y1, x2, y2 in pixels, num_objs B
+        :return: dict input Bx3xHxW RGB in [0, 1], hm, reg_mask, ind, wh, reg, ids, bbox
+        """
+        imgs = batch['input'].permute(0, 3, 1, 2).float()
+        labels = batch['labels'].float()
+        n, _, height, width = imgs.shape
+        keep = torch.arange(labels.size(1), device=labels.device)[None] < batch['num_objs'].view(-1, 1)
+        boxes = labels[..., 2:6]
+        if augment:
+            imgs = hsv_jitter(imgs)
+            M, angles = affine_matrices(n, height, width)
+            imgs = warp_affine(imgs, M.to(imgs.device))
+            boxes, keep = warp_boxes(boxes, M.to(imgs.device), angles, keep)
+
+        # x1, y1, x2, y2 in pixels to normalized cx, cy, w, h
+        scale = boxes.new_tensor([width, height])
+        center = (boxes[..., 0:2] + boxes[..., 2:4]) / 2 / scale
+        size = (boxes[..., 2:4] - boxes[..., 0:2]) / scale
+        if augment:
+            flip = torch.rand(n, device=imgs.device) > 0.5
+            imgs = torch.where(flip[:, None, None, None], imgs.flip(3), imgs)
+            center[..., 0] = torch.where(flip[:, None], 1 - center[..., 0], center[..., 0])
+
+        ret = {'input': imgs.flip(1).clamp(0, 255) / 255.}
+        ret.update(self.encode(labels, center, size, keep, height // self.down_ratio, width // self.down_ratio))
+        return ret
+
+    def encode(self, labels, center, size, keep, output_h, output_w):
+        """encode_targets of the whole batch"""
+        n, max_objs = keep.shape
+        device = labels.device
+        cx = center[..., 0] * output_w
+        cy = center[..., 1] * output_h
+        w = size[..., 0] * output_w
+        h = size[..., 1] * output_h
+        keep = keep & (h > 0) & (w > 0)
+
+        amodal_x1 = cx - w / 2.
+        amodal_y1 = cy - h / 2.
+        amodal_x2 = amodal_x1 + w
+        amodal_y2 = amodal_y1 + h
+        cx = cx.clamp(0, output_w - 1)
+        cy = cy.clamp(0, output_h - 1)
+        x1 = cx - w / 2
+        y1 = cy - h / 2
+        ct = torch.stack([cx, cy], dim=2)
+        ct_int = ct.long()
+
+        if self.ltrb:
+            wh = torch.stack([cx - amodal_x1, cy - amodal_y1, amodal_x2 - cx, amodal_y2 - cy], dim=2)
+        else:
+            wh = torch.stack([w, h], dim=2)
+        hm = torch.zeros(n, self.num_classes, output_h, output_w, device=device)
+        batch_index, slot = torch.nonzero(keep, as_tuple=True)
+        if len(batch_index) > 0:
+            cls_ids = labels[batch_index, slot, 0].long()
+            if self.mse_loss:
+                # draw_msra_gaussian, sigma 6 over 3 sigma
+                radii = torch.full_like(batch_index, 18)
+                sigmas = torch.full((len(batch_index), ), 6., device=device)
+            else:
+                radii = gaussian_radius(torch.ceil(h[batch_index, slot]).double(),
+                                        torch.ceil(w[batch_index, slot]).double()).long().clamp(min=0)
+                sigmas = (2 * radii + 1).float() / 6
+            draw_gaussians(hm, batch_index, cls_ids, ct_int[batch_index, slot], radii, sigmas, int(radii.max()))
+
+        drop = ~keep
+        return {'hm': hm,
+                'reg_mask': keep.to(torch.uint8),
+                'ind': (ct_int[..., 1] * output_w + ct_int[..., 0]).masked_fill(drop, 0),
+                'wh': wh.masked_fill(drop[..., None], 0),
+                'reg': (ct - ct_int).masked_fill(drop[..., None], 0),
+                'ids': labels[..., 1].long().masked_fill(drop, 0),
+                'bbox': torch.stack([x1, y1, x1 + w, y1 + h], dim=2).masked_fill(drop[..., None], 0)}
@@ -0,0 +1,136 @@
+import json
+import os
+import os.path as osp
+
+import cv2
+import numpy as np
+
+from .shards import ShardWriter, ShardReader, paths_header, paths_match, SHARD_SIZE
+
+
+"""
+An image cache holds the images of a data config already letterboxed to the
+training input size, so data loader workers skip decoding and resizing the
+full resolution frames. A cache directory holds
+
+    geometry.npy          float64 (num_files, 5): original height and width,
+                          letterbox ratio, horizontal and vertical padding
+    images.npy            raw: uint8 (num_files, height, width, 3) BGR images
+                          jpg: int64 (num_files, 3) shard, offset, length of
+                          every encoded image in shard-00000.bin ...
+    cache.json            datasets (name, number of files, hash of the image
+                          paths), input size, format, shard file names
+
+raw is bit-identical to letterboxing the original images and takes
+height * width * 3 bytes per image, jpg is smaller but lossy.
+"""
+CACHE_FORMATS = ('jpg', 'raw')
+
+
+def write_image_cache(dirname, img_files, img_size, fmt='jpg', quality=95, shard_size=SHARD_SIZE):
+    """
+    :type img_files: OrderedDict dataset name -> image files
+    :type img_size: (width, height) of the letterboxed images
+    :type fmt: str, one of CACHE_FORMATS
+    :type quality: int, JPEG quality of the jpg format
+    """
+    from .jde import letterbox
+
+    if fmt not in CACHE_FORMATS:
+        raise ValueError('unknown image cache format {}'.format(fmt))
+    if not osp.isdir(dirname):
+        os.makedirs(dirname)
+    width, height = img_size
+    num_files = sum(len(x) for x in img_files.values())
+    geometry = np.zeros((num_files, 5), dtype=np.float64)
+    if fmt == 'raw':
+        images = np.lib.format.open_memmap(osp.join(dirname, 'images.npy'), mode='w+', dtype=np.uint8,
+                                           shape=(num_files, height, width, 3))
+    else:
+        writer = ShardWriter(dirname, shard_size)
+        locations = np.zeros((num_files, 3), dtype=np.int64)
+
+    i = 0
+    for img_paths in img_files.values():
+        for img_path in img_paths:
+            img = cv2.imread(img_path)  # BGR
+            if img is None:
+                raise ValueError('File corrupt {}'.format(img_path))
+            h, w, _ = img.shape
+            img, ratio, padw, padh = letterbox(img, height=height, width=width)
+            geometry[i] = h, w, ratio, padw, padh
+            if fmt == 'raw':
+                images[i] = img
+            else:
+                _, data = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+                locations[i] = writer.write(data.tobytes())
+            i += 1
+
+    shards = []
+    if fmt == 'raw':
+        images.flush()
+        del images
+    else:
+        shards = writer.close()
+        np.save(osp.join(dirname, 'images.npy'), locations)
+    np.save(osp.join(dirname, 'geometry.npy'), geometry)
+    # written last, a cache directory without it is incomplete
+    with open(osp.join(dirname, 'cache.json'), 'w') as f:
+        json.dump({'datasets': paths_header(img_files), 'img_size': [width, height], 'format': fmt,
+                   'quality': quality, 'shards': shards}, f)
+
+
+class ImageCache(object):
+    """Letterboxed images of a cache directory written by write_image_cache"""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        with open(osp.join(dirname, 'cache.json'), 'r') as f:
+            self.header = json.load(f)
+        self.img_size = tuple(self.header['img_size'])
+        self.geometry = np.load(osp.join(dirname, 'geometry.npy'))
+        if self.header['format'] == 'raw':
+            self.images = np.load(osp.join(dirname, 'images.npy'), mmap_mode='r')
+        else:
+            self.images = ShardReader(dirname, self.header['shards'], np.load(osp.join(dirname, 'images.npy')))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.header['format'] == 'raw':
+            # workers map the file again instead of receiving a copy of it
+            state['images'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.images is None:
+            self.images = np.load(osp.join(self.dirname, 'images.npy'), mmap_mode='r')
+
+    def matches(self, img_files, img_size):
+        """True if the cache holds exactly the images of `img_files`, in this order and at `img_size`"""
+        return tuple(img_size) == self.img_size and paths_match(self.header['datasets'], img_files)
+
+    def __len__(self):
+        return len(self.geometry)
+
+    def read(self, idx):
+        """
+        :return: letterboxed BGR image `idx`,
+                 (original height, original width, letterbox ratio, padw, padh)
+        """
+        if self.header['format'] == 'raw':
+            img = np.array(self.images[idx])
+        else:
+            img = self.images.imread(idx)
+        h, w, ratio, padw, padh = self.geometry[idx].tolist()
+        # python numbers like letterbox returns, so labels are transformed in the same precision
+        return img, (int(h), int(w), ratio, padw, padh)
+
+
+def load_image_cache(dirname, img_files, img_size):
+    """Open the image cache of `dirname`, which must hold the images of `img_files` at `img_size`"""
+    cache = ImageCache(dirname)
+    if not cache.matches(img_files, img_size):
+        raise ValueError('{} holds the images of another file list or input size, run '
+                         'gen_image_cache.py with this data config'.format(dirname))
+    return cache
@@ -2,7 +2,9 @@ import glob
 import math
 import os
 import os.path as osp
+import queue
 import random
+import threading
 import time
 from collections import OrderedDict
 
@@ -10,18 +12,22 @@ import cv2
 import json
 import numpy as np
 import torch
-import copy
 
 from torch.utils.data import Dataset
 from torchvision.transforms import transforms as T
 from cython_bbox import bbox_overlaps as bbox_ious
 from opts import opts
-from utils.image import gaussian_radius, draw_umich_gaussian, draw_msra_gaussian
 from utils.utils import xyxy2xywh, generate_anchors, xywh2xyxy, encode_delta
+from .label_index import read_file_lists, count_track_ids, load_label_index
+from .shards import load_image_shards
+from .image_cache import load_image_cache
+from .targets import encode_targets
 
 
 class LoadImages:  # for inference
-    def __init__(self, path, img_size=(1088, 608)):
+    random_access = True
+
+    def __init__(self, path, img_size=(1088, 608), as_uint8=False):
         if os.path.isdir(path):
             image_format = ['.jpg', '.jpeg', '.png', '.tif']
             self.files = sorted(glob.glob('%s/*.*' % path))
@@ -33,6 +39,9 @@ class LoadImages:  # for inference
         self.width = img_size[0]
         self.height = img_size[1]
         self.count = 0
+        # return the padded BGR uint8 image and leave normalization to to_blob
+        self.as_uint8 = as_uint8
+        self.buffer = np.empty((self.height, self.width, 3), dtype=np.uint8) if as_uint8 else None
 
         assert self.nF > 0, 'No images found in ' + path
 
@@ -44,39 +53,30 @@ class LoadImages:  # for inference
         self.count += 1
         if self.count == self.nF:
             raise StopIteration
-        img_path = self.files[self.count]
-
-        # Read image
-        img0 = cv2.imread(img_path)  # BGR
-        assert img0 is not None, 'Failed to load ' + img_path
-
-        # Padded resize
-        img, _, _, _ = letterbox(img0, height=self.height, width=self.width)
-
-        # Normalize RGB
-        img = img[:, :, ::-1].transpose(2, 0, 1)
-        img = np.ascontiguousarray(img, dtype=np.float32)
-        img /= 255.0
-
-        # cv2.imwrite(img_path + '.letterbox.jpg', 255 * img.transpose((1, 2, 0))[:, :, ::-1])  # save letterbox image
-        return img_path, img, img0
+        return self.load(self.count)
 
     def __getitem__(self, idx):
         idx = idx % self.nF
+        return self.load(idx)
+
+    def load(self, idx, out=None):
         img_path = self.files[idx]
 
         # Read image
         img0 = cv2.imread(img_path)  # BGR
         assert img0 is not None, 'Failed to load ' + img_path
 
+        if self.as_uint8:
+            img, _, _, _ = letterbox_into(img0, self.buffer if out is None else out)
+            return img_path, img, img0
+
         # Padded resize
         img, _, _, _ = letterbox(img0, height=self.height, width=self.width)
 
         # Normalize RGB
-        img = img[:, :, ::-1].transpose(2, 0, 1)
-        img = np.ascontiguousarray(img, dtype=np.float32)
-        img /= 255.0
+        img = normalize_rgb(img, out)
 
+        # cv2.imwrite(img_path + '.letterbox.jpg', 255 * img.transpose((1, 2, 0))[:, :, ::-1])  # save letterbox image
         return img_path, img, img0
 
     def __len__(self):
@@ -84,7 +84,9 @@ class LoadImages:  # for inference
 
 
 class LoadVideo:  # for inference
-    def __init__(self, path, img_size=(1088, 608)):
+    random_access = False
+
+    def __init__(self, path, img_size=(1088, 608), as_uint8=False):
         self.cap = cv2.VideoCapture(path)
         self.frame_rate = int(round(self.cap.get(cv2.CAP_PROP_FPS)))
         self.vw = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -96,6 +98,8 @@ class LoadVideo:  # for inference
         self.count = 0
 
         self.w, self.h = 1920, 1080
+        self.as_uint8 = as_uint8
+        self.buffer = np.empty((self.height, self.width, 3), dtype=np.uint8) if as_uint8 else None
         print('Lenth of the video: {:d} frames'.format(self.vn))
 
     def get_size(self, vw, vh, dw, dh):
@@ -111,27 +115,130 @@ class LoadVideo:  # for inference
         self.count += 1
         if self.count == len(self):
             raise StopIteration
-        # Read image
+        return self.load(self.count)
+
+    def load(self, idx, out=None):
+        # frames can only be decoded in order, idx is the position in the stream
         res, img0 = self.cap.read()  # BGR
-        assert img0 is not None, 'Failed to load frame {:d}'.format(self.count)
+        assert img0 is not None, 'Failed to load frame {:d}'.format(idx)
         img0 = cv2.resize(img0, (self.w, self.h))
 
+        if self.as_uint8:
+            img, _, _, _ = letterbox_into(img0, self.buffer if out is None else out)
+            return idx, img, img0
+
         # Padded resize
         img, _, _, _ = letterbox(img0, height=self.height, width=self.width)
 
         # Normalize RGB
-        img = img[:, :, ::-1].transpose(2, 0, 1)
-        img = np.ascontiguousarray(img, dtype=np.float32)
-        img /= 255.0
+        img = normalize_rgb(img, out)
 
         # cv2.imwrite(img_path + '.letterbox.jpg', 255 * img.transpose((1, 2, 0))[:, :, ::-1])  # save letterbox image
-        return self.count, img, img0
+        return idx, img, img0
 
     def __len__(self):
         return self.vn  # number of files
 
 
+class PrefetchLoader:  # for inference
+    """
+    Decodes and letterboxes the frames of LoadImages / LoadVideo on background
+    threads into a bounded ring of preallocated input buffers. Frames are
+    returned in order; workers block when the ring is full. The returned input
+    array is reused once the next frame is requested.
+    """
+
+    def __init__(self, loader, buffer_size=4, num_workers=1):
+        self.loader = loader
+        self.nF = len(loader)
+        self.width = loader.width
+        self.height = loader.height
+        self.frame_rate = getattr(loader, 'frame_rate', None)
+        self.buffer_size = max(buffer_size, 1)
+        # sequential sources such as videos are decoded by a single worker
+        self.num_workers = max(num_workers, 1) if loader.random_access else 1
+        if getattr(loader, 'as_uint8', False):
+            self.buffers = np.empty((self.buffer_size, self.height, self.width, 3), dtype=np.uint8)
+        else:
+            self.buffers = np.empty((self.buffer_size, 3, self.height, self.width), dtype=np.float32)
+        self.workers = []
+
+    def __iter__(self):
+        self.close()
+        self.count = -1
+        self.next_index = 0
+        self.in_use = None
+        self.ready = {}
+        self.error = None
+        self.stopped = False
+        self.free_slots = queue.Queue()
+        for slot in range(self.buffer_size):
+            self.free_slots.put(slot)
+        self.claim_lock = threading.Lock()
+        self.ready_cond = threading.Condition()
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(self.num_workers)]
+        for w in self.workers:
+            w.start()
+        return self
+
+    def _work(self):
+        while True:
+            # take the slot before the index, so the oldest pending frame always has a buffer
+            with self.claim_lock:
+                slot = self.free_slots.get()
+                idx = self.next_index
+                self.next_index += 1
+            if self.stopped or idx >= self.nF:
+                self.free_slots.put(slot)
+                return
+            try:
+                path, img, img0 = self.loader.load(idx, out=self.buffers[slot])
+            except Exception as e:
+                with self.ready_cond:
+                    self.error = e
+                    self.ready_cond.notify_all()
+                return
+            with self.ready_cond:
+                self.ready[idx] = (slot, path, img0)
+                self.ready_cond.notify_all()
+
+    def __next__(self):
+        if self.in_use is not None:
+            self.free_slots.put(self.in_use)
+            self.in_use = None
+        self.count += 1
+        if self.count >= self.nF:
+            self.close()
+            raise StopIteration
+        with self.ready_cond:
+            while self.count not in self.ready and self.error is None:
+                self.ready_cond.wait()
+            if self.count not in self.ready:
+                self.close()
+                raise self.error
+            slot, path, img0 = self.ready.pop(self.count)
+        self.in_use = slot
+        return path, self.buffers[slot], img0
+
+    def close(self):
+        if len(self.workers) == 0:
+            return
+        self.stopped = True
+        # wake up workers waiting for a free buffer
+        for _ in self.workers:
+            self.free_slots.put(0)
+        for w in self.workers:
+            w.join()
+        self.workers = []
+
+    def __len__(self):
+        return self.nF
+
+
 class LoadImagesAndLabels:  # for training
+    image_shards = None
+    image_cache = None
+
     def __init__(self, path, img_size=(1088, 608), augment=False, transforms=None):
         with open(path, 'r') as file:
             self.img_files = file.readlines()
@@ -152,10 +259,54 @@ class LoadImagesAndLabels:  # for training
         label_path = self.label_files[files_index]
         return self.get_data(img_path, label_path)
 
-    def get_data(self, img_path, label_path):
+    def read_image(self, files_index):
+        """
+        :return: image `files_index` and its letterbox geometry from the image cache
+                 or the image shards if there are any, else None, None
+        """
+        if self.image_cache is not None:
+            return self.image_cache.read(files_index)
+        if self.image_shards is not None:
+            return self.image_shards.imread(files_index), None
+        return None, None
+
+    def get_letterboxed(self, files_index, img_path, label_path, labels0=None):
+        """
+        Image `files_index` letterboxed to the input size, without augmentation,
+        for --device_augment
+        :return: HxWx3 uint8 BGR image, Nx6 labels with x1, y1, x2, y2 in pixels, (h, w)
+        """
+        img, geometry = self.read_image(files_index)
+        if img is None:
+            img = cv2.imread(img_path)  # BGR
+            if img is None:
+                raise ValueError('File corrupt {}'.format(img_path))
+        if geometry is None:
+            h, w, _ = img.shape
+            img, ratio, padw, padh = letterbox(img, height=self.height, width=self.width)
+        else:
+            h, w, ratio, padw, padh = geometry
+        if labels0 is None and os.path.isfile(label_path):
+            labels0 = np.loadtxt(label_path, dtype=np.float32).reshape(-1, 6)
+        if labels0 is not None:
+            labels = letterbox_labels(labels0, ratio, w, h, padw, padh)
+        else:
+            labels = np.zeros((0, 6), dtype=np.float32)
+        return img, labels, (h, w)
+
+    def get_data(self, img_path, label_path, labels0=None, img=None, geometry=None):
+        """
+        :param labels0: Nx6 labels of the image if already read, e.g. from a label
+                        index. They are read from `label_path` otherwise.
+        :param img: BGR image if already read, e.g. from image shards. It is
+                    read from `img_path` otherwise.
+        :param geometry: (original height, original width, ratio, padw, padh) if
+                         `img` is already letterboxed, e.g. from an image cache
+        """
         height = self.height
         width = self.width
-        img = cv2.imread(img_path)  # BGR
+        if img is None:
+            img = cv2.imread(img_path)  # BGR
         if img is None:
             raise ValueError('File corrupt {}'.format(img_path))
         augment_hsv = True
@@ -180,19 +331,17 @@ class LoadImagesAndLabels:  # for training
             img_hsv[:, :, 2] = V.astype(np.uint8)
             cv2.cvtColor(img_hsv, cv2.COLOR_HSV2BGR, dst=img)
 
-        h, w, _ = img.shape
-        img, ratio, padw, padh = letterbox(img, height=height, width=width)
+        if geometry is None:
+            h, w, _ = img.shape
+            img, ratio, padw, padh = letterbox(img, height=height, width=width)
+        else:
+            h, w, ratio, padw, padh = geometry
 
         # Load labels
-        if os.path.isfile(label_path):
+        if labels0 is None and os.path.isfile(label_path):
             labels0 = np.loadtxt(label_path, dtype=np.float32).reshape(-1, 6)
-
-            # Normalized xywh to pixel xyxy format
-            labels = labels0.copy()
-            labels[:, 2] = ratio * w * (labels0[:, 2] - labels0[:, 4] / 2) + padw
-            labels[:, 3] = ratio * h * (labels0[:, 3] - labels0[:, 5] / 2) + padh
-            labels[:, 4] = ratio * w * (labels0[:, 2] + labels0[:, 4] / 2) + padw
-            labels[:, 5] = ratio * h * (labels0[:, 3] + labels0[:, 5] / 2) + padh
+        if labels0 is not None:
+            labels = letterbox_labels(labels0, ratio, w, h, padw, padh)
         else:
             labels = np.array([])
 
@@ -239,6 +388,61 @@ class LoadImagesAndLabels:  # for training
         return self.nF  # number of batches
 
 
+def normalize_rgb(img, out=None):
+    """BGR HxWx3 uint8 image -> RGB 3xHxW float32 in [0, 1], written into `out` if given"""
+    if out is None:
+        out = np.empty((3, img.shape[0], img.shape[1]), dtype=np.float32)
+    np.divide(img[:, :, ::-1].transpose(2, 0, 1), np.float32(255.0), out=out, dtype=np.float32)
+    return out
+
+
+def to_blob(img, device):
+    """
+    Letterboxed BGR uint8 image(s), HxWx3 or NxHxWx3 -> normalized RGB Nx3xHxW
+    float tensor on `device`. Only uint8 data crosses the host/device boundary,
+    the channel swap and the division by 255 run on the device.
+    """
+    blob = torch.from_numpy(img).to(device, non_blocking=True)
+    if blob.dim() == 3:
+        blob = blob.unsqueeze(0)
+    blob = blob.permute(0, 3, 1, 2).flip(1)
+    blob = blob.to(dtype=torch.float32, memory_format=torch.contiguous_format)
+    return blob.div_(255.)
+
+
+def letterbox_into(img, out, color=(127.5, 127.5, 127.5)):
+    """
+    Same as `letterbox`, but resizes straight into the preallocated HxWx3 uint8
+    buffer `out` and only paints its padding, so no image is allocated
+    """
+    height, width = out.shape[:2]
+    shape = img.shape[:2]  # shape = [height, width]
+    ratio = min(float(height) / shape[0], float(width) / shape[1])
+    new_shape = (round(shape[1] * ratio), round(shape[0] * ratio))  # new_shape = [width, height]
+    dw = (width - new_shape[0]) / 2  # width padding
+    dh = (height - new_shape[1]) / 2  # height padding
+    top, left = round(dh - 0.1), round(dw - 0.1)
+    bottom, right = top + new_shape[1], left + new_shape[0]
+
+    fill = np.clip(np.rint(color), 0, 255).astype(np.uint8)
+    out[:top] = fill
+    out[bottom:] = fill
+    out[top:bottom, :left] = fill
+    out[top:bottom, right:] = fill
+    cv2.resize(img, new_shape, dst=out[top:bottom, left:right], interpolation=cv2.INTER_AREA)
+    return out, ratio, dw, dh
+
+
+def letterbox_labels(labels0, ratio, w, h, padw, padh):
+    """Normalized xywh labels of a w x h image to pixel xyxy in its letterboxed image"""
+    labels = labels0.copy()
+    labels[:, 2] = ratio * w * (labels0[:, 2] - labels0[:, 4] / 2) + padw
+    labels[:, 3] = ratio * h * (labels0[:, 3] - labels0[:, 5] / 2) + padh
+    labels[:, 4] = ratio * w * (labels0[:, 2] + labels0[:, 4] / 2) + padw
+    labels[:, 5] = ratio * h * (labels0[:, 3] + labels0[:, 5] / 2) + padh
+    return labels
+
+
 def letterbox(img, height=608, width=1088,
               color=(127.5, 127.5, 127.5)):  # resize a rectangular image to a padded rectangular
     shape = img.shape[:2]  # shape = [height, width]
@@ -354,36 +558,29 @@ class JointDataset(LoadImagesAndLabels):  # for training
 
     def __init__(self, opt, root, paths, img_size=(1088, 608), augment=False, transforms=None):
         self.opt = opt
+        label_index_dir = opt.label_index_dir
+        shard_dir = opt.shard_dir
+        image_cache_dir = opt.image_cache_dir
         dataset_names = paths.keys()
-        self.img_files = OrderedDict()
-        self.label_files = OrderedDict()
         self.tid_num = OrderedDict()
         self.tid_start_index = OrderedDict()
         self.num_classes = 1
 
-        for ds, path in paths.items():
-            with open(path, 'r') as file:
-                self.img_files[ds] = file.readlines()
-                self.img_files[ds] = [osp.join(root, x.strip()) for x in self.img_files[ds]]
-                self.img_files[ds] = list(filter(lambda x: len(x) > 0, self.img_files[ds]))
-
-            self.label_files[ds] = [
-                x.replace('images', 'labels_with_ids').replace('.png', '.txt').replace('.jpg', '.txt')
-                for x in self.img_files[ds]]
+        self.img_files, self.label_files = read_file_lists(root, paths)
 
+        # labels of all files in one memory-mapped file instead of one text file each
+        self.label_index = load_label_index(label_index_dir, self.label_files) if label_index_dir else None
+        # images, and their labels, packed into a few large files
+        self.image_shards = load_image_shards(shard_dir, self.img_files) if shard_dir else None
+        if self.image_shards is not None:
+            self.label_index = self.image_shards.labels
+        # images already letterboxed to img_size
+        self.image_cache = load_image_cache(image_cache_dir, self.img_files, img_size) if image_cache_dir else None
         for ds, label_paths in self.label_files.items():
-            max_index = -1
-            for lp in label_paths:
-                lb = np.loadtxt(lp)
-                if len(lb) < 1:
-                    continue
-                if len(lb.shape) < 2:
-                    img_max = lb[1]
-                else:
-                    img_max = np.max(lb[:, 1])
-                if img_max > max_index:
-                    max_index = img_max
-            self.tid_num[ds] = max_index + 1
+            if self.label_index is not None:
+                self.tid_num[ds] = self.label_index.tid_num[ds]
+            else:
+                self.tid_num[ds] = count_track_ids(label_paths)
 
         last_index = 0
         for i, (k, v) in enumerate(self.tid_num.items()):
@@ -417,105 +614,51 @@ class JointDataset(LoadImagesAndLabels):  # for training
 
         img_path = self.img_files[ds][files_index - start_index]
         label_path = self.label_files[ds][files_index - start_index]
-
-        imgs, labels, img_path, (input_h, input_w) = self.get_data(img_path, label_path)
-        for i, _ in enumerate(labels):
-            if labels[i, 1] > -1:
-                labels[i, 1] += self.tid_start_index[ds]
+        labels0 = self.label_index[files_index] if self.label_index is not None else None
+        if self.opt.device_augment:
+            # augmentation and targets are left to DeviceAugment on the training device
+            img, labels, _ = self.get_letterboxed(files_index, img_path, label_path, labels0)
+            labels[labels[:, 1] > -1, 1] += self.tid_start_index[ds]
+            num_objs = min(len(labels), self.max_objs)
+            padded = np.zeros((self.max_objs, 6), dtype=np.float32)
+            padded[:num_objs] = labels[:num_objs]
+            return {'input': img, 'labels': padded, 'num_objs': num_objs}
+        img, geometry = self.read_image(files_index)
+
+        imgs, labels, img_path, (input_h, input_w) = self.get_data(img_path, label_path, labels0, img, geometry)
+        if len(labels) > 0:
+            labels[labels[:, 1] > -1, 1] += self.tid_start_index[ds]
 
         output_h = imgs.shape[1] // self.opt.down_ratio
         output_w = imgs.shape[2] // self.opt.down_ratio
-        num_classes = self.num_classes
-        num_objs = labels.shape[0]
-        hm = np.zeros((num_classes, output_h, output_w), dtype=np.float32)
-        if self.opt.ltrb:
-            wh = np.zeros((self.max_objs, 4), dtype=np.float32)
-        else:
-            wh = np.zeros((self.max_objs, 2), dtype=np.float32)
-        reg = np.zeros((self.max_objs, 2), dtype=np.float32)
-        ind = np.zeros((self.max_objs, ), dtype=np.int64)
-        reg_mask = np.zeros((self.max_objs, ), dtype=np.uint8)
-        ids = np.zeros((self.max_objs, ), dtype=np.int64)
-        bbox_xys = np.zeros((self.max_objs, 4), dtype=np.float32)
-
-        draw_gaussian = draw_msra_gaussian if self.opt.mse_loss else draw_umich_gaussian
-        for k in range(num_objs):
-            label = labels[k]
-            bbox = label[2:]
-            cls_id = int(label[0])
-            bbox[[0, 2]] = bbox[[0, 2]] * output_w
-            bbox[[1, 3]] = bbox[[1, 3]] * output_h
-            bbox_amodal = copy.deepcopy(bbox)
-            bbox_amodal[0] = bbox_amodal[0] - bbox_amodal[2] / 2.
-            bbox_amodal[1] = bbox_amodal[1] - bbox_amodal[3] / 2.
-            bbox_amodal[2] = bbox_amodal[0] + bbox_amodal[2]
-            bbox_amodal[3] = bbox_amodal[1] + bbox_amodal[3]
-            bbox[0] = np.clip(bbox[0], 0, output_w - 1)
-            bbox[1] = np.clip(bbox[1], 0, output_h - 1)
-            h = bbox[3]
-            w = bbox[2]
-
-            bbox_xy = copy.deepcopy(bbox)
-            bbox_xy[0] = bbox_xy[0] - bbox_xy[2] / 2
-            bbox_xy[1] = bbox_xy[1] - bbox_xy[3] / 2
-            bbox_xy[2] = bbox_xy[0] + bbox_xy[2]
-            bbox_xy[3] = bbox_xy[1] + bbox_xy[3]
-
-            if h > 0 and w > 0:
-                radius = gaussian_radius((math.ceil(h), math.ceil(w)))
-                radius = max(0, int(radius))
-                radius = 6 if self.opt.mse_loss else radius
-                #radius = max(1, int(radius)) if self.opt.mse_loss else radius
-                ct = np.array(
-                    [bbox[0], bbox[1]], dtype=np.float32)
-                ct_int = ct.astype(np.int32)
-                draw_gaussian(hm[cls_id], ct_int, radius)
-                if self.opt.ltrb:
-                    wh[k] = ct[0] - bbox_amodal[0], ct[1] - bbox_amodal[1], \
-                            bbox_amodal[2] - ct[0], bbox_amodal[3] - ct[1]
-                else:
-                    wh[k] = 1. * w, 1. * h
-                ind[k] = ct_int[1] * output_w + ct_int[0]
-                reg[k] = ct - ct_int
-                reg_mask[k] = 1
-                ids[k] = label[1]
-                bbox_xys[k] = bbox_xy
-
-        ret = {'input': imgs, 'hm': hm, 'reg_mask': reg_mask, 'ind': ind, 'wh': wh, 'reg': reg, 'ids': ids, 'bbox': bbox_xys}
+        ret = {'input': imgs}
+        ret.update(encode_targets(labels, output_h, output_w, self.max_objs, num_classes=self.num_classes,
+                                  ltrb=self.opt.ltrb, mse_loss=self.opt.mse_loss))
         return ret
 
 
 class DetDataset(LoadImagesAndLabels):  # for training
-    def __init__(self, root, paths, img_size=(1088, 608), augment=False, transforms=None):
+    def __init__(self, root, paths, img_size=(1088, 608), augment=False, transforms=None, label_index_dir='',
+                 shard_dir='', image_cache_dir=''):
 
         dataset_names = paths.keys()
-        self.img_files = OrderedDict()
-        self.label_files = OrderedDict()
         self.tid_num = OrderedDict()
         self.tid_start_index = OrderedDict()
-        for ds, path in paths.items():
-            with open(path, 'r') as file:
-                self.img_files[ds] = file.readlines()
-                self.img_files[ds] = [osp.join(root, x.strip()) for x in self.img_files[ds]]
-                self.img_files[ds] = list(filter(lambda x: len(x) > 0, self.img_files[ds]))
-
-            self.label_files[ds] = [
-                x.replace('images', 'labels_with_ids').replace('.png', '.txt').replace('.jpg', '.txt')
-                for x in self.img_files[ds]]
-
+        self.img_files, self.label_files = read_file_lists(root, paths)
+
+        # labels of all files in one memory-mapped file instead of one text file each
+        self.label_index = load_label_index(label_index_dir, self.label_files) if label_index_dir else None
+        # images, and their labels, packed into a few large files
+        self.image_shards = load_image_shards(shard_dir, self.img_files) if shard_dir else None
+        if self.image_shards is not None:
+            self.label_index = self.image_shards.labels
+        # images already letterboxed to img_size
+        self.image_cache = load_image_cache(image_cache_dir, self.img_files, img_size) if image_cache_dir else None
         for ds, label_paths in self.label_files.items():
-            max_index = -1
-            for lp in label_paths:
-                lb = np.loadtxt(lp)
-                if len(lb) < 1:
-                    continue
-                if len(lb.shape) < 2:
-                    img_max = lb[1]
-                else:
-                    img_max = np.max(lb[:, 1])
-                if img_max > max_index:
-                    max_index = img_max
-            self.tid_num[ds] = max_index + 1
+            if self.label_index is not None:
+                self.tid_num[ds] = self.label_index.tid_num[ds]
+            else:
+                self.tid_num[ds] = count_track_ids(label_paths)
 
         last_index = 0
         for i, (k, v) in enumerate(self.tid_num.items()):
@@ -548,10 +691,14 @@ class DetDataset(LoadImagesAndLabels):  # for training
 
         img_path = self.img_files[ds][files_index - start_index]
         label_path = self.label_files[ds][files_index - start_index]
-        if os.path.isfile(label_path):
+        labels0 = None
+        if self.label_index is not None:
+            labels0 = self.label_index[files_index]
+        elif os.path.isfile(label_path):
             labels0 = np.loadtxt(label_path, dtype=np.float32).reshape(-1, 6)
+        img, geometry = self.read_image(files_index)
 
-        imgs, labels, img_path, (h, w) = self.get_data(img_path, label_path)
+        imgs, labels, img_path, (h, w) = self.get_data(img_path, label_path, labels0, img, geometry)
         for i, _ in enumerate(labels):
             if labels[i, 1] > -1:
                 labels[i, 1] += self.tid_start_index[ds]
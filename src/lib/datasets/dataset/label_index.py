@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import os.path as osp
+from collections import OrderedDict
+
+import numpy as np
+
+
+"""
+A label index packs the labels_with_ids files of every dataset of a data
+config into one binary file, laid out as
+
+    magic           8 bytes b'FMLABEL1'
+    header size     uint64
+    header          json: datasets (name, number of files, tid_num, hash of the
+                    label paths), num_files, num_rows, array offsets
+    offsets         int64 (num_files + 1), file i owns rows offsets[i]:offsets[i + 1]
+    present         uint8 (num_files), 0 for label files that do not exist
+    rows            float32 (num_rows, 6), class, track id, x, y, w, h
+
+Files are in the order of the datasets of the config and of their file lists,
+so the position of a file is the index JointDataset / DetDataset use.
+"""
+MAGIC = b'FMLABEL1'
+ALIGN = 64
+
+
+def read_file_lists(root, paths):
+    """
+    :type paths: OrderedDict dataset name -> file listing its images, relative to `root`
+    :return: OrderedDicts dataset name -> image files, dataset name -> label files
+    """
+    img_files = OrderedDict()
+    label_files = OrderedDict()
+    for ds, path in paths.items():
+        with open(path, 'r') as file:
+            img_files[ds] = file.readlines()
+            img_files[ds] = [osp.join(root, x.strip()) for x in img_files[ds]]
+            img_files[ds] = list(filter(lambda x: len(x) > 0, img_files[ds]))
+
+        label_files[ds] = [
+            x.replace('images', 'labels_with_ids').replace('.png', '.txt').replace('.jpg', '.txt')
+            for x in img_files[ds]]
+    return img_files, label_files
+
+
+def count_track_ids(label_paths):
+    """Largest track id in the label files + 1, parsed one by one"""
+    max_index = -1
+    for lp in label_paths:
+        lb = np.loadtxt(lp)
+        if len(lb) < 1:
+            continue
+        if len(lb.shape) < 2:
+            img_max = lb[1]
+        else:
+            img_max = np.max(lb[:, 1])
+        if img_max > max_index:
+            max_index = img_max
+    return max_index + 1
+
+
+def _paths_hash(label_paths):
+    return hashlib.sha1('\n'.join(label_paths).encode('utf-8')).hexdigest()
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def compile_label_index(filename, label_files):
+    """
+    Parse every label file once and write them to the label index `filename`
+    :type label_files: OrderedDict dataset name -> label files
+    """
+    offsets = [0]
+    present = []
+    rows = []
+    datasets = []
+    for ds, label_paths in label_files.items():
+        max_index = -1
+        for lp in label_paths:
+            if not os.path.isfile(lp):
+                present.append(0)
+                offsets.append(offsets[-1])
+                continue
+            lb = np.loadtxt(lp)
+            # track ids as counted by count_track_ids, rows as parsed by get_data
+            if len(lb) > 0:
+                max_index = max(max_index, lb[1] if len(lb.shape) < 2 else np.max(lb[:, 1]))
+            lb = lb.astype(np.float32).reshape(-1, 6)
+            present.append(1)
+            rows.append(lb)
+            offsets.append(offsets[-1] + len(lb))
+        datasets.append({'name': ds, 'num_files': len(label_paths), 'tid_num': float(max_index + 1),
+                         'paths_hash': _paths_hash(label_paths)})
+
+    offsets = np.asarray(offsets, dtype=np.int64)
+    present = np.asarray(present, dtype=np.uint8)
+    rows = np.concatenate(rows) if len(rows) > 0 else np.zeros((0, 6), dtype=np.float32)
+
+    header = {'datasets': datasets, 'num_files': len(present), 'num_rows': len(rows)}
+    # array offsets depend on the header size, which depends on the offsets
+    header_size = 0
+    while True:
+        start = _aligned(len(MAGIC) + 8 + header_size)
+        header['offsets_start'] = start
+        header['present_start'] = _aligned(start + offsets.nbytes)
+        header['rows_start'] = _aligned(header['present_start'] + present.nbytes)
+        encoded = json.dumps(header).encode('utf-8')
+        if len(encoded) == header_size:
+            break
+        header_size = len(encoded)
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(encoded)).tobytes())
+        f.write(encoded)
+        for name, array in (('offsets_start', offsets), ('present_start', present), ('rows_start', rows)):
+            f.write(b'\0' * (header[name] - f.tell()))
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_filename, filename)
+
+
+class LabelIndex(object):
+    """Memory-mapped, read-only view of a label index file"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._open()
+
+    def _open(self):
+        with open(self.filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a label index'.format(self.filename))
+            header_size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(f.read(header_size).decode('utf-8'))
+        n, m = self.header['num_files'], self.header['num_rows']
+        self.offsets = np.memmap(self.filename, dtype=np.int64, mode='r',
+                                 offset=self.header['offsets_start'], shape=(n + 1, ))
+        self.present = np.memmap(self.filename, dtype=np.uint8, mode='r',
+                                 offset=self.header['present_start'], shape=(n, )) if n > 0 else np.zeros(0, np.uint8)
+        self.rows = np.memmap(self.filename, dtype=np.float32, mode='r',
+                              offset=self.header['rows_start'], shape=(m, 6)) if m > 0 else np.zeros((0, 6), np.float32)
+
+    def __getstate__(self):
+        # workers map the file again instead of receiving a copy of it
+        return {'filename': self.filename}
+
+    def __setstate__(self, state):
+        self.filename = state['filename']
+        self._open()
+
+    @property
+    def tid_num(self):
+        """OrderedDict dataset name -> largest track id + 1"""
+        return OrderedDict((ds['name'], ds['tid_num']) for ds in self.header['datasets'])
+
+    def matches(self, label_files):
+        """True if the index holds exactly the files of `label_files` in this order"""
+        datasets = self.header['datasets']
+        if [ds['name'] for ds in datasets] != list(label_files.keys()):
+            return False
+        return all(ds['num_files'] == len(label_paths) and ds['paths_hash'] == _paths_hash(label_paths)
+                   for ds, label_paths in zip(datasets, label_files.values()))
+
+    def __len__(self):
+        return self.header['num_files']
+
+    def __getitem__(self, idx):
+        """:return: Nx6 float32 labels of file `idx`, None if it has no label file"""
+        if not self.present[idx]:
+            return None
+        return np.array(self.rows[self.offsets[idx]:self.offsets[idx + 1]])
+
+
+def load_label_index(dirname, label_files):
+    """
+    Open the label index of `label_files` in the directory `dirname`, named
+    after the hash of the label paths so every file list gets its own. It is
+    compiled first if it does not exist yet.
+    """
+    key = _paths_hash(['{}:{}'.format(ds, _paths_hash(label_paths)) for ds, label_paths in label_files.items()])
+    filename = osp.join(dirname, '{}.labels'.format(key[:16]))
+    if os.path.isfile(filename):
+        index = LabelIndex(filename)
+        if index.matches(label_files):
+            return index
+    print('compiling label index {}'.format(filename))
+    if not osp.isdir(dirname):
+        os.makedirs(dirname)
+    compile_label_index(filename, label_files)
+    return LabelIndex(filename)
@@ -0,0 +1,189 @@
+import json
+import mmap
+import os
+import os.path as osp
+
+import cv2
+import numpy as np
+import torch
+import torch.utils.data
+
+from .label_index import LabelIndex, compile_label_index, _paths_hash
+
+
+"""
+Image shards pack the encoded images of a data config, as they are on disk,
+into a few large files written sequentially, next to a label index of their
+labels. A shard directory holds
+
+    shard-00000.bin ...   encoded images, back to back
+    images.npy            int64 (num_files, 3): shard, offset, length of every image
+    labels.index          label index of the label files, see label_index.py
+    shards.json           datasets (name, number of files, hash of the image
+                          paths), shard file names
+
+images.npy and the label index are in the order of the datasets of the config
+and of their file lists. The images are written to the shards in a seeded
+random order instead, so every shard holds a random sample of all datasets.
+"""
+SHARD_SIZE = 1 << 30
+
+
+class ShardWriter(object):
+    """Appends encoded images to shard files of about `shard_size` bytes in `dirname`"""
+
+    def __init__(self, dirname, shard_size=SHARD_SIZE):
+        if not osp.isdir(dirname):
+            os.makedirs(dirname)
+        self.dirname = dirname
+        self.shard_size = shard_size
+        self.shards = []
+        self.f = None
+
+    def write(self, data):
+        """:return: shard, offset, length of `data`"""
+        if self.f is None or self.f.tell() + len(data) > self.shard_size and self.f.tell() > 0:
+            if self.f is not None:
+                self.f.close()
+            self.shards.append('shard-{:05d}.bin'.format(len(self.shards)))
+            self.f = open(osp.join(self.dirname, self.shards[-1]), 'wb')
+        location = (len(self.shards) - 1, self.f.tell(), len(data))
+        self.f.write(data)
+        return location
+
+    def close(self):
+        """:return: shard file names"""
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        return self.shards
+
+
+class ShardReader(object):
+    """
+    Random-access reads of encoded images in shard files. Shards are
+    memory-mapped when first read, by each data loader worker separately.
+    """
+
+    def __init__(self, dirname, shards, locations):
+        """
+        :type shards: list of shard file names in `dirname`
+        :type locations: np.ndarray, Nx3 shard, offset, length of every image
+        """
+        self.dirname = dirname
+        self.shards = shards
+        self.locations = locations
+        self._maps = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_maps'] = {}
+        return state
+
+    def _map(self, shard):
+        if shard not in self._maps:
+            with open(osp.join(self.dirname, self.shards[shard]), 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(m, 'madvise'):
+                m.madvise(mmap.MADV_WILLNEED)
+            self._maps[shard] = m
+        return self._maps[shard]
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __getitem__(self, idx):
+        """:return: encoded bytes of image `idx`"""
+        shard, offset, length = (int(v) for v in self.locations[idx])
+        return self._map(shard)[offset:offset + length]
+
+    def imread(self, idx):
+        """:return: BGR image `idx`, as cv2.imread of the original file"""
+        return cv2.imdecode(np.frombuffer(self[idx], dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def shard_of(self):
+        """:return: shard of every image"""
+        return self.locations[:, 0]
+
+
+def paths_header(img_files):
+    """Header entries of the datasets of `img_files`, checked by paths_match"""
+    return [{'name': ds, 'num_files': len(img_paths), 'paths_hash': _paths_hash(img_paths)}
+            for ds, img_paths in img_files.items()]
+
+
+def paths_match(datasets, img_files):
+    """True if the `datasets` header entries list exactly the images of `img_files` in this order"""
+    if [ds['name'] for ds in datasets] != list(img_files.keys()):
+        return False
+    return all(ds['num_files'] == len(img_paths) and ds['paths_hash'] == _paths_hash(img_paths)
+               for ds, img_paths in zip(datasets, img_files.values()))
+
+
+def write_shards(dirname, img_files, label_files, shard_size=SHARD_SIZE, seed=0):
+    """
+    :type img_files: OrderedDict dataset name -> image files
+    :type label_files: OrderedDict dataset name -> label files
+    :type shard_size: int, bytes after which a new shard is started
+    :type seed: int, seed of the order the images are written in
+    """
+    img_paths = [img_path for paths in img_files.values() for img_path in paths]
+    writer = ShardWriter(dirname, shard_size)
+    locations = np.zeros((len(img_paths), 3), dtype=np.int64)
+    for i in np.random.RandomState(seed).permutation(len(img_paths)):
+        with open(img_paths[i], 'rb') as img_file:
+            locations[i] = writer.write(img_file.read())
+    shards = writer.close()
+
+    np.save(osp.join(dirname, 'images.npy'), locations)
+    compile_label_index(osp.join(dirname, 'labels.index'), label_files)
+    # written last, a shard directory without it is incomplete
+    with open(osp.join(dirname, 'shards.json'), 'w') as f:
+        json.dump({'datasets': paths_header(img_files), 'shards': shards}, f)
+
+
+class ImageShards(ShardReader):
+    """Images and labels of a shard directory written by write_shards"""
+
+    def __init__(self, dirname):
+        with open(osp.join(dirname, 'shards.json'), 'r') as f:
+            self.header = json.load(f)
+        super(ImageShards, self).__init__(dirname, self.header['shards'],
+                                          np.load(osp.join(dirname, 'images.npy')))
+        self.labels = LabelIndex(osp.join(dirname, 'labels.index'))
+
+    def matches(self, img_files):
+        """True if the shards hold exactly the images of `img_files` in this order"""
+        return paths_match(self.header['datasets'], img_files)
+
+
+def load_image_shards(dirname, img_files):
+    """Open the shards of `dirname`, which must hold the images of `img_files`"""
+    shards = ImageShards(dirname)
+    if not shards.matches(img_files):
+        raise ValueError('{} holds the images of another file list, run gen_shards.py '
+                         'with this data config'.format(dirname))
+    return shards
+
+
+class ShardSampler(torch.utils.data.Sampler):
+    """
+    Shuffles the order of the shards and the images within each shard, so an
+    epoch reads one shard after the other rather than seeking over all of
+    them. As write_shards fills the shards in random order, each shard is a
+    random sample of the whole dataset, but a batch still only mixes images
+    of one shard, and the reads within a shard are random, not sequential.
+    """
+
+    def __init__(self, shard_of):
+        self.shards = [np.flatnonzero(shard_of == shard).tolist() for shard in np.unique(shard_of)]
+        self.num_samples = len(shard_of)
+
+    def __iter__(self):
+        for shard in torch.randperm(len(self.shards)).tolist():
+            indices = self.shards[shard]
+            for i in torch.randperm(len(indices)).tolist():
+                yield indices[i]
+
+    def __len__(self):
+        return self.num_samples
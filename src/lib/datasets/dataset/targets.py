@@ -0,0 +1,64 @@
+import numpy as np
+
+from utils.image import gaussian_radius, draw_umich_gaussian, draw_msra_gaussian
+
+
+def encode_targets(labels, output_h, output_w, max_objs, num_classes=1, ltrb=True, mse_loss=False):
+    """
+    Training targets of one image, computed for all objects at once.
+    Identical to encoding the objects one by one in float32 as
+    JointDataset did; only the heatmap is still drawn object by object,
+    from cached kernels.
+    :type labels: np.ndarray, Nx6 float32 class, track id, normalized cx, cy, w, h
+    :return: dict hm, reg_mask, ind, wh, reg, ids, bbox
+    """
+    hm = np.zeros((num_classes, output_h, output_w), dtype=np.float32)
+    wh = np.zeros((max_objs, 4 if ltrb else 2), dtype=np.float32)
+    reg = np.zeros((max_objs, 2), dtype=np.float32)
+    ind = np.zeros((max_objs, ), dtype=np.int64)
+    reg_mask = np.zeros((max_objs, ), dtype=np.uint8)
+    ids = np.zeros((max_objs, ), dtype=np.int64)
+    bbox_xys = np.zeros((max_objs, 4), dtype=np.float32)
+
+    if len(labels) > 0:
+        cx = labels[:, 2] * output_w
+        cy = labels[:, 3] * output_h
+        w = labels[:, 4] * output_w
+        h = labels[:, 5] * output_h
+        keep = np.flatnonzero((h > 0) & (w > 0))
+        cx, cy, w, h = cx[keep], cy[keep], w[keep], h[keep]
+
+        amodal_x1 = cx - w / 2.
+        amodal_y1 = cy - h / 2.
+        amodal_x2 = amodal_x1 + w
+        amodal_y2 = amodal_y1 + h
+        cx = np.clip(cx, 0, output_w - 1)
+        cy = np.clip(cy, 0, output_h - 1)
+        x1 = cx - w / 2
+        y1 = cy - h / 2
+
+        if mse_loss:
+            radii = np.full(len(keep), 6, dtype=np.int64)
+        else:
+            radii = gaussian_radius((np.ceil(h).astype(np.int64), np.ceil(w).astype(np.int64)))
+            radii = np.maximum(0, radii.astype(np.int64))
+        ct = np.stack([cx, cy], axis=1)
+        ct_int = ct.astype(np.int32)
+        cls_ids = labels[keep, 0].astype(np.int64)
+        for cls_id, center, radius in zip(cls_ids, ct_int, radii.tolist()):
+            if mse_loss:
+                draw_msra_gaussian(hm[cls_id], center, radius)
+            else:
+                draw_umich_gaussian(hm[cls_id], center, radius)
+
+        if ltrb:
+            wh[keep] = np.stack([cx - amodal_x1, cy - amodal_y1, amodal_x2 - cx, amodal_y2 - cy], axis=1)
+        else:
+            wh[keep] = np.stack([1. * w, 1. * h], axis=1)
+        ind[keep] = ct_int[:, 1] * output_w + ct_int[:, 0]
+        reg[keep] = ct - ct_int
+        reg_mask[keep] = 1
+        ids[keep] = labels[keep, 1]
+        bbox_xys[keep] = np.stack([x1, y1, x1 + w, y1 + h], axis=1)
+
+    return {'hm': hm, 'reg_mask': reg_mask, 'ind': ind, 'wh': wh, 'reg': reg, 'ids': ids, 'bbox': bbox_xys}
@@ -0,0 +1,148 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .decode import mot_decode
+from .utils import _tranpose_and_gather_feat
+
+
+"""Architectures export_onnx supports, the others need the DCNv2 extension"""
+ONNX_ARCHS = ('dlav0', 'dlaconv', 'hrnet')
+
+
+class TrackingNet(nn.Module):
+    """
+    Backbone, heads and decoding of JDETracker in one module, mapping an
+    input blob to the mot_decode detections and their gathered embeddings.
+    """
+
+    def __init__(self, model, K=500, ltrb=True, reg_offset=True):
+        super(TrackingNet, self).__init__()
+        self.model = model
+        self.K = K
+        self.ltrb = ltrb
+        self.reg_offset = reg_offset
+
+    def forward(self, x):
+        output = self.model(x)[-1]
+        hm = output['hm'].sigmoid()
+        id_feature = F.normalize(output['id'], dim=1)
+        reg = output['reg'] if self.reg_offset else None
+        dets, inds = mot_decode(hm, output['wh'], reg=reg, ltrb=self.ltrb, K=self.K)
+        id_feature = _tranpose_and_gather_feat(id_feature, inds)
+        return dets, id_feature
+
+
+class HeadOutputs(nn.Module):
+    """Network outputs of the last stack as a tuple, in the order of `heads`"""
+
+    def __init__(self, model, heads):
+        super(HeadOutputs, self).__init__()
+        self.model = model
+        self.heads = list(heads)
+
+    def forward(self, x):
+        output = self.model(x)[-1]
+        return tuple(output[head] for head in self.heads)
+
+
+def export_meta(opt):
+    """Settings an exported model is fixed to"""
+    return {'arch': opt.arch, 'img_size': list(opt.img_size), 'K': opt.K,
+            'ltrb': bool(opt.ltrb), 'reg_offset': bool(opt.reg_offset),
+            'reid_dim': opt.reid_dim, 'down_ratio': opt.down_ratio}
+
+
+def export_torchscript(model, opt, filename, qengine=None):
+    """
+    Trace `model` on opt.device with its decoding for inputs of opt.img_size
+    and save it to `filename`. The traced graph is specialized to that input
+    size and to batches of one frame. `qengine` marks models quantized for
+    that engine, which only run on the CPU.
+    """
+    net = TrackingNet(model, K=opt.K, ltrb=opt.ltrb, reg_offset=opt.reg_offset).eval()
+    width, height = opt.img_size
+    x = torch.zeros(1, 3, height, width, device=opt.device)
+    with torch.no_grad():
+        traced = torch.jit.trace(net, x, check_trace=False)
+    meta = export_meta(opt)
+    meta['int8'] = qengine is not None
+    meta['qengine'] = qengine
+    torch.jit.save(traced, filename, _extra_files={'meta.json': json.dumps(meta)})
+    return traced
+
+
+def load_torchscript(filename, device):
+    """
+    Load a model saved by export_torchscript, without the networks package
+    :return: traced module, dict of the settings it was exported with
+    """
+    extra_files = {'meta.json': ''}
+    model = torch.jit.load(filename, map_location=device, _extra_files=extra_files)
+    model.eval()
+    return model, json.loads(extra_files['meta.json'])
+
+
+def export_onnx(model, opt, filename, opset_version=17):
+    """
+    Export the head outputs of `model` on opt.device for inputs of opt.img_size
+    to an ONNX graph with input `input` and outputs named after the heads
+    (hm, wh, id, reg). The batch size is left dynamic.
+    """
+    import onnx
+
+    arch = opt.arch[:opt.arch.find('_')] if '_' in opt.arch else opt.arch
+    if arch not in ONNX_ARCHS:
+        raise ValueError('cannot export {} to ONNX, supported are {}'.format(opt.arch, ', '.join(ONNX_ARCHS)))
+    heads = list(opt.heads)
+    net = HeadOutputs(model, heads).eval()
+    width, height = opt.img_size
+    x = torch.zeros(1, 3, height, width, device=opt.device)
+    dynamic_axes = {name: {0: 'batch'} for name in ['input'] + heads}
+    with torch.no_grad():
+        torch.onnx.export(net, x, filename, input_names=['input'], output_names=heads,
+                          dynamic_axes=dynamic_axes, opset_version=opset_version)
+
+    graph = onnx.load(filename)
+    prop = graph.metadata_props.add()
+    prop.key, prop.value = 'meta.json', json.dumps(export_meta(opt))
+    onnx.save(graph, filename)
+
+
+class OnnxModel(object):
+    """
+    ONNX Runtime session of a graph saved by export_onnx, called like the
+    networks: an input blob in, a list of one dict of head outputs out.
+    """
+
+    def __init__(self, filename, device, num_threads=0, providers=('CPUExecutionProvider',)):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(filename, options, providers=list(providers))
+        self.device = device
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        self.meta = json.loads(self.session.get_modelmeta().custom_metadata_map['meta.json'])
+
+    def __call__(self, x):
+        x = x.detach().cpu().numpy().astype('float32')
+        outputs = self.session.run(self.output_names, {self.input_name: x})
+        return [{name: torch.from_numpy(output).to(self.device)
+                 for name, output in zip(self.output_names, outputs)}]
+
+
+def load_onnx(filename, device, num_threads=0):
+    """
+    Load a graph saved by export_onnx into ONNX Runtime on the CPU
+    :return: OnnxModel, dict of the settings it was exported with
+    """
+    model = OnnxModel(filename, device, num_threads=num_threads)
+    return model, model.meta
@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+def _fuse_traced(model):
+    """
+    Fold every BatchNorm2d whose input is the output of a Conv2d used by
+    nothing else into that convolution, on the torch.fx graph of `model`.
+    Modules the traced forward does not call are left out of the result.
+    """
+    traced = torch.fx.symbolic_trace(model)
+    modules = dict(traced.named_modules())
+    for node in list(traced.graph.nodes):
+        if node.op != 'call_module' or not isinstance(modules[node.target], nn.BatchNorm2d):
+            continue
+        conv_node = node.args[0]
+        if not isinstance(conv_node, torch.fx.Node) or conv_node.op != 'call_module' or \
+                not isinstance(modules[conv_node.target], nn.Conv2d) or len(conv_node.users) > 1:
+            continue
+        bn = modules[node.target]
+        if not bn.track_running_stats:
+            continue
+        parent_name, _, name = conv_node.target.rpartition('.')
+        fused = fuse_conv_bn_eval(modules[conv_node.target], bn)
+        setattr(modules[parent_name] if parent_name else traced, name, fused)
+        modules[conv_node.target] = fused
+        node.replace_all_uses_with(conv_node)
+        traced.graph.erase_node(node)
+    traced.graph.lint()
+    return torch.fx.GraphModule(traced, traced.graph)
+
+
+def _fuse_sequential(model):
+    """Fold BatchNorm2d into the Conv2d before it within nn.Sequential blocks"""
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        names = list(module._modules.keys())
+        for conv_name, bn_name in zip(names[:-1], names[1:]):
+            conv, bn = module._modules[conv_name], module._modules[bn_name]
+            if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d) and bn.track_running_stats:
+                module._modules[conv_name] = fuse_conv_bn_eval(conv, bn)
+                module._modules[bn_name] = nn.Identity()
+    return model
+
+
+def fuse_conv_bn(model):
+    """
+    Copy of `model` in eval mode with its batch norms folded into the
+    preceding convolutions. Networks torch.fx cannot trace, like the DCN
+    ones, only get the conv/bn pairs of their nn.Sequential blocks fused.
+    """
+    model = copy.deepcopy(model).eval()
+    try:
+        return _fuse_traced(model)
+    except Exception:
+        return _fuse_sequential(model)
+
+
+def prepare_inference(model, channels_last=False):
+    """
+    Compact a loaded network for inference: fuse conv/bn, drop the gradient
+    state of the parameters and, with `channels_last`, store weights NHWC.
+    """
+    model = fuse_conv_bn(model)
+    for param in model.parameters():
+        param.requires_grad_(False)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+
+def max_output_error(model, other, x, heads=('hm', 'wh', 'id')):
+    """
+    :return: dict head -> max abs difference of the outputs of `other` to
+             those of `model` for `x`, relative to their largest magnitude (at least 1)
+    """
+    with torch.no_grad():
+        output = model(x)[-1]
+        other_output = other(x)[-1]
+    return {head: ((output[head] - other_output[head]).abs().max() /
+                   output[head].abs().max().clamp(min=1)).item() for head in heads}
@@ -0,0 +1,35 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+"""Architectures quantize_int8 supports, FX cannot trace the DCNv2 layers of the others"""
+QUANT_ARCHS = ('dlav0', 'dlaconv', 'hrnet')
+
+
+def quantize_int8(model, calib_blobs, backend='x86'):
+    """
+    Post-training static int8 quantization of a network on the CPU.
+    The convolutions of backbone and heads are quantized with activation
+    ranges observed over `calib_blobs`, the network outputs stay float.
+    The quantized engine `backend` has to be active when the model runs.
+    :type calib_blobs: iterable of Nx3xHxW float input blobs
+    :return: quantized copy of `model`
+    """
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+    prepared = None
+    with torch.no_grad():
+        for blob in calib_blobs:
+            blob = blob.cpu()
+            if prepared is None:
+                prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs=(blob, ))
+            prepared(blob)
+    if prepared is None:
+        raise ValueError('no calibration frames')
+    return convert_fx(prepared)
@@ -114,17 +114,136 @@ class opts(object):
     self.parser.add_argument('--nms_thres', type=float, default=0.4, help='iou thresh for nms')
     self.parser.add_argument('--track_buffer', type=int, default=30, help='tracking buffer')
     self.parser.add_argument('--min-box-area', type=float, default=100, help='filter out tiny boxes')
+    self.parser.add_argument('--match_thres', type=float, default=0.4,
+                             help='max embedding distance of the first association')
+    self.parser.add_argument('--iou_thres', type=float, default=0.5,
+                             help='max iou distance of the second association')
+    self.parser.add_argument('--unconfirmed_thres', type=float, default=0.7,
+                             help='max iou distance matching unconfirmed tracks')
+    self.parser.add_argument('--adaptive_res', action='store_true',
+                             help='pick the input size of every stream from --adaptive_sizes '
+                                  'by its recent detection counts and box sizes.')
+    self.parser.add_argument('--adaptive_sizes', type=str, default='576x320,864x480,1088x608',
+                             help='comma separated WxH input sizes of --adaptive_res')
+    self.parser.add_argument('--adaptive_min_height', type=float, default=32,
+                             help='input pixels the small detections should keep with --adaptive_res')
+    self.parser.add_argument('--adaptive_dense', type=float, default=30,
+                             help='mean detections per frame from which --adaptive_res uses the largest size')
+    self.parser.add_argument('--adaptive_window', type=int, default=30,
+                             help='frames --adaptive_res decides on, and at least between two switches')
+    self.parser.add_argument('--detect_interval', type=int, default=1,
+                             help='run the detector on every k-th frame and only advance the tracks '
+                                  'by the Kalman filter in between. the largest k with --latency_budget.')
+    self.parser.add_argument('--latency_budget', type=float, default=0,
+                             help='ms per frame; pick the detector interval up to --detect_interval '
+                                  'adaptively to meet it. 0 for a fixed interval.')
+    self.parser.add_argument('--sparse_assoc', action='store_true',
+                             help='only score track/detection pairs found through a spatial '
+                                  'grid index. Matches are the same as the dense association.')
     self.parser.add_argument('--input-video', type=str,
                              default='../videos/MOT16-03.mp4',
                              help='path to the input video')
     self.parser.add_argument('--output-format', type=str, default='video', help='video or text')
+    self.parser.add_argument('--prefetch_frames', type=int, default=4,
+                             help='frames decoded ahead of tracking on background threads. '
+                                  '0 to decode on the tracking thread.')
+    self.parser.add_argument('--prefetch_workers', type=int, default=2,
+                             help='decoding threads for image sequences. Videos use one.')
     self.parser.add_argument('--output-root', type=str, default='../demos', help='expected output root path')
+    self.parser.add_argument('--results_chunk', type=int, default=50,
+                             help='frames of tracking results buffered per write.')
+    self.parser.add_argument('--results_fsync', action='store_true',
+                             help='fsync the results file after every write.')
+    self.parser.add_argument('--results_rotate_mb', type=float, default=0,
+                             help='start a new results file after this many MB. 0 to disable.')
+    self.parser.add_argument('--results_rotate_min', type=float, default=0,
+                             help='start a new results file after this many minutes. 0 to disable.')
+    self.parser.add_argument('--results_binary', action='store_true',
+                             help='write results as numpy record batches (.npy) instead of text.')
+    self.parser.add_argument('--eval_workers', type=int, default=0,
+                             help='processes tracking and evaluating sequences in parallel, '
+                                  'each loading the model once. 0 to run them in series.')
+    self.parser.add_argument('--gt_cache_dir', type=str, default='../exp/gt_cache',
+                             help='directory keeping parsed gt files for evaluation. '
+                                  'empty to parse them on every run.')
+
+    # detection cache and parameter sweep
+    self.parser.add_argument('--det_cache_dir', type=str, default='../exp/det_cache',
+                             help='directory of the per sequence detection caches')
+    self.parser.add_argument('--save_det_cache', action='store_true',
+                             help='save the detections and embeddings of every tracked frame '
+                                  'to --det_cache_dir.')
+    self.parser.add_argument('--det_cache_fp16', action='store_true',
+                             help='store cached embeddings as float16.')
+    self.parser.add_argument('--replay', action='store_true',
+                             help='track from the detection caches in --det_cache_dir '
+                                  'instead of running the model.')
+    self.parser.add_argument('--sweep_workers', type=int, default=4,
+                             help='processes replaying the sweep configurations')
+    self.parser.add_argument('--sweep_conf_thres', type=str, default='',
+                             help='comma separated conf_thres values to sweep, empty for --conf_thres only.')
+    self.parser.add_argument('--sweep_track_buffer', type=str, default='',
+                             help='comma separated track_buffer values to sweep, empty for --track_buffer only.')
+    self.parser.add_argument('--sweep_match_thres', type=str, default='',
+                             help='comma separated match_thres values to sweep, empty for --match_thres only.')
+    self.parser.add_argument('--sweep_iou_thres', type=str, default='',
+                             help='comma separated iou_thres values to sweep, empty for --iou_thres only.')
+    self.parser.add_argument('--sweep_unconfirmed_thres', type=str, default='',
+                             help='comma separated unconfirmed_thres values to sweep, empty for --unconfirmed_thres only.')
+    self.parser.add_argument('--sweep_min_box_area', type=str, default='',
+                             help='comma separated min_box_area values to sweep, empty for --min-box-area only.')
+
+    # inference backend and export
+    self.parser.add_argument('--not_fuse_bn', action='store_true',
+                             help='keep batch norms as separate ops instead of folding them '
+                                  'into the convolutions when loading the model for tracking.')
+    self.parser.add_argument('--channels_last', action='store_true',
+                             help='run the tracking network in channels last memory format.')
+    self.parser.add_argument('--backend', default='pytorch', choices=['pytorch', 'torchscript', 'onnxruntime'],
+                             help='pytorch runs the network of --arch, torchscript and onnxruntime '
+                                  '(on the CPU) run a --load_model saved by export.py or quantize.py.')
+    self.parser.add_argument('--onnx_threads', type=int, default=0,
+                             help='intra op threads of onnxruntime. 0 for its default.')
+    self.parser.add_argument('--export_format', default='torchscript', choices=['torchscript', 'onnx'],
+                             help='format export.py writes. onnx graphs hold the head outputs '
+                                  'and support dlav0, dlaconv and hrnet.')
+    self.parser.add_argument('--export_path', type=str, default='',
+                             help='file export.py writes to. empty for --load_model '
+                                  'with the input size and format appended.')
+    self.parser.add_argument('--quant_seq', type=str, default='',
+                             help='sequence directory (with img1 and gt) quantize.py calibrates on '
+                                  'and compares the int8 and fp32 MOTA/IDF1 on. '
+                                  'supports --arch dlav0, dlaconv and hrnet.')
+    self.parser.add_argument('--calib_frames', type=int, default=64,
+                             help='frames of --quant_seq, evenly spaced, observed for calibration.')
 
     # mot
     self.parser.add_argument('--data_cfg', type=str,
                              default='../src/lib/cfg/data.json',
                              help='load data from cfg')
     self.parser.add_argument('--data_dir', type=str, default='/data/yfzhang/MOT/JDE')
+    self.parser.add_argument('--label_index_dir', type=str, default='',
+                             help='directory of label indexes, which pack all labels_with_ids files of a '
+                                  'dataset mix into one file, compiled on first use. empty to read '
+                                  'the text files. remove them after regenerating labels.')
+    self.parser.add_argument('--shard_dir', type=str, default='',
+                             help='directory of image shards written by gen_shards.py for --data_cfg, '
+                                  'read instead of the image and label files. training then '
+                                  'shuffles shard by shard.')
+    self.parser.add_argument('--shard_size', type=int, default=1024,
+                             help='MB per shard written by gen_shards.py and gen_image_cache.py.')
+    self.parser.add_argument('--image_cache_dir', type=str, default='',
+                             help='directory of images of --data_cfg already letterboxed to the input '
+                                  'size, written by gen_image_cache.py, read instead of the images.')
+    self.parser.add_argument('--image_cache_format', default='jpg', choices=['jpg', 'raw'],
+                             help='jpg: smaller, lossy | raw: uint8 arrays, identical to '
+                                  'letterboxing the original images.')
+    self.parser.add_argument('--image_cache_quality', type=int, default=95,
+                             help='JPEG quality of the jpg image cache.')
+    self.parser.add_argument('--device_augment', action='store_true',
+                             help='data loader workers only letterbox the images, the HSV, affine and '
+                                  'flip augmentation and the targets are computed per batch on the '
+                                  'training device.')
 
     # loss
     self.parser.add_argument('--mse_loss', action='store_true',
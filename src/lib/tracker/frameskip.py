@@ -0,0 +1,60 @@
+import math
+
+
+class FrameSkipScheduler(object):
+    """
+    Decides on which frames to run the detector, the frames in between are
+    advanced with JDETracker.predict_only.
+
+    Without a latency budget the detector runs on every `max_interval`-th
+    frame. With a budget (seconds per frame) the interval k is the smallest
+    one whose average frame time over a cycle of one detector frame and k - 1
+    predicted frames fits the budget, from running averages of both times,
+    capped at `max_interval`.
+    """
+
+    def __init__(self, max_interval, budget=0., momentum=0.9):
+        self.max_interval = max(int(max_interval), 1)
+        self.budget = budget
+        self.momentum = momentum
+        self.interval = self.max_interval if budget <= 0 else 1
+        self.since_detection = None
+        self.detect_time = None
+        self.predict_time = None
+        self.num_detected = 0
+        self.num_frames = 0
+
+    def detect_next(self):
+        """:return: True if the detector should run on the next frame"""
+        return self.since_detection is None or self.since_detection + 1 >= self.interval
+
+    def _average(self, average, elapsed):
+        if average is None:
+            return elapsed
+        return self.momentum * average + (1 - self.momentum) * elapsed
+
+    def record(self, detected, elapsed):
+        """
+        :type detected: bool, the detector ran on the frame
+        :type elapsed: float, seconds the frame took
+        """
+        self.num_frames += 1
+        if detected:
+            self.num_detected += 1
+            self.since_detection = 0
+            self.detect_time = self._average(self.detect_time, elapsed)
+        else:
+            self.since_detection += 1
+            self.predict_time = self._average(self.predict_time, elapsed)
+        if self.budget > 0:
+            self.interval = self.select()
+
+    def select(self):
+        """:return: detector interval meeting the latency budget"""
+        if self.detect_time is None or self.detect_time <= self.budget:
+            return 1
+        predict_time = self.predict_time or 0.
+        if self.budget <= predict_time:
+            return self.max_interval
+        k = int(math.ceil((self.detect_time - predict_time) / (self.budget - predict_time)))
+        return min(max(k, 1), self.max_interval)
@@ -3,6 +3,7 @@ import numpy as np
 import scipy
 import lap
 from scipy.spatial.distance import cdist
+from scipy.sparse.csgraph import connected_components
 
 from cython_bbox import bbox_overlaps as bbox_ious
 from tracking_utils import kalman_filter
@@ -92,8 +93,8 @@ def iou_distance(atracks, btracks):
 
 def embedding_distance(tracks, detections, metric='cosine'):
     """
-    :param tracks: list[STrack]
-    :param detections: list[BaseTrack]
+    :param tracks: list[STrack] | np.ndarray of smoothed track features
+    :param detections: list[BaseTrack] | np.ndarray of detection features
     :param metric:
     :return: cost_matrix np.ndarray
     """
@@ -101,24 +102,50 @@ def embedding_distance(tracks, detections, metric='cosine'):
     cost_matrix = np.zeros((len(tracks), len(detections)), dtype=np.float)
     if cost_matrix.size == 0:
         return cost_matrix
-    det_features = np.asarray([track.curr_feat for track in detections], dtype=np.float)
+    if isinstance(detections, np.ndarray):
+        det_features = np.asarray(detections, dtype=np.float64)
+    else:
+        det_features = np.asarray([track.curr_feat for track in detections], dtype=np.float64)
     #for i, track in enumerate(tracks):
         #cost_matrix[i, :] = np.maximum(0.0, cdist(track.smooth_feat.reshape(1,-1), det_features, metric))
-    track_features = np.asarray([track.smooth_feat for track in tracks], dtype=np.float)
+    if isinstance(tracks, np.ndarray):
+        track_features = np.asarray(tracks, dtype=np.float64)
+    else:
+        track_features = np.asarray([track.smooth_feat for track in tracks], dtype=np.float64)
     cost_matrix = np.maximum(0.0, cdist(track_features, det_features, metric))  # Nomalized features
     return cost_matrix
 
 
+def track_states(tracks):
+    """
+    :param tracks: list[STrack] | tuple(means, covariances)
+    :return: Nx8 means and Nx8x8 covariances
+    """
+    if isinstance(tracks, tuple):
+        return tracks
+    return np.asarray([track.mean for track in tracks]), np.asarray([track.covariance for track in tracks])
+
+
+def measurements_of(detections):
+    """
+    :param detections: list[STrack] | np.ndarray of (x, y, a, h) measurements
+    :return: Nx4 measurements
+    """
+    if isinstance(detections, np.ndarray):
+        return detections
+    return np.asarray([det.to_xyah() for det in detections])
+
+
 def gate_cost_matrix(kf, cost_matrix, tracks, detections, only_position=False):
     if cost_matrix.size == 0:
         return cost_matrix
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
-    measurements = np.asarray([det.to_xyah() for det in detections])
-    for row, track in enumerate(tracks):
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = np.inf
+    means, covariances = track_states(tracks)
+    measurements = measurements_of(detections)
+    gating_distance = kf.multi_gating_distance(
+        means, covariances, measurements, only_position)
+    cost_matrix[gating_distance > gating_threshold] = np.inf
     return cost_matrix
 
 
@@ -127,10 +154,193 @@ def fuse_motion(kf, cost_matrix, tracks, detections, only_position=False, lambda
         return cost_matrix
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
-    measurements = np.asarray([det.to_xyah() for det in detections])
-    for row, track in enumerate(tracks):
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position, metric='maha')
-        cost_matrix[row, gating_distance > gating_threshold] = np.inf
-        cost_matrix[row] = lambda_ * cost_matrix[row] + (1 - lambda_) * gating_distance
+    means, covariances = track_states(tracks)
+    measurements = measurements_of(detections)
+    gating_distance = kf.multi_gating_distance(
+        means, covariances, measurements, only_position, metric='maha')
+    cost_matrix[gating_distance > gating_threshold] = np.inf
+    cost_matrix[:] = lambda_ * cost_matrix + (1 - lambda_) * gating_distance
     return cost_matrix
+
+
+def _grid_cells(tlbrs, origin, cell_size, ncols):
+    """Enumerate the grid cells covered by every box as (cell key, box index) pairs."""
+    lo = np.floor((tlbrs[:, :2] - origin) / cell_size).astype(np.int64)
+    hi = np.floor((tlbrs[:, 2:] - origin) / cell_size).astype(np.int64)
+    nx = hi[:, 0] - lo[:, 0] + 1
+    ny = hi[:, 1] - lo[:, 1] + 1
+    counts = nx * ny
+    box_inds = np.repeat(np.arange(len(tlbrs)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = lo[box_inds, 0] + k % nx[box_inds]
+    cy = lo[box_inds, 1] + k // nx[box_inds]
+    return cy * ncols + cx, box_inds
+
+
+def box_pairs(atlbrs, btlbrs, cell_size=None):
+    """
+    Find every pair of boxes whose extents intersect, using a uniform grid
+    index instead of testing all len(a) x len(b) pairs
+    :type atlbrs: np.ndarray
+    :type btlbrs: np.ndarray
+
+    :rtype ia, ib np.ndarray
+    """
+    atlbrs = np.asarray(atlbrs, dtype=np.float64).reshape(-1, 4)
+    btlbrs = np.asarray(btlbrs, dtype=np.float64).reshape(-1, 4)
+    if len(atlbrs) == 0 or len(btlbrs) == 0:
+        return np.empty((0, ), dtype=int), np.empty((0, ), dtype=int)
+    if cell_size is None:
+        # degenerate boxes, like the points gate_pairs passes, would shrink the cells to a pixel
+        sizes = np.concatenate([atlbrs[:, 2:] - atlbrs[:, :2], btlbrs[:, 2:] - btlbrs[:, :2]])
+        sizes = sizes[sizes > 0]
+        cell_size = max(float(np.median(sizes)), 1.) if len(sizes) > 0 else 1.
+    origin = np.minimum(atlbrs[:, :2].min(0), btlbrs[:, :2].min(0))
+    right = max(atlbrs[:, 2].max(), btlbrs[:, 2].max())
+    ncols = int((right - origin[0]) // cell_size) + 1
+
+    akeys, ainds = _grid_cells(atlbrs, origin, cell_size, ncols)
+    bkeys, binds = _grid_cells(btlbrs, origin, cell_size, ncols)
+    order = np.argsort(bkeys, kind='stable')
+    bkeys, binds = bkeys[order], binds[order]
+
+    # join on the cell key
+    lo = np.searchsorted(bkeys, akeys, side='left')
+    counts = np.searchsorted(bkeys, akeys, side='right') - lo
+    ia = np.repeat(ainds, counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    ib = binds[np.repeat(lo, counts) + k]
+
+    pairs = np.unique(ia * len(btlbrs) + ib)
+    ia, ib = pairs // len(btlbrs), pairs % len(btlbrs)
+    hit = (atlbrs[ia, 0] <= btlbrs[ib, 2]) & (btlbrs[ib, 0] <= atlbrs[ia, 2]) & \
+          (atlbrs[ia, 1] <= btlbrs[ib, 3]) & (btlbrs[ib, 1] <= atlbrs[ia, 3])
+    return ia[hit], ib[hit]
+
+
+def sparse_iou_distance(atlbrs, btlbrs):
+    """
+    Compute IoU cost only for the pairs of boxes that overlap
+    :type atlbrs: np.ndarray
+    :type btlbrs: np.ndarray
+
+    :rtype ia, ib, cost np.ndarray
+    """
+    atlbrs = np.asarray(atlbrs, dtype=np.float64).reshape(-1, 4)
+    btlbrs = np.asarray(btlbrs, dtype=np.float64).reshape(-1, 4)
+    # bbox_ious counts the border pixel, so boxes up to one pixel apart overlap
+    ia, ib = box_pairs(atlbrs + [0, 0, 1, 1], btlbrs + [0, 0, 1, 1])
+    a, b = atlbrs[ia], btlbrs[ib]
+    iw = np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]) + 1
+    ih = np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]) + 1
+    ua = (a[:, 2] - a[:, 0] + 1) * (a[:, 3] - a[:, 1] + 1) + \
+         (b[:, 2] - b[:, 0] + 1) * (b[:, 3] - b[:, 1] + 1) - iw * ih
+    _ious = np.where((iw > 0) & (ih > 0), iw * ih / ua, 0.)
+    return ia, ib, 1 - _ious
+
+
+def gate_pairs(kf, tracks, detections, only_position=False):
+    """
+    Candidate (track, detection) pairs for the chi2 gate. The gate ellipse of a
+    track never reaches further than sqrt(chi2 * var) from its center along x
+    and y, so detections whose centers fall outside that rectangle are skipped.
+    :param tracks: list[STrack] | tuple(means, covariances)
+    :param detections: list[STrack] | np.ndarray of (x, y, a, h) measurements
+
+    :rtype ia, ib np.ndarray
+    """
+    gating_dim = 2 if only_position else 4
+    gating_threshold = kalman_filter.chi2inv95[gating_dim]
+    means, covariances = track_states(tracks)
+    measurements = measurements_of(detections)
+    if len(means) == 0 or len(measurements) == 0:
+        return np.empty((0, ), dtype=int), np.empty((0, ), dtype=int)
+    mean, covariance = kf.multi_project(means, covariances)
+    radius = np.sqrt(gating_threshold * covariance[:, [0, 1], [0, 1]])
+    gates = np.concatenate([mean[:, :2] - radius, mean[:, :2] + radius], axis=1)
+    centers = np.concatenate([measurements[:, :2], measurements[:, :2]], axis=1)
+    # cells as large as a typical gate, each gate then covers a handful of cells
+    return box_pairs(gates, centers, cell_size=max(float(np.median(2 * radius)), 1.))
+
+
+def sparse_embedding_distance(tracks, detections, ia, ib):
+    """
+    Cosine cost of the given (track, detection) pairs only
+    :param tracks: np.ndarray of smoothed track features
+    :param detections: np.ndarray of detection features
+
+    :rtype cost np.ndarray
+    """
+    track_features = np.asarray(tracks, dtype=np.float64)
+    det_features = np.asarray(detections, dtype=np.float64)
+    track_norm = np.linalg.norm(track_features, axis=1)
+    det_norm = np.linalg.norm(det_features, axis=1)
+    dot = np.einsum('ij,ij->i', track_features[ia], det_features[ib])
+    return np.maximum(0.0, 1 - dot / (track_norm[ia] * det_norm[ib]))
+
+
+def sparse_fuse_motion(kf, costs, ia, ib, tracks, detections, only_position=False, lambda_=0.98):
+    """
+    Sparse version of `fuse_motion`: gated pairs are dropped instead of set to inf
+    :rtype ia, ib, cost np.ndarray
+    """
+    gating_dim = 2 if only_position else 4
+    gating_threshold = kalman_filter.chi2inv95[gating_dim]
+    means, covariances = track_states(tracks)
+    measurements = measurements_of(detections)
+    if len(ia) == 0:
+        return ia, ib, costs
+    mean, covariance = kf.multi_project(means, covariances)
+    if only_position:
+        mean, covariance = mean[:, :2], covariance[:, :2, :2]
+        measurements = measurements[:, :2]
+    cholesky_factor = np.linalg.cholesky(covariance)
+    d = measurements[ib] - mean[ia]
+    z = kalman_filter.solve_lower_triangular(cholesky_factor[ia], d)
+    gating_distance = np.sum(z * z, axis=1)
+
+    keep = gating_distance <= gating_threshold
+    costs = lambda_ * costs[keep] + (1 - lambda_) * gating_distance[keep]
+    return ia[keep], ib[keep], costs
+
+
+def sparse_linear_assignment(ia, ib, costs, shape, thresh):
+    """
+    Solve the same problem as `linear_assignment` from candidate pairs only.
+    A pair dearer than `thresh` is never part of the optimum, so the remaining
+    bipartite graph splits into connected components solved one by one.
+    :type ia: np.ndarray
+    :type ib: np.ndarray
+    :type costs: np.ndarray
+    :type shape: tuple(int, int)
+    :type thresh: float
+    """
+    num_a, num_b = shape
+    keep = costs <= thresh
+    ia, ib, costs = ia[keep], ib[keep], costs[keep]
+
+    graph = scipy.sparse.coo_matrix((np.ones(len(ia)), (ia, num_a + ib)), shape=(num_a + num_b, num_a + num_b))
+    _, labels = connected_components(graph, directed=False)
+    comp = labels[ia]
+    order = np.argsort(comp, kind='stable')
+    ia, ib, costs, comp = ia[order], ib[order], costs[order], comp[order]
+    _, starts, sizes = np.unique(comp, return_index=True, return_counts=True)
+
+    # a component with one candidate pair is a match by itself
+    single = starts[sizes == 1]
+    matches = [np.stack([ia[single], ib[single]], axis=1)]
+    for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+        sl = slice(start, start + size)
+        rows, ri = np.unique(ia[sl], return_inverse=True)
+        cols, ci = np.unique(ib[sl], return_inverse=True)
+        cost_matrix = np.full((len(rows), len(cols)), np.inf)
+        cost_matrix[ri, ci] = costs[sl]
+        m, _, _ = linear_assignment(cost_matrix, thresh)
+        if len(m) > 0:
+            matches.append(np.stack([rows[m[:, 0]], cols[m[:, 1]]], axis=1))
+
+    matches = np.concatenate(matches).astype(int).reshape(-1, 2)
+    matches = matches[np.argsort(matches[:, 0])]
+    unmatched_a = np.setdiff1d(np.arange(num_a), matches[:, 0])
+    unmatched_b = np.setdiff1d(np.arange(num_b), matches[:, 1])
+    return matches, unmatched_a, unmatched_b
@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from datasets.dataset.jde import to_blob
+from .multitracker import JDETracker, load_tracking_model
+from .resolution import create_scheduler
+
+
+class MultiStreamTracker(object):
+    """
+    Tracks many video streams with a single model.
+
+    Streams register with `add_stream` and hand in frames with `submit`. Each
+    `step` stacks the latest pending frame of every stream into one batch, runs
+    one forward pass and splits the decoded `hm`/`wh`/`id`/`reg` outputs back to
+    the per-stream JDETracker states, which hold no model of their own.
+    Streams may join and leave at any time, also from other threads.
+    With --adaptive_res every stream has its own input size, see `input_size`.
+    """
+
+    def __init__(self, opt):
+        self.opt = opt
+        self.model = load_tracking_model(opt)
+        self.streams = OrderedDict()
+        # per stream ResolutionScheduler with --adaptive_res
+        self.schedulers = {}
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add_stream(self, stream_id, frame_rate=30):
+        with self.lock:
+            if stream_id in self.streams:
+                raise ValueError('Stream {} is already registered'.format(stream_id))
+            self.streams[stream_id] = JDETracker(self.opt, frame_rate=frame_rate, with_model=False)
+            if self.opt.adaptive_res:
+                self.schedulers[stream_id] = create_scheduler(self.opt)
+        return self.streams[stream_id]
+
+    def remove_stream(self, stream_id):
+        with self.lock:
+            self.pending.pop(stream_id, None)
+            self.schedulers.pop(stream_id, None)
+            return self.streams.pop(stream_id)
+
+    def input_size(self, stream_id):
+        """(width, height) the next frame of a stream should be letterboxed to"""
+        if stream_id in self.schedulers:
+            return self.schedulers[stream_id].size
+        return tuple(self.opt.img_size)
+
+    def submit(self, stream_id, img, img0):
+        """
+        Queue the next frame of a stream. A frame of the same stream that has
+        not been processed yet is replaced, so every step sees the latest one.
+        `img` is only read during the next step and must not be refilled before.
+        :type img: np.ndarray, 3xHxW float or HxWx3 uint8 letterboxed input as returned by the loaders
+        :type img0: np.ndarray, original BGR frame
+        """
+        with self.lock:
+            if stream_id not in self.streams:
+                raise KeyError('Unknown stream {}'.format(stream_id))
+            self.pending[stream_id] = (img, img0)
+
+    def step(self):
+        """
+        Run one batched forward over all pending frames
+        :return: dict stream_id -> list[STrack]
+        """
+        with self.lock:
+            pending, self.pending = self.pending, OrderedDict()
+
+        # frames of different input sizes cannot share a batch
+        groups = OrderedDict()
+        for stream_id, (img, img0) in pending.items():
+            groups.setdefault(img.shape, []).append((stream_id, img, img0))
+
+        results = OrderedDict()
+        for shape, frames in groups.items():
+            with self.lock:
+                # drop frames of streams that left while they were queued
+                frames = [(self.streams[stream_id], stream_id, img, img0)
+                          for stream_id, img, img0 in frames if stream_id in self.streams]
+            if len(frames) == 0:
+                continue
+            imgs = [img for _, _, img, _ in frames]
+            if imgs[0].dtype == np.uint8:
+                blob = to_blob(np.stack(imgs), self.opt.device)
+            else:
+                blob = torch.stack([torch.from_numpy(img) for img in imgs]).to(self.opt.device)
+            dets, id_feature = frames[0][0].infer(blob, self.model)
+
+            for i, (tracker, stream_id, _, img0) in enumerate(frames):
+                meta = tracker.get_meta(img0, blob.shape[2], blob.shape[3])
+                scheduler = self.schedulers.get(stream_id)
+                if scheduler is None:
+                    results[stream_id] = tracker.update_detections(dets[i:i + 1], id_feature[i], meta)
+                    continue
+                stream_dets = tracker.merge_outputs([tracker.post_process(dets[i:i + 1], meta)])[1]
+                scheduler.update(stream_dets[stream_dets[:, 4] > self.opt.conf_thres], img0.shape)
+                results[stream_id] = tracker.update_frame(stream_dets, id_feature[i])
+        return results
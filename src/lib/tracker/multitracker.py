@@ -1,6 +1,5 @@
 import numpy as np
 from numba import jit
-from collections import deque
 import itertools
 import os
 import os.path as osp
@@ -9,113 +8,77 @@ import torch
 import cv2
 import torch.nn.functional as F
 
-from models.model import create_model, load_model
 from models.decode import mot_decode
+from models.export import load_onnx, load_torchscript
+from models.fuse import prepare_inference, max_output_error
 from tracking_utils.utils import *
 from tracking_utils.log import logger
 from tracking_utils.kalman_filter import KalmanFilter
 from models import *
 from tracker import matching
 from .basetrack import BaseTrack, TrackState
+from .trackstore import TrackStore
 from utils.post_process import ctdet_post_process
 from utils.image import get_affine_transform
 from models.utils import _tranpose_and_gather_feat
 
 
 class STrack(BaseTrack):
-    shared_kalman = KalmanFilter()
-    def __init__(self, tlwh, score, temp_feat, buffer_size=30):
+    """
+    Thin view on one row of a TrackStore, kept for the public API.
+    A view is only valid until the next call of JDETracker.update.
+    """
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
 
-        # wait activate
-        self._tlwh = np.asarray(tlwh, dtype=np.float)
-        self.kalman_filter = None
-        self.mean, self.covariance = None, None
-        self.is_activated = False
+    @property
+    def mean(self):
+        return self._store.mean[self._row]
 
-        self.score = score
-        self.tracklet_len = 0
+    @property
+    def covariance(self):
+        return self._store.covariance[self._row]
 
-        self.smooth_feat = None
-        self.update_features(temp_feat)
-        self.features = deque([], maxlen=buffer_size)
-        self.alpha = 0.9
+    @property
+    def smooth_feat(self):
+        return self._store.smooth_feat[self._row]
 
-    def update_features(self, feat):
-        feat /= np.linalg.norm(feat)
-        self.curr_feat = feat
-        if self.smooth_feat is None:
-            self.smooth_feat = feat
-        else:
-            self.smooth_feat = self.alpha * self.smooth_feat + (1 - self.alpha) * feat
-        self.features.append(feat)
-        self.smooth_feat /= np.linalg.norm(self.smooth_feat)
+    @property
+    def curr_feat(self):
+        return self._store.curr_feat[self._row]
 
-    def predict(self):
-        mean_state = self.mean.copy()
-        if self.state != TrackState.Tracked:
-            mean_state[7] = 0
-        self.mean, self.covariance = self.kalman_filter.predict(mean_state, self.covariance)
+    @property
+    def score(self):
+        return self._store.score[self._row]
 
-    @staticmethod
-    def multi_predict(stracks):
-        if len(stracks) > 0:
-            multi_mean = np.asarray([st.mean.copy() for st in stracks])
-            multi_covariance = np.asarray([st.covariance for st in stracks])
-            for i, st in enumerate(stracks):
-                if st.state != TrackState.Tracked:
-                    multi_mean[i][7] = 0
-            multi_mean, multi_covariance = STrack.shared_kalman.multi_predict(multi_mean, multi_covariance)
-            for i, (mean, cov) in enumerate(zip(multi_mean, multi_covariance)):
-                stracks[i].mean = mean
-                stracks[i].covariance = cov
-
-    def activate(self, kalman_filter, frame_id):
-        """Start a new tracklet"""
-        self.kalman_filter = kalman_filter
-        self.track_id = self.next_id()
-        self.mean, self.covariance = self.kalman_filter.initiate(self.tlwh_to_xyah(self._tlwh))
-
-        self.tracklet_len = 0
-        self.state = TrackState.Tracked
-        if frame_id == 1:
-            self.is_activated = True
-        #self.is_activated = True
-        self.frame_id = frame_id
-        self.start_frame = frame_id
-
-    def re_activate(self, new_track, frame_id, new_id=False):
-        self.mean, self.covariance = self.kalman_filter.update(
-            self.mean, self.covariance, self.tlwh_to_xyah(new_track.tlwh)
-        )
-
-        self.update_features(new_track.curr_feat)
-        self.tracklet_len = 0
-        self.state = TrackState.Tracked
-        self.is_activated = True
-        self.frame_id = frame_id
-        if new_id:
-            self.track_id = self.next_id()
-
-    def update(self, new_track, frame_id, update_feature=True):
-        """
-        Update a matched track
-        :type new_track: STrack
-        :type frame_id: int
-        :type update_feature: bool
-        :return:
-        """
-        self.frame_id = frame_id
-        self.tracklet_len += 1
+    @property
+    def track_id(self):
+        return int(self._store.track_id[self._row])
+
+    @property
+    def state(self):
+        return int(self._store.state[self._row])
+
+    @state.setter
+    def state(self, state):
+        self._store.state[self._row] = state
 
-        new_tlwh = new_track.tlwh
-        self.mean, self.covariance = self.kalman_filter.update(
-            self.mean, self.covariance, self.tlwh_to_xyah(new_tlwh))
-        self.state = TrackState.Tracked
-        self.is_activated = True
+    @property
+    def is_activated(self):
+        return bool(self._store.is_activated[self._row])
+
+    @property
+    def frame_id(self):
+        return int(self._store.frame_id[self._row])
+
+    @property
+    def start_frame(self):
+        return int(self._store.start_frame[self._row])
 
-        self.score = new_track.score
-        if update_feature:
-            self.update_features(new_track.curr_feat)
+    @property
+    def tracklet_len(self):
+        return int(self._store.tracklet_len[self._row])
 
     @property
     # @jit(nopython=True)
@@ -123,12 +86,7 @@ class STrack(BaseTrack):
         """Get current position in bounding box format `(top left x, top left y,
                 width, height)`.
         """
-        if self.mean is None:
-            return self._tlwh.copy()
-        ret = self.mean[:4].copy()
-        ret[2] *= ret[3]
-        ret[:2] -= ret[2:] / 2
-        return ret
+        return self._store.tlwh([self._row])[0]
 
     @property
     # @jit(nopython=True)
@@ -147,8 +105,8 @@ class STrack(BaseTrack):
         height)`, where the aspect ratio is `width / height`.
         """
         ret = np.asarray(tlwh).copy()
-        ret[:2] += ret[2:] / 2
-        ret[2] /= ret[3]
+        ret[..., :2] += ret[..., 2:] / 2
+        ret[..., 2] /= ret[..., 3]
         return ret
 
     def to_xyah(self):
@@ -158,36 +116,90 @@ class STrack(BaseTrack):
     # @jit(nopython=True)
     def tlbr_to_tlwh(tlbr):
         ret = np.asarray(tlbr).copy()
-        ret[2:] -= ret[:2]
+        ret[..., 2:] -= ret[..., :2]
         return ret
 
     @staticmethod
     # @jit(nopython=True)
     def tlwh_to_tlbr(tlwh):
         ret = np.asarray(tlwh).copy()
-        ret[2:] += ret[:2]
+        ret[..., 2:] += ret[..., :2]
         return ret
 
     def __repr__(self):
         return 'OT_{}_({}-{})'.format(self.track_id, self.start_frame, self.end_frame)
 
 
+"""Max relative difference of the hm, wh and id outputs of a fused model to the original"""
+FUSE_TOLERANCE = 1e-3
+
+
+def check_export_meta(opt, meta):
+    """Raise if a model exported with the settings `meta` cannot run with `opt`"""
+    for key, value in (('img_size', list(opt.img_size)), ('K', opt.K), ('reid_dim', opt.reid_dim),
+                       ('ltrb', bool(opt.ltrb)), ('reg_offset', bool(opt.reg_offset))):
+        if meta[key] != value:
+            raise ValueError('{} is exported with {} {}, not {}'.format(opt.load_model, key, meta[key], value))
+
+
+def load_tracking_model(opt):
+    """
+    Create the network of `opt.arch`, load `opt.load_model` and prepare it for inference.
+    With --backend torchscript or onnxruntime `opt.load_model` is a model saved
+    by export.py, loaded without importing the networks.
+    """
+    if opt.gpus[0] >= 0:
+        opt.device = torch.device('cuda')
+    else:
+        opt.device = torch.device('cpu')
+    if opt.backend == 'torchscript':
+        model, meta = load_torchscript(opt.load_model, torch.device('cpu'))
+        check_export_meta(opt, meta)
+        if meta.get('int8', False):
+            if opt.device.type != 'cpu':
+                raise ValueError('{} is an int8 model, run it on the CPU with --gpus -1'.format(opt.load_model))
+            torch.backends.quantized.engine = meta['qengine']
+        return model.to(opt.device)
+    if opt.backend == 'onnxruntime':
+        model, meta = load_onnx(opt.load_model, opt.device, num_threads=opt.onnx_threads)
+        check_export_meta(opt, meta)
+        return model
+
+    from models.model import create_model, load_model
+    print('Creating model...')
+    model = create_model(opt.arch, opt.heads, opt.head_conv)
+    model = load_model(model, opt.load_model)
+    model = model.to(opt.device)
+    model.eval()
+    if not opt.not_fuse_bn:
+        model = fuse_tracking_model(model, opt)
+    return model
+
+
+def fuse_tracking_model(model, opt):
+    """
+    Fold batch norms into convolutions for inference. The fused network is
+    only used if its outputs match those of `model` on a random input.
+    """
+    fused = prepare_inference(model, channels_last=opt.channels_last)
+    x = torch.rand(1, 3, 256, 256, device=opt.device)
+    errors = max_output_error(model, fused, x)
+    if max(errors.values()) > FUSE_TOLERANCE:
+        logger.warning('outputs of the fused model differ by {}, keep the unfused one'.format(errors))
+        return model
+    return fused
+
+
 class JDETracker(object):
-    def __init__(self, opt, frame_rate=30):
+    def __init__(self, opt, frame_rate=30, with_model=True, model=None):
         self.opt = opt
-        if opt.gpus[0] >= 0:
-            opt.device = torch.device('cuda')
-        else:
-            opt.device = torch.device('cpu')
-        print('Creating model...')
-        self.model = create_model(opt.arch, opt.heads, opt.head_conv)
-        self.model = load_model(self.model, opt.load_model)
-        self.model = self.model.to(opt.device)
-        self.model.eval()
+        # trackers driven by a MultiStreamTracker share its model and hold none,
+        # an already loaded `model` is used as is
+        if model is None and with_model:
+            model = load_tracking_model(opt)
+        self.model = model
 
-        self.tracked_stracks = []  # type: list[STrack]
-        self.lost_stracks = []  # type: list[STrack]
-        self.removed_stracks = []  # type: list[STrack]
+        self.tracks = TrackStore(feat_dim=opt.reid_dim)
 
         self.frame_id = 0
         self.det_thresh = opt.conf_thres
@@ -196,9 +208,18 @@ class JDETracker(object):
         self.max_per_image = opt.K
         self.mean = np.array(opt.mean, dtype=np.float32).reshape(1, 1, 3)
         self.std = np.array(opt.std, dtype=np.float32).reshape(1, 1, 3)
+        self.alpha = 0.9
 
         self.kalman_filter = KalmanFilter()
 
+    @property
+    def tracked_stracks(self):
+        return [STrack(self.tracks, row) for row in self.tracks.tracked]
+
+    @property
+    def lost_stracks(self):
+        return [STrack(self.tracks, row) for row in self.tracks.lost]
+
     def post_process(self, dets, meta):
         dets = dets.detach().cpu().numpy()
         dets = dets.reshape(1, -1, dets.shape[2])
@@ -225,26 +246,83 @@ class JDETracker(object):
                 results[j] = results[j][keep_inds]
         return results
 
-    def update(self, im_blob, img0):
-        self.frame_id += 1
-        activated_starcks = []
-        refind_stracks = []
-        lost_stracks = []
-        removed_stracks = []
-
+    def multi_predict(self, rows):
+        """Predict the current location of tracks `rows` with KF"""
+        tracks = self.tracks
+        if len(rows) > 0:
+            multi_mean = tracks.mean[rows]
+            multi_mean[tracks.state[rows] != TrackState.Tracked, 7] = 0
+            tracks.mean[rows], tracks.covariance[rows] = self.kalman_filter.multi_predict(
+                multi_mean, tracks.covariance[rows])
+
+    def update_features(self, rows, feats):
+        tracks = self.tracks
+        feats = feats / np.linalg.norm(feats, axis=1, keepdims=True)
+        smooth_feat = self.alpha * tracks.smooth_feat[rows] + (1 - self.alpha) * feats
+        smooth_feat /= np.linalg.norm(smooth_feat, axis=1, keepdims=True)
+        tracks.curr_feat[rows] = feats
+        tracks.smooth_feat[rows] = smooth_feat
+
+    def update_tracks(self, rows, detections, det_inds, re_activate=False):
+        """
+        Update matched tracks with their detections
+        :type rows: np.ndarray
+        :type detections: tuple(tlwhs, scores, feats)
+        :type det_inds: np.ndarray
+        :type re_activate: bool
+        :return:
+        """
+        tracks = self.tracks
+        det_tlwhs, det_scores, det_feats = detections
+        tracks.mean[rows], tracks.covariance[rows] = self.kalman_filter.multi_update(
+            tracks.mean[rows], tracks.covariance[rows], STrack.tlwh_to_xyah(det_tlwhs[det_inds]))
+        self.update_features(rows, det_feats[det_inds])
+
+        if re_activate:
+            tracks.tracklet_len[rows] = 0
+        else:
+            tracks.tracklet_len[rows] += 1
+            tracks.score[rows] = det_scores[det_inds]
+        tracks.state[rows] = TrackState.Tracked
+        tracks.is_activated[rows] = True
+        tracks.frame_id[rows] = self.frame_id
+
+    def embedding_assignment(self, rows, detections, thresh):
+        """Match tracks `rows` to detections by embedding distance fused with motion"""
+        tracks = self.tracks
+        det_tlwhs, _, det_feats = detections
+        states = (tracks.mean[rows], tracks.covariance[rows])
+        det_xyahs = STrack.tlwh_to_xyah(det_tlwhs)
+        if self.opt.sparse_assoc:
+            ia, ib = matching.gate_pairs(self.kalman_filter, states, det_xyahs)
+            dists = matching.sparse_embedding_distance(tracks.smooth_feat[rows], det_feats, ia, ib)
+            ia, ib, dists = matching.sparse_fuse_motion(self.kalman_filter, dists, ia, ib, states, det_xyahs)
+            return matching.sparse_linear_assignment(ia, ib, dists, (len(rows), len(det_xyahs)), thresh)
+        dists = matching.embedding_distance(tracks.smooth_feat[rows], det_feats)
+        dists = matching.fuse_motion(self.kalman_filter, dists, states, det_xyahs)
+        return matching.linear_assignment(dists, thresh)
+
+    def iou_assignment(self, rows, det_tlbrs, thresh):
+        """Match tracks `rows` to detection boxes by IoU"""
+        if self.opt.sparse_assoc:
+            ia, ib, dists = matching.sparse_iou_distance(self.tracks.tlbr(rows), det_tlbrs)
+            return matching.sparse_linear_assignment(ia, ib, dists, (len(rows), len(det_tlbrs)), thresh)
+        dists = matching.iou_distance(self.tracks.tlbr(rows), det_tlbrs)
+        return matching.linear_assignment(dists, thresh)
+
+    def get_meta(self, img0, inp_height, inp_width):
         width = img0.shape[1]
         height = img0.shape[0]
-        inp_height = im_blob.shape[2]
-        inp_width = im_blob.shape[3]
         c = np.array([width / 2., height / 2.], dtype=np.float32)
         s = max(float(inp_width) / float(inp_height) * height, width) * 1.0
         meta = {'c': c, 's': s,
                 'out_height': inp_height // self.opt.down_ratio,
                 'out_width': inp_width // self.opt.down_ratio}
+        return meta
 
-        ''' Step 1: Network forward, get detections & embeddings'''
+    def decode(self, output):
+        """Decode a batch of head outputs into detections and their embeddings"""
         with torch.no_grad():
-            output = self.model(im_blob)[-1]
             hm = output['hm'].sigmoid_()
             wh = output['wh']
             id_feature = output['id']
@@ -253,170 +331,209 @@ class JDETracker(object):
             reg = output['reg'] if self.opt.reg_offset else None
             dets, inds = mot_decode(hm, wh, reg=reg, ltrb=self.opt.ltrb, K=self.opt.K)
             id_feature = _tranpose_and_gather_feat(id_feature, inds)
-            id_feature = id_feature.squeeze(0)
             id_feature = id_feature.cpu().numpy()
+        return dets, id_feature
 
+    def infer(self, im_blob, model=None):
+        """
+        Network forward and decoding of a batch
+        :type model: network to run in place of self.model
+        :return: BxKx6 output of mot_decode, BxKxD gathered embeddings
+        """
+        model = self.model if model is None else model
+        with torch.no_grad():
+            if self.opt.backend == 'torchscript':
+                # the traced graph takes batches of one frame
+                outputs = [model(im_blob[i:i + 1]) for i in range(im_blob.shape[0])]
+                dets = torch.cat([o[0] for o in outputs])
+                id_feature = torch.cat([o[1] for o in outputs]).cpu().numpy()
+                return dets, id_feature
+            # networks and onnxruntime sessions return the head outputs
+            if self.opt.channels_last and self.opt.backend == 'pytorch':
+                im_blob = im_blob.contiguous(memory_format=torch.channels_last)
+            output = model(im_blob)[-1]
+        return self.decode(output)
+
+    def detect(self, im_blob, img0):
+        """
+        Network forward and decoding of one frame
+        :return: Kx5 detections (x1, y1, x2, y2, score) in img0 coordinates, KxD embeddings
+        """
+        dets, id_feature = self.infer(im_blob)
+        meta = self.get_meta(img0, im_blob.shape[2], im_blob.shape[3])
+        dets = self.post_process(dets, meta)
+        dets = self.merge_outputs([dets])[1]
+        return dets, id_feature[0]
+
+    def update(self, im_blob, img0):
+        ''' Step 1: Network forward, get detections & embeddings'''
+        dets, id_feature = self.detect(im_blob, img0)
+        return self.update_frame(dets, id_feature)
+
+    def update_detections(self, dets, id_feature, meta):
+        """
+        Run association for one frame from its decoded network outputs
+        :type dets: torch.Tensor, 1xKx6 output of mot_decode
+        :type id_feature: np.ndarray, KxD gathered embeddings
+        :type meta: dict
+        :return: list[STrack]
+        """
         dets = self.post_process(dets, meta)
         dets = self.merge_outputs([dets])[1]
+        return self.update_frame(dets, id_feature)
+
+    def predict_only(self):
+        """
+        Advance all tracks one frame without detections, for frames the
+        detector skips. Activated and lost tracks move by the Kalman
+        prediction and lost tracks time out as in update_frame. Nothing is
+        matched, so tracklet_len, scores and features stay unchanged.
+        :return: list[STrack], activated tracks at their predicted boxes
+        """
+        self.frame_id += 1
+        tracks = self.tracks
+
+        lost = tracks.lost
+        timed_out = self.time_out_lost(lost)
+        tracks.take(tracks.tracked, self.drop_removed(lost, timed_out))
+
+        tracked = tracks.tracked
+        self.multi_predict(np.concatenate([tracked[tracks.is_activated[tracked]], tracks.lost]))
+        return [STrack(tracks, row) for row in tracks.tracked if tracks.is_activated[row]]
+
+    def time_out_lost(self, lost):
+        """
+        Mark the tracks of `lost` lost for more than max_time_lost frames as removed
+        :return: their rows
+        """
+        tracks = self.tracks
+        timed_out = lost[self.frame_id - tracks.frame_id[lost] > self.max_time_lost]
+        tracks.state[timed_out] = TrackState.Removed
+        return timed_out
+
+    def drop_removed(self, lost, removed):
+        """
+        Drop the tracks removed in earlier frames from the lost pool `lost`
+        and record `removed` as removed. Tracks removed in this frame stay in
+        the pool until the next one, as in the original tracker.
+        :return: rows of the lost pool
+        """
+        lost = lost[~self.tracks.was_removed[lost]]
+        self.tracks.was_removed[removed] = True
+        return lost
+
+    def update_frame(self, dets, id_feature):
+        """
+        Run association for one frame from its post-processed detections
+        :type dets: np.ndarray, Kx5 (x1, y1, x2, y2, score)
+        :type id_feature: np.ndarray, KxD embeddings
+        :return: list[STrack]
+        """
+        self.frame_id += 1
+        tracks = self.tracks
 
         remain_inds = dets[:, 4] > self.opt.conf_thres
         dets = dets[remain_inds]
         id_feature = id_feature[remain_inds]
 
-        # vis
-        '''
-        for i in range(0, dets.shape[0]):
-            bbox = dets[i][0:4]
-            cv2.rectangle(img0, (bbox[0], bbox[1]),
-                          (bbox[2], bbox[3]),
-                          (0, 255, 0), 2)
-        cv2.imshow('dets', img0)
-        cv2.waitKey(0)
-        id0 = id0-1
-        '''
-
-        if len(dets) > 0:
-            '''Detections'''
-            detections = [STrack(STrack.tlbr_to_tlwh(tlbrs[:4]), tlbrs[4], f, 30) for
-                          (tlbrs, f) in zip(dets[:, :5], id_feature)]
-        else:
-            detections = []
+        '''Detections'''
+        det_tlwhs = STrack.tlbr_to_tlwh(dets[:, :4]).astype(np.float64)
+        det_scores = dets[:, 4]
+        det_feats = id_feature / np.linalg.norm(id_feature, axis=1, keepdims=True)
+        det_feats /= np.linalg.norm(det_feats, axis=1, keepdims=True)
+        detections = (det_tlwhs, det_scores, det_feats)
 
         ''' Add newly detected tracklets to tracked_stracks'''
-        unconfirmed = []
-        tracked_stracks = []  # type: list[STrack]
-        for track in self.tracked_stracks:
-            if not track.is_activated:
-                unconfirmed.append(track)
-            else:
-                tracked_stracks.append(track)
+        tracked = tracks.tracked
+        lost = tracks.lost
+        unconfirmed = tracked[~tracks.is_activated[tracked]]
+        tracked_stracks = tracked[tracks.is_activated[tracked]]
 
         ''' Step 2: First association, with embedding'''
-        strack_pool = joint_stracks(tracked_stracks, self.lost_stracks)
-        # Predict the current location with KF
-        #for strack in strack_pool:
-            #strack.predict()
-        STrack.multi_predict(strack_pool)
-        dists = matching.embedding_distance(strack_pool, detections)
-        #dists = matching.iou_distance(strack_pool, detections)
-        dists = matching.fuse_motion(self.kalman_filter, dists, strack_pool, detections)
-        matches, u_track, u_detection = matching.linear_assignment(dists, thresh=0.4)
-
-        for itracked, idet in matches:
-            track = strack_pool[itracked]
-            det = detections[idet]
-            if track.state == TrackState.Tracked:
-                track.update(detections[idet], self.frame_id)
-                activated_starcks.append(track)
-            else:
-                track.re_activate(det, self.frame_id, new_id=False)
-                refind_stracks.append(track)
+        strack_pool = np.concatenate([tracked_stracks, lost])
+        self.multi_predict(strack_pool)
+        matches, u_track, u_detection = self.embedding_assignment(strack_pool, detections, thresh=self.opt.match_thres)
+
+        matches = np.asarray(matches, dtype=int).reshape(-1, 2)
+        u_detection = np.asarray(u_detection, dtype=int)
+        rows = strack_pool[matches[:, 0]]
+        is_tracked = tracks.state[rows] == TrackState.Tracked
+        activated_starcks = [rows[is_tracked]]
+        refind_stracks = rows[~is_tracked]
+        self.update_tracks(rows[is_tracked], detections, matches[is_tracked, 1])
+        self.update_tracks(refind_stracks, detections, matches[~is_tracked, 1], re_activate=True)
 
         ''' Step 3: Second association, with IOU'''
-        detections = [detections[i] for i in u_detection]
-        r_tracked_stracks = [strack_pool[i] for i in u_track if strack_pool[i].state == TrackState.Tracked]
-        dists = matching.iou_distance(r_tracked_stracks, detections)
-        matches, u_track, u_detection = matching.linear_assignment(dists, thresh=0.5)
-
-        for itracked, idet in matches:
-            track = r_tracked_stracks[itracked]
-            det = detections[idet]
-            if track.state == TrackState.Tracked:
-                track.update(det, self.frame_id)
-                activated_starcks.append(track)
-            else:
-                track.re_activate(det, self.frame_id, new_id=False)
-                refind_stracks.append(track)
-                
-        for it in u_track:
-            track = r_tracked_stracks[it]
-            if not track.state == TrackState.Lost:
-                track.mark_lost()
-                lost_stracks.append(track)
+        r_tracked_stracks = strack_pool[np.asarray(u_track, dtype=int)]
+        r_tracked_stracks = r_tracked_stracks[tracks.state[r_tracked_stracks] == TrackState.Tracked]
+        matches, u_track, u_remain = self.iou_assignment(
+            r_tracked_stracks, STrack.tlwh_to_tlbr(det_tlwhs[u_detection]), thresh=self.opt.iou_thres)
+
+        matches = np.asarray(matches, dtype=int).reshape(-1, 2)
+        rows = r_tracked_stracks[matches[:, 0]]
+        activated_starcks.append(rows)
+        self.update_tracks(rows, detections, u_detection[matches[:, 1]])
+
+        lost_stracks = r_tracked_stracks[np.asarray(u_track, dtype=int)]
+        tracks.state[lost_stracks] = TrackState.Lost
 
         '''Deal with unconfirmed tracks, usually tracks with only one beginning frame'''
-        detections = [detections[i] for i in u_detection]
-        dists = matching.iou_distance(unconfirmed, detections)
-        matches, u_unconfirmed, u_detection = matching.linear_assignment(dists, thresh=0.7)
-        for itracked, idet in matches:
-            unconfirmed[itracked].update(detections[idet], self.frame_id)
-            activated_starcks.append(unconfirmed[itracked])
-        for it in u_unconfirmed:
-            track = unconfirmed[it]
-            track.mark_removed()
-            removed_stracks.append(track)
+        u_detection = u_detection[np.asarray(u_remain, dtype=int)]
+        matches, u_unconfirmed, u_remain = self.iou_assignment(
+            unconfirmed, STrack.tlwh_to_tlbr(det_tlwhs[u_detection]), thresh=self.opt.unconfirmed_thres)
+
+        matches = np.asarray(matches, dtype=int).reshape(-1, 2)
+        rows = unconfirmed[matches[:, 0]]
+        activated_starcks.append(rows)
+        self.update_tracks(rows, detections, u_detection[matches[:, 1]])
+
+        removed_stracks = [unconfirmed[np.asarray(u_unconfirmed, dtype=int)]]
+        tracks.state[removed_stracks[0]] = TrackState.Removed
 
         """ Step 4: Init new stracks"""
-        for inew in u_detection:
-            track = detections[inew]
-            if track.score < self.det_thresh:
-                continue
-            track.activate(self.kalman_filter, self.frame_id)
-            activated_starcks.append(track)
+        u_detection = u_detection[np.asarray(u_remain, dtype=int)]
+        u_detection = u_detection[det_scores[u_detection] >= self.det_thresh]
+        mean, covariance = self.kalman_filter.multi_initiate(STrack.tlwh_to_xyah(det_tlwhs[u_detection]))
+        new_stracks = tracks.append(
+            mean, covariance, det_feats[u_detection], det_scores[u_detection],
+            [STrack.next_id() for _ in u_detection], self.frame_id, self.frame_id == 1)
+        activated_starcks.append(new_stracks)
+
         """ Step 5: Update state"""
-        for track in self.lost_stracks:
-            if self.frame_id - track.end_frame > self.max_time_lost:
-                track.mark_removed()
-                removed_stracks.append(track)
-
-        # print('Ramained match {} s'.format(t4-t3))
-
-        self.tracked_stracks = [t for t in self.tracked_stracks if t.state == TrackState.Tracked]
-        self.tracked_stracks = joint_stracks(self.tracked_stracks, activated_starcks)
-        self.tracked_stracks = joint_stracks(self.tracked_stracks, refind_stracks)
-        self.lost_stracks = sub_stracks(self.lost_stracks, self.tracked_stracks)
-        self.lost_stracks.extend(lost_stracks)
-        self.lost_stracks = sub_stracks(self.lost_stracks, self.removed_stracks)
-        self.removed_stracks.extend(removed_stracks)
-        self.tracked_stracks, self.lost_stracks = remove_duplicate_stracks(self.tracked_stracks, self.lost_stracks)
-        # get scores of lost tracks
-        output_stracks = [track for track in self.tracked_stracks if track.is_activated]
+        removed_stracks.append(self.time_out_lost(lost))
+
+        tracked = tracked[tracks.state[tracked] == TrackState.Tracked]
+        tracked = np.concatenate([tracked, new_stracks, refind_stracks])
+        lost = np.concatenate([lost[tracks.state[lost] != TrackState.Tracked], lost_stracks])
+        removed_stracks = np.concatenate(removed_stracks)
+        lost = self.drop_removed(lost, removed_stracks)
+        keep_tracked, keep_lost = remove_duplicate_stracks(
+            tracks.tlbr(tracked), tracks.frame_id[tracked] - tracks.start_frame[tracked],
+            tracks.tlbr(lost), tracks.frame_id[lost] - tracks.start_frame[lost])
 
         logger.debug('===========Frame {}=========='.format(self.frame_id))
-        logger.debug('Activated: {}'.format([track.track_id for track in activated_starcks]))
-        logger.debug('Refind: {}'.format([track.track_id for track in refind_stracks]))
-        logger.debug('Lost: {}'.format([track.track_id for track in lost_stracks]))
-        logger.debug('Removed: {}'.format([track.track_id for track in removed_stracks]))
+        logger.debug('Activated: {}'.format(tracks.track_id[np.concatenate(activated_starcks)].tolist()))
+        logger.debug('Refind: {}'.format(tracks.track_id[refind_stracks].tolist()))
+        logger.debug('Lost: {}'.format(tracks.track_id[lost_stracks].tolist()))
+        logger.debug('Removed: {}'.format(tracks.track_id[removed_stracks].tolist()))
+
+        tracks.take(tracked[keep_tracked], lost[keep_lost])
+        # get scores of lost tracks
+        output_stracks = [STrack(tracks, row) for row in tracks.tracked if tracks.is_activated[row]]
 
         return output_stracks
 
 
-def joint_stracks(tlista, tlistb):
-    exists = {}
-    res = []
-    for t in tlista:
-        exists[t.track_id] = 1
-        res.append(t)
-    for t in tlistb:
-        tid = t.track_id
-        if not exists.get(tid, 0):
-            exists[tid] = 1
-            res.append(t)
-    return res
-
-
-def sub_stracks(tlista, tlistb):
-    stracks = {}
-    for t in tlista:
-        stracks[t.track_id] = t
-    for t in tlistb:
-        tid = t.track_id
-        if stracks.get(tid, 0):
-            del stracks[tid]
-    return list(stracks.values())
-
-
-def remove_duplicate_stracks(stracksa, stracksb):
-    pdist = matching.iou_distance(stracksa, stracksb)
-    pairs = np.where(pdist < 0.15)
-    dupa, dupb = list(), list()
-    for p, q in zip(*pairs):
-        timep = stracksa[p].frame_id - stracksa[p].start_frame
-        timeq = stracksb[q].frame_id - stracksb[q].start_frame
-        if timep > timeq:
-            dupb.append(q)
-        else:
-            dupa.append(p)
-    resa = [t for i, t in enumerate(stracksa) if not i in dupa]
-    resb = [t for i, t in enumerate(stracksb) if not i in dupb]
-    return resa, resb
\ No newline at end of file
+def remove_duplicate_stracks(tlbra, agea, tlbrb, ageb):
+    """
+    Drop the younger one of every pair of tracks that overlap almost completely
+    :return: keep masks for both track sets
+    """
+    pdist = matching.iou_distance(tlbra, tlbrb)
+    p, q = np.where(pdist < 0.15)
+    dupb = agea[p] > ageb[q]
+    keepa = np.ones(len(tlbra), dtype=bool)
+    keepb = np.ones(len(tlbrb), dtype=bool)
+    keepa[p[~dupb]] = False
+    keepb[q[dupb]] = False
+    return keepa, keepb
@@ -0,0 +1,91 @@
+from collections import deque
+
+import numpy as np
+
+
+def parse_sizes(sizes):
+    """
+    :type sizes: str, comma separated WxH input sizes, e.g. '576x320,864x480,1088x608'
+    :return: list of (width, height), smallest first
+    """
+    sizes = [tuple(int(v) for v in size.lower().split('x')) for size in sizes.split(',') if size.strip()]
+    return sorted(sizes, key=lambda size: size[0] * size[1])
+
+
+class ResolutionScheduler(object):
+    """
+    Picks the network input size of one stream from a few fixed sizes.
+
+    Over a window of recent frames it looks at the detections above the
+    confidence threshold: dense scenes get the largest size, otherwise the
+    smallest size at which the small boxes (10th percentile of the heights)
+    still cover `min_height` input pixels. Stepping down needs 25% headroom
+    and switches are at least `window` frames apart, so streams do not flip
+    between two sizes.
+
+    Tracks live in original image coordinates and JDETracker.get_meta is
+    computed from the size of every blob, so the meta c/s and the Kalman
+    state stay valid across a switch without any rescaling.
+    """
+
+    def __init__(self, sizes, min_height=32, dense_count=30, window=30):
+        self.sizes = list(sizes)
+        self.min_height = min_height
+        self.dense_count = dense_count
+        self.window = window
+        # start at full resolution until there is evidence for less
+        self.index = len(self.sizes) - 1
+        self.heights = deque(maxlen=window)
+        self.counts = deque(maxlen=window)
+        self.frames_since_switch = 0
+
+    @property
+    def size(self):
+        """(width, height) of the next input"""
+        return self.sizes[self.index]
+
+    @staticmethod
+    def scale(size, img_shape):
+        """Letterbox scale of an image of `img_shape` (H, W, ...) into `size` (width, height)"""
+        return min(float(size[0]) / img_shape[1], float(size[1]) / img_shape[0])
+
+    def select(self, img_shape):
+        """:return: index in self.sizes suited to the recent detections"""
+        if np.mean(self.counts) >= self.dense_count:
+            return len(self.sizes) - 1
+        heights = np.concatenate(self.heights)
+        if len(heights) == 0:
+            return self.index
+        small = np.percentile(heights, 10)
+        for i, size in enumerate(self.sizes):
+            headroom = 1.25 if i < self.index else 1.
+            if small * self.scale(size, img_shape) >= self.min_height * headroom:
+                return i
+        return len(self.sizes) - 1
+
+    def update(self, dets, img_shape):
+        """
+        Record the detections of the last frame and switch size if needed
+        :type dets: np.ndarray, Kx5 (x1, y1, x2, y2, score) in original image coordinates
+        :type img_shape: shape of the original image
+        :return: True if the input size changed
+        """
+        self.heights.append(dets[:, 3] - dets[:, 1])
+        self.counts.append(len(dets))
+        self.frames_since_switch += 1
+        if self.frames_since_switch < self.window or len(self.counts) < self.window:
+            return False
+        index = self.select(img_shape)
+        if index == self.index:
+            return False
+        self.index = index
+        self.frames_since_switch = 0
+        return True
+
+
+def create_scheduler(opt):
+    """ResolutionScheduler of the --adaptive_* options"""
+    if opt.backend != 'pytorch':
+        raise ValueError('--adaptive_res needs --backend pytorch, exported models have a fixed input size')
+    return ResolutionScheduler(parse_sizes(opt.adaptive_sizes), min_height=opt.adaptive_min_height,
+                               dense_count=opt.adaptive_dense, window=opt.adaptive_window)
@@ -0,0 +1,90 @@
+import numpy as np
+
+from .basetrack import TrackState
+
+
+class TrackStore(object):
+    """
+    Columnar storage for the tracklets of one JDETracker.
+
+    Every per-track quantity lives in one contiguous array and row i of each
+    array belongs to the same tracklet. Rows are kept ordered as
+    [tracked..., lost...], so both pools are plain slices of the store.
+    """
+
+    _columns = ('mean', 'covariance', 'smooth_feat', 'curr_feat', 'score', 'track_id',
+                'state', 'is_activated', 'was_removed', 'frame_id', 'start_frame', 'tracklet_len')
+
+    def __init__(self, feat_dim=128):
+        self.mean = np.zeros((0, 8), dtype=np.float64)
+        self.covariance = np.zeros((0, 8, 8), dtype=np.float64)
+        self.smooth_feat = np.zeros((0, feat_dim), dtype=np.float32)
+        self.curr_feat = np.zeros((0, feat_dim), dtype=np.float32)
+        self.score = np.zeros((0, ), dtype=np.float32)
+        self.track_id = np.zeros((0, ), dtype=np.int64)
+        self.state = np.zeros((0, ), dtype=np.int64)
+        self.is_activated = np.zeros((0, ), dtype=bool)
+        # set once a track has been handed to the removed pool
+        self.was_removed = np.zeros((0, ), dtype=bool)
+        self.frame_id = np.zeros((0, ), dtype=np.int64)
+        self.start_frame = np.zeros((0, ), dtype=np.int64)
+        self.tracklet_len = np.zeros((0, ), dtype=np.int64)
+
+        self.num_tracked = 0
+
+    def __len__(self):
+        return len(self.track_id)
+
+    @property
+    def tracked(self):
+        return np.arange(self.num_tracked)
+
+    @property
+    def lost(self):
+        return np.arange(self.num_tracked, len(self))
+
+    def append(self, mean, covariance, feat, score, track_id, frame_id, is_activated):
+        """Append new tracklets after the existing rows.
+
+        :return: row indices of the new tracklets
+        """
+        n = len(track_id)
+        rows = np.arange(len(self), len(self) + n)
+        new = {
+            'mean': mean,
+            'covariance': covariance,
+            'smooth_feat': feat,
+            'curr_feat': feat,
+            'score': score,
+            'track_id': track_id,
+            'state': np.full(n, TrackState.Tracked),
+            'is_activated': np.full(n, is_activated),
+            'was_removed': np.zeros(n, dtype=bool),
+            'frame_id': np.full(n, frame_id),
+            'start_frame': np.full(n, frame_id),
+            'tracklet_len': np.zeros(n),
+        }
+        for k in self._columns:
+            col = getattr(self, k)
+            setattr(self, k, np.concatenate([col, np.asarray(new[k], dtype=col.dtype)], axis=0))
+        return rows
+
+    def take(self, tracked_rows, lost_rows):
+        """Keep only the given rows, reordered as [tracked_rows, lost_rows]."""
+        rows = np.concatenate([tracked_rows, lost_rows]).astype(np.int64)
+        for k in self._columns:
+            setattr(self, k, getattr(self, k)[rows])
+        self.num_tracked = len(tracked_rows)
+
+    def tlwh(self, rows):
+        """Current boxes of `rows` in `(top left x, top left y, width, height)` format."""
+        ret = self.mean[rows, :4].copy()
+        ret[:, 2] *= ret[:, 3]
+        ret[:, :2] -= ret[:, 2:] / 2
+        return ret
+
+    def tlbr(self, rows):
+        """Current boxes of `rows` in `(min x, min y, max x, max y)` format."""
+        ret = self.tlwh(rows)
+        ret[:, 2:] += ret[:, :2]
+        return ret
@@ -0,0 +1,141 @@
+import os
+import json
+import numpy as np
+
+
+"""
+A detection cache holds the post-processed detections of one sequence, as
+returned by JDETracker.detect, in flat column files of one directory:
+
+    boxes.bin       N x 4 (x1, y1, x2, y2) in image coordinates, float16 or float32
+    scores.bin      N float32
+    embeddings.bin  N x D id embeddings, float16 or float32
+    offsets.npy     F + 1 int64, frame i owns rows offsets[i]:offsets[i + 1]
+    meta.json       shapes, dtypes and the settings the cache was made with
+
+meta.json is written last, a directory without it is incomplete.
+"""
+
+
+class DetectionCacheWriter(object):
+    """
+    Appends detections frame by frame. Rows scoring at most `min_score` are
+    dropped, so a cache can be replayed with any conf_thres >= min_score.
+    float16 embeddings halve the cache size. float16 boxes can be off by a
+    pixel past x or y = 1024, so boxes default to float32.
+    """
+
+    def __init__(self, dirname, min_score=0., info=None, dtype='float32', box_dtype='float32'):
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        meta_filename = os.path.join(dirname, 'meta.json')
+        if os.path.exists(meta_filename):
+            os.remove(meta_filename)
+
+        self.dirname = dirname
+        self.min_score = min_score
+        self.info = info or {}
+        self.dtype = np.dtype(dtype)
+        self.box_dtype = np.dtype(box_dtype)
+        self.offsets = [0]
+        self.feat_dim = None
+        self.files = {k: open(os.path.join(dirname, k + '.bin'), 'wb') for k in ('boxes', 'scores', 'embeddings')}
+
+    def write(self, dets, id_feature):
+        """
+        :type dets: np.ndarray, Kx5 (x1, y1, x2, y2, score)
+        :type id_feature: np.ndarray, KxD embeddings
+        """
+        keep = dets[:, 4] > self.min_score
+        dets = dets[keep]
+        self.feat_dim = id_feature.shape[1]
+        self.files['boxes'].write(np.ascontiguousarray(dets[:, :4], dtype=self.box_dtype).tobytes())
+        self.files['scores'].write(np.ascontiguousarray(dets[:, 4], dtype=np.float32).tobytes())
+        self.files['embeddings'].write(np.ascontiguousarray(id_feature[keep], dtype=self.dtype).tobytes())
+        self.offsets.append(self.offsets[-1] + len(dets))
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        np.save(os.path.join(self.dirname, 'offsets.npy'), np.asarray(self.offsets, dtype=np.int64))
+        meta = dict(self.info)
+        meta.update({
+            'num_frames': len(self.offsets) - 1,
+            'num_rows': self.offsets[-1],
+            'feat_dim': self.feat_dim or 0,
+            'min_score': self.min_score,
+            'dtype': self.dtype.name,
+            'box_dtype': self.box_dtype.name,
+        })
+        with open(os.path.join(self.dirname, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DetectionCache(object):
+    """Memory-mapped, read-only view of a detection cache directory"""
+
+    def __init__(self, dirname):
+        with open(os.path.join(dirname, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.dirname = dirname
+        self.offsets = np.load(os.path.join(dirname, 'offsets.npy'))
+        n, dim = self.meta['num_rows'], self.meta['feat_dim']
+        self.boxes = self._map('boxes', (n, 4), self.meta.get('box_dtype', 'float32'))
+        self.scores = self._map('scores', (n, ), 'float32')
+        self.embeddings = self._map('embeddings', (n, dim), self.meta.get('dtype', 'float32'))
+
+    @staticmethod
+    def exists(dirname):
+        return os.path.isfile(os.path.join(dirname, 'meta.json'))
+
+    def _map(self, name, shape, dtype):
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.dirname, name + '.bin'), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        """
+        :return: Kx5 detections (x1, y1, x2, y2, score), KxD embeddings of frame `idx`
+        """
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        dets = np.empty((end - start, 5), dtype=np.float32)
+        dets[:, :4] = self.boxes[start:end]
+        dets[:, 4] = self.scores[start:end]
+        return dets, self.embeddings[start:end].astype(np.float32)
+
+
+class ReplayLoader(object):
+    """
+    Iterates over the frames of a detection cache in place of LoadImages or
+    LoadVideo, yielding the (dets, id_feature) to feed JDETracker.update_frame.
+    """
+
+    def __init__(self, dirname):
+        self.cache = DetectionCache(dirname)
+        self.frame_rate = self.cache.meta.get('frame_rate', 30)
+        self.count = 0
+
+    def __iter__(self):
+        self.count = -1
+        return self
+
+    def __next__(self):
+        self.count += 1
+        if self.count == len(self):
+            raise StopIteration
+        return self.cache[self.count]
+
+    def __getitem__(self, idx):
+        return self.cache[idx]
+
+    def __len__(self):
+        return len(self.cache)
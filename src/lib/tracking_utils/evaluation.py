@@ -1,18 +1,123 @@
 import os
+import glob
+import shutil
+import hashlib
 import numpy as np
 import copy
 import motmetrics as mm
 mm.lap.default_solver = 'lap'
 
-from tracking_utils.io import read_results, unzip_objs
+from tracking_utils.io import load_results, result_filenames, FrameIndexedResults
+
+
+# annotations already loaded by this process, keyed by (gt path, mtime)
+_gt_cache = dict()
+
+
+def load_gt(gt_filename, data_type, cache_dir=None):
+    """
+    Load the gt boxes and ignore regions of a gt file.
+
+    Annotations are kept for the lifetime of the process. With `cache_dir` they
+    are also saved there, keyed by path and mtime, and later processes
+    memory-map them instead of parsing the text file.
+
+    :return: gt and ignore FrameIndexedResults
+    """
+    path = os.path.abspath(gt_filename)
+    mtime = os.stat(path).st_mtime_ns if os.path.isfile(path) else -1
+    key = (path, mtime)
+    if key in _gt_cache:
+        return _gt_cache[key]
+
+    entry = None
+    if cache_dir and mtime >= 0:
+        name = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        entry = os.path.join(cache_dir, '{}-{}'.format(name, mtime))
+    if entry is not None and os.path.isdir(entry):
+        gt = FrameIndexedResults.load(os.path.join(entry, 'gt'))
+        ignore = FrameIndexedResults.load(os.path.join(entry, 'ignore'))
+    else:
+        gt = load_results(gt_filename, data_type, is_gt=True)
+        ignore = load_results(gt_filename, data_type, is_ignore=True)
+        if entry is not None:
+            _save_gt_cache(entry, gt, ignore)
+    _gt_cache[key] = gt, ignore
+    return gt, ignore
+
+
+def _save_gt_cache(entry, gt, ignore):
+    # write next to the entry and rename it in place, so concurrent evaluators
+    # never see a partial entry
+    tmp = '{}.tmp{}'.format(entry, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    gt.save(os.path.join(tmp, 'gt'))
+    ignore.save(os.path.join(tmp, 'ignore'))
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # another process saved the same entry first
+        shutil.rmtree(tmp, ignore_errors=True)
+    # drop entries of older versions of the same gt file
+    name = os.path.basename(entry).split('-')[0]
+    for stale in glob.glob(os.path.join(os.path.dirname(entry), name + '-*')):
+        if stale != entry and '.tmp' not in stale:
+            shutil.rmtree(stale, ignore_errors=True)
+
+
+def _concat_ranges(starts, counts):
+    """Concatenation of arange(start, start + count) for every start, count"""
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+
+
+def frame_pairs(a_starts, a_counts, b_starts, b_counts):
+    """
+    Row indices of every (a, b) pair of boxes sharing a frame.
+
+    Frame i holds rows [a_starts[i], a_starts[i] + a_counts[i]) of a and the
+    same for b. Pairs are listed frame by frame and row-major within a frame,
+    so the pairs of frame i form an (a_counts[i], b_counts[i]) block starting
+    at pair_starts[i].
+
+    :return: a_rows, b_rows, pair_starts
+    """
+    a_counts = np.asarray(a_counts, dtype=np.int64)
+    b_counts = np.asarray(b_counts, dtype=np.int64)
+    n_pairs = a_counts * b_counts
+    a_frame = np.repeat(np.arange(len(a_counts)), a_counts)
+    a_rows = _concat_ranges(np.asarray(a_starts, dtype=np.int64), a_counts)
+    reps = b_counts[a_frame]
+    b_rows = _concat_ranges(np.asarray(b_starts, dtype=np.int64)[a_frame], reps)
+    return np.repeat(a_rows, reps), b_rows, np.cumsum(n_pairs) - n_pairs
+
+
+def iou_distance_pairs(a_tlwhs, b_tlwhs, max_iou=1.):
+    """
+    1 - IoU of the boxes a_tlwhs[i] and b_tlwhs[i], nan above `max_iou`.
+    Element-wise version of mm.distances.iou_matrix, with the same arithmetic.
+    """
+    a_min, a_max = a_tlwhs[:, :2], a_tlwhs[:, :2] + a_tlwhs[:, 2:]
+    b_min, b_max = b_tlwhs[:, :2], b_tlwhs[:, :2] + b_tlwhs[:, 2:]
+    i_size = np.maximum(np.minimum(a_max, b_max) - np.maximum(a_min, b_min), 0)
+    i_vol = i_size[:, 0] * i_size[:, 1]
+    a_size = np.maximum(a_max - a_min, 0)
+    b_size = np.maximum(b_max - b_min, 0)
+    u_vol = a_size[:, 0] * a_size[:, 1] + b_size[:, 0] * b_size[:, 1] - i_vol
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = np.where(i_vol == 0, 0., i_vol / u_vol)
+    dist = 1 - iou
+    dist[dist > max_iou] = np.nan
+    return dist
 
 
 class Evaluator(object):
 
-    def __init__(self, data_root, seq_name, data_type):
+    def __init__(self, data_root, seq_name, data_type, cache_dir=None):
         self.data_root = data_root
         self.seq_name = seq_name
         self.data_type = data_type
+        self.cache_dir = cache_dir
 
         self.load_annotations()
         self.reset_accumulator()
@@ -21,8 +126,7 @@ class Evaluator(object):
         assert self.data_type == 'mot'
 
         gt_filename = os.path.join(self.data_root, self.seq_name, 'gt', 'gt.txt')
-        self.gt_frame_dict = read_results(gt_filename, self.data_type, is_gt=True)
-        self.gt_ignore_frame_dict = read_results(gt_filename, self.data_type, is_ignore=True)
+        self.gt_frame_dict, self.gt_ignore_frame_dict = load_gt(gt_filename, self.data_type, self.cache_dir)
 
     def reset_accumulator(self):
         self.acc = mm.MOTAccumulator(auto_id=True)
@@ -33,12 +137,10 @@ class Evaluator(object):
         trk_ids = np.copy(trk_ids)
 
         # gts
-        gt_objs = self.gt_frame_dict.get(frame_id, [])
-        gt_tlwhs, gt_ids = unzip_objs(gt_objs)[:2]
+        gt_tlwhs, gt_ids = self.gt_frame_dict.get(frame_id)[:2]
 
         # ignore boxes
-        ignore_objs = self.gt_ignore_frame_dict.get(frame_id, [])
-        ignore_tlwhs = unzip_objs(ignore_objs)[0]
+        ignore_tlwhs = self.gt_ignore_frame_dict.get(frame_id)[0]
 
         # remove ignored results
         keep = np.ones(len(trk_tlwhs), dtype=bool)
@@ -76,18 +178,75 @@ class Evaluator(object):
         return events
 
     def eval_file(self, filename):
+        # with all the parts ResultsWriter rotated the rows into
+        result_frame_dict = load_results(result_filenames(filename), self.data_type, is_gt=False)
+        return self.eval_results(result_frame_dict)
+
+    def eval_results(self, results):
+        """
+        Evaluate the FrameIndexedResults of a whole sequence.
+
+        Gives the same accumulator as eval_frame on every frame of `results`:
+        the IoUs of all (ignore region, result) and (gt, result) pairs sharing a
+        frame are computed in one pass, results covered by an ignore region are
+        dropped in bulk and only the accumulator update runs frame by frame.
+        """
         self.reset_accumulator()
+        frame_ids = results.frame_ids
+
+        # remove ignored results
+        ignore = self.gt_ignore_frame_dict
+        i_starts, i_counts = self._frame_ranges(ignore, frame_ids)
+        t_starts, t_counts = self._frame_ranges(results, frame_ids)
+        ia, it, _ = frame_pairs(i_starts, i_counts, t_starts, t_counts)
+        overlap = ~np.isnan(iou_distance_pairs(ignore.tlwhs[ia], results.tlwhs[it], max_iou=0.5))
+        ia, it = ia[overlap], it[overlap]
+        # an overlap whose ignore region and result overlap nothing else is
+        # always part of the assignment, only frames with shared boxes are solved
+        shared = (np.bincount(ia, minlength=len(ignore.frames)) > 1)[ia] | \
+                 (np.bincount(it, minlength=len(results.frames)) > 1)[it]
+        keep = np.ones(len(results.frames), dtype=bool)
+        keep[it] = False
+        for i in np.unique(np.searchsorted(frame_ids, results.frames[it[shared]])):
+            ignore_tlwhs = ignore.tlwhs[i_starts[i]:i_starts[i] + i_counts[i]]
+            trk_rows = np.arange(t_starts[i], t_starts[i] + t_counts[i])
+            keep[trk_rows] = True
+            iou_distance = mm.distances.iou_matrix(ignore_tlwhs, results.tlwhs[trk_rows], max_iou=0.5)
+            match_is, match_js = mm.lap.linear_sum_assignment(iou_distance)
+            match_is, match_js = map(lambda a: np.asarray(a, dtype=int), [match_is, match_js])
+            match_ious = iou_distance[match_is, match_js]
+            keep[trk_rows[match_js[np.logical_not(np.isnan(match_ious))]]] = False
 
-        result_frame_dict = read_results(filename, self.data_type, is_gt=False)
-        #frames = sorted(list(set(self.gt_frame_dict.keys()) | set(result_frame_dict.keys())))
-        frames = sorted(list(set(result_frame_dict.keys())))
-        for frame_id in frames:
-            trk_objs = result_frame_dict.get(frame_id, [])
-            trk_tlwhs, trk_ids = unzip_objs(trk_objs)[:2]
-            self.eval_frame(frame_id, trk_tlwhs, trk_ids, rtn_events=False)
+        trk_frames = results.frames[keep]
+        trk_tlwhs = results.tlwhs[keep]
+        trk_ids = results.ids[keep]
+        t_starts = np.searchsorted(trk_frames, frame_ids, side='left')
+        t_counts = np.searchsorted(trk_frames, frame_ids, side='right') - t_starts
+
+        # get distance matrices
+        gt = self.gt_frame_dict
+        g_starts, g_counts = self._frame_ranges(gt, frame_ids)
+        ig, it, pair_starts = frame_pairs(g_starts, g_counts, t_starts, t_counts)
+        iou_distance = iou_distance_pairs(gt.tlwhs[ig], trk_tlwhs[it], max_iou=0.5)
+
+        # acc
+        for i in range(len(frame_ids)):
+            gt_ids = gt.ids[g_starts[i]:g_starts[i] + g_counts[i]]
+            frame_trk_ids = trk_ids[t_starts[i]:t_starts[i] + t_counts[i]]
+            if g_counts[i] > 0 and t_counts[i] > 0:
+                dists = iou_distance[pair_starts[i]:pair_starts[i] + g_counts[i] * t_counts[i]]
+                dists = dists.reshape(g_counts[i], t_counts[i])
+            else:
+                dists = np.empty((0, 0))
+            self.acc.update(gt_ids, frame_trk_ids, dists)
 
         return self.acc
 
+    @staticmethod
+    def _frame_ranges(results, frame_ids):
+        starts = np.searchsorted(results.frames, frame_ids, side='left')
+        return starts, np.searchsorted(results.frames, frame_ids, side='right') - starts
+
     @staticmethod
     def get_summary(accs, names, metrics=('mota', 'num_switches', 'idp', 'idr', 'idf1', 'precision', 'recall')):
         names = copy.deepcopy(names)
@@ -1,45 +1,325 @@
 import os
+import time
+import itertools
 from typing import Dict
 import numpy as np
 
 from tracking_utils.log import logger
 
 
+"""
+Text layouts of result rows as (template, fields). Templates only hold
+positional fields, so a whole batch of rows is rendered by one str.format call.
+"""
+MOT_FORMAT = ('{},{},{},{},{},{},1,-1,-1,-1\n', ('frame', 'id', 'x1', 'y1', 'w', 'h'))
+MOT_SCORE_FORMAT = ('{},{},{},{},{},{},{},1,-1,-1,-1\n', ('frame', 'id', 'x1', 'y1', 'w', 'h', 'score'))
+KITTI_FORMAT = ('{} {} pedestrian 0 0 -10 {} {} {} {} -10 -10 -10 -1000 -1000 -1000 -10\n',
+                ('frame', 'id', 'x1', 'y1', 'x2', 'y2'))
+
+
+def stack_results(results):
+    """Flatten [(frame_id, tlwhs, track_ids[, scores]), ...] into per-row arrays
+
+    :return: frames, ids, tlwhs, scores (None if `results` carries no scores)
+    """
+    frames, ids, tlwhs, scores = [], [], [], []
+    has_scores = False
+    for res in results:
+        track_ids = np.asarray(res[2], dtype=np.int64).reshape(-1)
+        frames.append(np.full(len(track_ids), res[0], dtype=np.int64))
+        ids.append(track_ids)
+        tlwhs.append(np.asarray(res[1], dtype=np.float64).reshape(-1, 4))
+        if len(res) > 3 and res[3] is not None:
+            scores.append(np.asarray(res[3], dtype=np.float64).reshape(-1))
+            has_scores = True
+        else:
+            scores.append(np.ones(len(track_ids)))
+    if len(frames) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, 4)), None
+    scores = np.concatenate(scores) if has_scores else None
+    return np.concatenate(frames), np.concatenate(ids), np.concatenate(tlwhs), scores
+
+
+def format_results(frames, ids, tlwhs, scores=None, save_format=MOT_FORMAT):
+    """Render result rows as text, skipping rows with negative ids"""
+    ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+    keep = ids >= 0
+    tlwhs = np.asarray(tlwhs, dtype=np.float64).reshape(-1, 4)[keep]
+    columns = {
+        'frame': np.asarray(frames, dtype=np.int64).reshape(-1)[keep],
+        'id': ids[keep],
+        'x1': tlwhs[:, 0],
+        'y1': tlwhs[:, 1],
+        'w': tlwhs[:, 2],
+        'h': tlwhs[:, 3],
+        'x2': tlwhs[:, 0] + tlwhs[:, 2],
+        'y2': tlwhs[:, 1] + tlwhs[:, 3],
+    }
+    if scores is not None:
+        columns['score'] = np.asarray(scores, dtype=np.float64).reshape(-1)[keep]
+    template, fields = save_format
+    values = itertools.chain.from_iterable(zip(*[columns[k].tolist() for k in fields]))
+    return (template * len(tlwhs)).format(*values)
+
+
+def write_mot_results(filename, frames, ids, tlwhs, scores=None, save_format=MOT_FORMAT, chunk_rows=100000):
+    """Write result rows given as flat arrays, formatting `chunk_rows` rows at a time"""
+    path = os.path.dirname(filename)
+    if path and not os.path.exists(path):
+        os.makedirs(path)
+
+    with open(filename, 'w') as f:
+        for i in range(0, len(ids), chunk_rows):
+            f.write(format_results(frames[i:i + chunk_rows], ids[i:i + chunk_rows], tlwhs[i:i + chunk_rows],
+                                   None if scores is None else scores[i:i + chunk_rows], save_format))
+
+
 def write_results(filename, results_dict: Dict, data_type: str):
     if not filename:
         return
-    path = os.path.dirname(filename)
-    if not os.path.exists(path):
-        os.makedirs(path)
 
     if data_type in ('mot', 'mcmot', 'lab'):
-        save_format = '{frame},{id},{x1},{y1},{w},{h},1,-1,-1,-1\n'
+        save_format = MOT_FORMAT
     elif data_type == 'kitti':
-        save_format = '{frame} {id} pedestrian -1 -1 -10 {x1} {y1} {x2} {y2} -1 -1 -1 -1000 -1000 -1000 -10 {score}\n'
+        save_format = ('{} {} pedestrian -1 -1 -10 {} {} {} {} -1 -1 -1 -1000 -1000 -1000 -10 1.0\n',
+                       ('frame', 'id', 'x1', 'y1', 'x2', 'y2'))
     else:
         raise ValueError(data_type)
 
-    with open(filename, 'w') as f:
-        for frame_id, frame_data in results_dict.items():
-            if data_type == 'kitti':
-                frame_id -= 1
-            for tlwh, track_id in frame_data:
-                if track_id < 0:
-                    continue
-                x1, y1, w, h = tlwh
-                x2, y2 = x1 + w, y1 + h
-                line = save_format.format(frame=frame_id, id=track_id, x1=x1, y1=y1, x2=x2, y2=y2, w=w, h=h, score=1.0)
-                f.write(line)
+    frames, ids, tlwhs, _ = stack_results(
+        [(frame_id, [tlwh for tlwh, _ in frame_data], [track_id for _, track_id in frame_data])
+         for frame_id, frame_data in results_dict.items()])
+    if data_type == 'kitti':
+        frames -= 1
+    write_mot_results(filename, frames, ids, tlwhs, save_format=save_format)
     logger.info('Save results to {}'.format(filename))
 
 
-def read_results(filename, data_type: str, is_gt=False, is_ignore=False):
+"""
+Record layout of binary result files. A file holds a sequence of np.save'd
+record batches, one per flush of a ResultsWriter.
+"""
+RESULT_DTYPE = np.dtype([
+    ('frame', np.int32),
+    ('id', np.int32),
+    ('x1', np.float32),
+    ('y1', np.float32),
+    ('w', np.float32),
+    ('h', np.float32),
+    ('score', np.float32)])
+
+
+def part_filename(filename, part):
+    """Name of part `part` of a result file, `filename` itself for the first one"""
+    if part == 0:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return '{}.{}{}'.format(root, part, ext)
+
+
+def result_filenames(filename):
+    """`filename` and the parts ResultsWriter rotated its rows into after it, in order"""
+    filenames = [filename]
+    while os.path.isfile(part_filename(filename, len(filenames))):
+        filenames.append(part_filename(filename, len(filenames)))
+    return filenames
+
+
+class ResultsWriter(object):
+    """
+    Streams tracking results to disk while a sequence is processed.
+
+    Frames are buffered and written every `chunk_frames` frames as MOT/KITTI
+    text rows, or as RESULT_DTYPE record batches if `filename` ends with
+    '.npy'. Each write is flushed, optionally fsync'ed, and the output moves on
+    to a new part file after `max_bytes` bytes or `max_seconds` seconds.
+    """
+
+    def __init__(self, filename, data_type='mot', chunk_frames=50, fsync=False,
+                 max_bytes=0, max_seconds=0):
+        if data_type == 'mot':
+            self.save_format = MOT_FORMAT
+        elif data_type == 'kitti':
+            self.save_format = KITTI_FORMAT
+        else:
+            raise ValueError(data_type)
+        path = os.path.dirname(filename)
+        if path and not os.path.exists(path):
+            os.makedirs(path)
+
+        self.filename = filename
+        self.data_type = data_type
+        self.binary = filename.endswith('.npy')
+        self.chunk_frames = chunk_frames
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+
+        # parts left by an earlier run would be read back as part of this one
+        for stale in result_filenames(filename)[1:]:
+            os.remove(stale)
+        self.part = 0
+        self.filenames = []
+        self.pending = []
+        self._open()
+
+    def _open(self):
+        filename = part_filename(self.filename, self.part)
+        self.f = open(filename, 'wb' if self.binary else 'w')
+        self.opened = time.time()
+        self.filenames.append(filename)
+
+    def write(self, frame_id, tlwhs, track_ids, scores=None):
+        self.pending.append((frame_id, tlwhs, track_ids, scores))
+        if len(self.pending) >= self.chunk_frames:
+            self.flush()
+
+    def _format(self, pending):
+        frames, ids, tlwhs, _ = stack_results(pending)
+        if self.data_type == 'kitti':
+            frames -= 1
+        return format_results(frames, ids, tlwhs, save_format=self.save_format)
+
+    def _records(self, pending):
+        frames, ids, tlwhs, scores = stack_results(pending)
+        records = np.empty(len(ids), dtype=RESULT_DTYPE)
+        records['frame'] = frames
+        records['id'] = ids
+        for i, k in enumerate(('x1', 'y1', 'w', 'h')):
+            records[k] = tlwhs[:, i]
+        records['score'] = 1 if scores is None else scores
+        return records[records['id'] >= 0]
+
+    def flush(self):
+        if len(self.pending) > 0:
+            if self.binary:
+                np.save(self.f, self._records(self.pending))
+            else:
+                self.f.write(self._format(self.pending))
+            self.pending = []
+        self.f.flush()
+        if self.fsync:
+            os.fsync(self.f.fileno())
+
+        if (self.max_bytes > 0 and self.f.tell() >= self.max_bytes) or \
+                (self.max_seconds > 0 and time.time() - self.opened >= self.max_seconds):
+            self.f.close()
+            self.part += 1
+            self._open()
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.flush()
+        self.f.close()
+        logger.info('save results to {}'.format(', '.join(self.filenames)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_binary_results(filename):
+    """Concatenate all record batches of a binary result file"""
+    batches = []
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        while f.tell() < size:
+            batches.append(np.load(f))
+    if len(batches) == 0:
+        return np.empty(0, dtype=RESULT_DTYPE)
+    return np.concatenate(batches)
+
+
+class FrameIndexedResults(object):
+    """
+    Boxes of a result or annotation file held in flat arrays sorted by frame.
+
+    Every frame id maps to a slice of the arrays, so `results[frame_id]` and
+    `results.get(frame_id)` return (tlwhs, ids, scores) views without copying.
+    `frame_ids` lists the frames present in the file, including those whose
+    boxes were all filtered out.
+    """
+
+    def __init__(self, frames, ids, tlwhs, scores, frame_ids=None, presorted=False):
+        frames = np.asarray(frames, dtype=np.int64).reshape(-1)
+        order = slice(None) if presorted else np.argsort(frames, kind='stable')
+        self.frames = frames[order]
+        self.ids = np.asarray(ids, dtype=np.int64).reshape(-1)[order]
+        self.tlwhs = np.asarray(tlwhs, dtype=np.float64).reshape(-1, 4)[order]
+        self.scores = np.asarray(scores, dtype=np.float64).reshape(-1)[order]
+
+        self.frame_ids = np.unique(self.frames if frame_ids is None else frame_ids)
+        starts = np.searchsorted(self.frames, self.frame_ids, side='left')
+        ends = np.searchsorted(self.frames, self.frame_ids, side='right')
+        self.index = dict(zip(self.frame_ids.tolist(), zip(starts.tolist(), ends.tolist())))
+
+    @classmethod
+    def from_records(cls, records):
+        records = records[records['frame'] >= 1]
+        tlwhs = np.stack([records[k] for k in ('x1', 'y1', 'w', 'h')], axis=1)
+        return cls(records['frame'], records['id'], tlwhs, records['score'])
+
+    def save(self, filename):
+        """Save as `filename`.rows.npy, (frame, id, x1, y1, w, h, score) float64 rows, and `filename`.frames.npy"""
+        rows = np.concatenate([self.frames[:, None], self.ids[:, None], self.tlwhs, self.scores[:, None]], axis=1)
+        np.save(filename + '.rows.npy', rows.astype(np.float64))
+        np.save(filename + '.frames.npy', self.frame_ids)
+
+    @classmethod
+    def load(cls, filename, mmap_mode='r'):
+        """Load what `save` wrote, boxes and scores stay memory-mapped"""
+        rows = np.load(filename + '.rows.npy', mmap_mode=mmap_mode)
+        frame_ids = np.load(filename + '.frames.npy')
+        return cls(rows[:, 0], rows[:, 1], rows[:, 2:6], rows[:, 6], frame_ids, presorted=True)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, frame_id):
+        return frame_id in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def __getitem__(self, frame_id):
+        start, end = self.index[frame_id]
+        return self.tlwhs[start:end], self.ids[start:end], self.scores[start:end]
+
+    def get(self, frame_id):
+        """(tlwhs, ids, scores) of one frame, empty arrays for unknown frames"""
+        start, end = self.index.get(frame_id, (0, 0))
+        return self.tlwhs[start:end], self.ids[start:end], self.scores[start:end]
+
+    def to_dict(self):
+        """The {frame_id: [(tlwh, target_id, score), ...]} layout of read_results"""
+        results_dict = dict()
+        for frame_id in self.index:
+            tlwhs, ids, scores = self[frame_id]
+            results_dict[frame_id] = list(zip(map(tuple, tlwhs.tolist()), ids.tolist(), scores.tolist()))
+        return results_dict
+
+
+def load_results(filename, data_type: str, is_gt=False, is_ignore=False):
+    """:param filename: str | list of the parts of one result file"""
+    filenames = [filename] if isinstance(filename, str) else list(filename)
+    if filenames[0].endswith('.npy'):
+        return FrameIndexedResults.from_records(np.concatenate([read_binary_results(f) for f in filenames]))
     if data_type in ('mot', 'lab'):
-        read_fun = read_mot_results
+        load_fun = load_mot_results
     else:
         raise ValueError('Unknown data type: {}'.format(data_type))
 
-    return read_fun(filename, is_gt, is_ignore)
+    return load_fun(filenames, is_gt, is_ignore)
+
+
+def read_results(filename, data_type: str, is_gt=False, is_ignore=False):
+    return load_results(filename, data_type, is_gt, is_ignore).to_dict()
 
 
 """
@@ -60,53 +340,69 @@ labels={'ped', ...			% 1
 """
 
 
-def read_mot_results(filename, is_gt, is_ignore):
-    valid_labels = {1}
-    ignore_labels = {2, 7, 8, 12}
-    results_dict = dict()
-    if os.path.isfile(filename):
+
+
+def parse_mot_text(filename):
+    """
+    Parse a comma separated MOT file into a float64 array, one row per line.
+    Lines with less than 7 fields are dropped, shorter rows are padded with nan.
+    Missing or empty files give an empty (0, 10) array.
+    """
+    if not os.path.isfile(filename) or os.path.getsize(filename) == 0:
+        return np.zeros((0, 10))
+    try:
+        data = np.loadtxt(filename, delimiter=',', dtype=np.float64, ndmin=2)
+    except ValueError:
+        # rows of different length or with empty fields, fall back to splitting
+        # line by line. only the columns 0-8 the loaders use are read, empty
+        # fields stay nan
         with open(filename, 'r') as f:
-            for line in f.readlines():
-                linelist = line.split(',')
-                if len(linelist) < 7:
-                    continue
-                fid = int(linelist[0])
-                if fid < 1:
-                    continue
-                results_dict.setdefault(fid, list())
-
-                box_size = float(linelist[4]) * float(linelist[5])
-
-                if is_gt:
-                    if 'MOT16-' in filename or 'MOT17-' in filename:
-                        label = int(float(linelist[7]))
-                        mark = int(float(linelist[6]))
-                        if mark == 0 or label not in valid_labels:
-                            continue
-                    score = 1
-                elif is_ignore:
-                    if 'MOT16-' in filename or 'MOT17-' in filename:
-                        label = int(float(linelist[7]))
-                        vis_ratio = float(linelist[8])
-                        if label not in ignore_labels and vis_ratio >= 0:
-                            continue
-                    else:
-                        continue
-                    score = 1
-                else:
-                    score = float(linelist[6])
-
-                #if box_size > 7000:
-                #if box_size <= 7000 or box_size >= 15000:
-                #if box_size < 15000:
-                    #continue
-
-                tlwh = tuple(map(float, linelist[2:6]))
-                target_id = int(linelist[1])
-
-                results_dict[fid].append((tlwh, target_id, score))
-
-    return results_dict
+            rows = [line.split(',') for line in f.readlines()]
+        rows = [row[:9] for row in rows if len(row) >= 7]
+        data = np.full((len(rows), max([len(row) for row in rows] + [7])), np.nan)
+        for i, row in enumerate(rows):
+            for j, v in enumerate(row):
+                if v.strip() != '':
+                    data[i, j] = float(v)
+    if data.shape[1] < 7:
+        return np.zeros((0, 10))
+    return data
+
+
+def load_mot_results(filename, is_gt, is_ignore):
+    valid_labels = [1]
+    ignore_labels = [2, 7, 8, 12]
+    filenames = [filename] if isinstance(filename, str) else list(filename)
+    parts = [parse_mot_text(f) for f in filenames]
+    width = max(part.shape[1] for part in parts)
+    data = np.concatenate([np.pad(part, ((0, 0), (0, width - part.shape[1])), constant_values=np.nan)
+                           for part in parts])
+    data = data[data[:, 0].astype(np.int64) >= 1]
+    frame_ids = data[:, 0].astype(np.int64)
+
+    is_mot1617 = 'MOT16-' in filenames[0] or 'MOT17-' in filenames[0]
+    if is_gt:
+        if is_mot1617:
+            label = data[:, 7].astype(np.int64)
+            mark = data[:, 6].astype(np.int64)
+            data = data[(mark != 0) & np.isin(label, valid_labels)]
+        scores = np.ones(len(data))
+    elif is_ignore:
+        if is_mot1617:
+            label = data[:, 7].astype(np.int64)
+            vis_ratio = data[:, 8]
+            data = data[~(~np.isin(label, ignore_labels) & (vis_ratio >= 0))]
+        else:
+            data = data[:0]
+        scores = np.ones(len(data))
+    else:
+        scores = data[:, 6]
+
+    return FrameIndexedResults(data[:, 0], data[:, 1], data[:, 2:6], scores, frame_ids=frame_ids)
+
+
+def read_mot_results(filename, is_gt, is_ignore):
+    return load_mot_results(filename, is_gt, is_ignore).to_dict()
 
 
 def unzip_objs(objs):
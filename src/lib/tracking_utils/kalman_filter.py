@@ -21,6 +21,19 @@ chi2inv95 = {
     9: 16.919}
 
 
+def solve_lower_triangular(cholesky_factor, b):
+    """
+    Solve the lower triangular systems `cholesky_factor` z = b by forward
+    substitution, all at once. `cholesky_factor` (...xKxK) and `b` (...xK)
+    broadcast against each other.
+    """
+    z = np.empty(np.broadcast_shapes(cholesky_factor.shape[:-1], b.shape))
+    for i in range(b.shape[-1]):
+        z[..., i] = (b[..., i] - np.einsum('...j,...j->...', z[..., :i], cholesky_factor[..., i, :i])) \
+            / cholesky_factor[..., i, i]
+    return z
+
+
 class KalmanFilter(object):
     """
     A simple Kalman filter for tracking bounding boxes in image space.
@@ -153,6 +166,68 @@ class KalmanFilter(object):
             self._update_mat, covariance, self._update_mat.T))
         return mean, covariance + innovation_cov
 
+    def multi_initiate(self, measurement):
+        """Create tracks from unassociated measurements (Vectorized version).
+
+        Parameters
+        ----------
+        measurement : ndarray
+            The Nx4 dimensional matrix of bounding box coordinates (x, y, a, h).
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx8 mean matrix and Nx8x8 covariance matrices of the
+            new tracks.
+
+        """
+        measurement = np.asarray(measurement).reshape(-1, 4)
+        mean = np.concatenate([measurement, np.zeros_like(measurement)], axis=1)
+
+        h = measurement[:, 3]
+        std = np.stack([
+            2 * self._std_weight_position * h,
+            2 * self._std_weight_position * h,
+            1e-2 * np.ones_like(h),
+            2 * self._std_weight_position * h,
+            10 * self._std_weight_velocity * h,
+            10 * self._std_weight_velocity * h,
+            1e-5 * np.ones_like(h),
+            10 * self._std_weight_velocity * h], axis=1)
+        covariance = np.zeros((len(mean), 8, 8))
+        covariance[:, np.arange(8), np.arange(8)] = np.square(std)
+        return mean, covariance
+
+    def multi_project(self, mean, covariance):
+        """Project state distributions to measurement space (Vectorized version).
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrics of the states.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 projected covariance
+            matrices of the given state estimates.
+
+        """
+        h = mean[:, 3]
+        std = np.stack([
+            self._std_weight_position * h,
+            self._std_weight_position * h,
+            1e-1 * np.ones_like(h),
+            self._std_weight_position * h], axis=1)
+
+        # The update matrix selects the first four state components.
+        projected_mean = mean[:, :4].copy()
+        projected_cov = covariance[:, :4, :4].copy()
+        projected_cov[:, np.arange(4), np.arange(4)] += np.square(std)
+        return projected_mean, projected_cov
+
     def multi_predict(self, mean, covariance):
         """Run Kalman filter prediction step (Vectorized version).
         Parameters
@@ -226,6 +301,41 @@ class KalmanFilter(object):
             kalman_gain, projected_cov, kalman_gain.T))
         return new_mean, new_covariance
 
+    def multi_update(self, mean, covariance, measurement):
+        """Run Kalman filter correction step (Vectorized version).
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the predicted states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrics of the states.
+        measurement : ndarray
+            The Nx4 dimensional measurement matrix (x, y, a, h), where (x, y)
+            is the center position, a the aspect ratio, and h the height of the
+            bounding box.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+
+        """
+        if len(mean) == 0:
+            return mean, covariance
+        projected_mean, projected_cov = self.multi_project(mean, covariance)
+
+        # P H^T, the 8x4 left block of every covariance.
+        cov_ht = covariance[:, :, :4]
+        kalman_gain = np.linalg.solve(
+            projected_cov, cov_ht.transpose((0, 2, 1))).transpose((0, 2, 1))
+        innovation = measurement - projected_mean
+
+        new_mean = mean + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariance = covariance - np.einsum(
+            'nij,njk,nlk->nil', kalman_gain, projected_cov, kalman_gain)
+        return new_mean, new_covariance
+
     def gating_distance(self, mean, covariance, measurements,
                         only_position=False, metric='maha'):
         """Compute gating distance between state distribution and measurements.
@@ -268,4 +378,43 @@ class KalmanFilter(object):
             squared_maha = np.sum(z * z, axis=0)
             return squared_maha
         else:
-            raise ValueError('invalid distance metric')
\ No newline at end of file
+            raise ValueError('invalid distance metric')
+
+    def multi_gating_distance(self, mean, covariance, measurements,
+                              only_position=False, metric='maha'):
+        """Compute gating distances between N state distributions and M
+        measurements (Vectorized version of `gating_distance`).
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the state distributions.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrics of the state distributions.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements, each in
+            format (x, y, a, h) where (x, y) is the bounding box center
+            position, a the aspect ratio, and h the height.
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+        Returns
+        -------
+        ndarray
+            Returns an NxM matrix, where element (i, j) contains the squared
+            Mahalanobis distance between state i and `measurements[j]`.
+        """
+        mean, covariance = self.multi_project(mean, covariance)
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        d = measurements[np.newaxis, :, :] - mean[:, np.newaxis, :]
+        if metric == 'gaussian':
+            return np.sum(d * d, axis=2)
+        elif metric == 'maha':
+            cholesky_factor = np.linalg.cholesky(covariance)
+            z = solve_lower_triangular(cholesky_factor[:, np.newaxis], d)
+            squared_maha = np.sum(z * z, axis=2)
+            return squared_maha
+        else:
+            raise ValueError('invalid distance metric')
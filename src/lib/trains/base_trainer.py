@@ -6,6 +6,7 @@ import time
 import torch
 from progress.bar import Bar
 from models.data_parallel import DataParallel
+from datasets.dataset.device_augment import DeviceAugment
 from utils.utils import AverageMeter
 
 
@@ -28,6 +29,7 @@ class BaseTrainer(object):
     self.loss_stats, self.loss = self._get_losses(opt)
     self.model_with_loss = ModleWithLoss(model, self.loss)
     self.optimizer.add_param_group({'params': self.loss.parameters()})
+    self.device_augment = DeviceAugment(opt) if opt.device_augment else None
 
   def set_device(self, gpus, chunk_sizes, device):
     if len(gpus) > 1:
@@ -67,6 +69,8 @@ class BaseTrainer(object):
       for k in batch:
         if k != 'meta':
           batch[k] = batch[k].to(device=opt.device, non_blocking=True)
+      if self.device_augment is not None:
+        batch = self.device_augment(batch, augment=phase == 'train')
 
       output, loss, loss_stats = model_with_loss(batch)
       loss = loss.mean()
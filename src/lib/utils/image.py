@@ -93,6 +93,7 @@ def crop(img, center, scale, output_size, rot=0):
 
 
 def gaussian_radius(det_size, min_overlap=0.7):
+  # height and width may also be arrays, for the radii of many boxes at once
   height, width = det_size
 
   a1  = 1
@@ -112,7 +113,7 @@ def gaussian_radius(det_size, min_overlap=0.7):
   c3  = (min_overlap - 1) * width * height
   sq3 = np.sqrt(b3 ** 2 - 4 * a3 * c3)
   r3  = (b3 + sq3) / 2
-  return min(r1, r2, r3)
+  return np.minimum(np.minimum(r1, r2), r3)
 
 
 def gaussian2D(shape, sigma=1):
@@ -123,9 +124,21 @@ def gaussian2D(shape, sigma=1):
     h[h < np.finfo(h.dtype).eps * h.max()] = 0
     return h
 
+_umich_gaussians = {}
+
+
+def umich_gaussian(radius):
+  """gaussian2D kernel of `radius` as draw_umich_gaussian draws it, built once per radius"""
+  gaussian = _umich_gaussians.get(radius)
+  if gaussian is None:
+    diameter = 2 * radius + 1
+    gaussian = gaussian2D((diameter, diameter), sigma=diameter / 6)
+    gaussian.setflags(write=False)
+    _umich_gaussians[radius] = gaussian
+  return gaussian
+
 def draw_umich_gaussian(heatmap, center, radius, k=1):
-  diameter = 2 * radius + 1
-  gaussian = gaussian2D((diameter, diameter), sigma=diameter / 6)
+  gaussian = umich_gaussian(radius)
   
   x, y = int(center[0]), int(center[1])
 
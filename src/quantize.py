@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import os
+import os.path as osp
+import copy
+import logging
+import numpy as np
+import torch
+
+from models.model import create_model, load_model
+from models.export import export_torchscript
+from models.quantize import quantize_int8, QUANT_ARCHS
+from tracker.multitracker import load_tracking_model
+from tracking_utils.evaluation import Evaluator
+from tracking_utils.log import logger
+from tracking_utils.utils import mkdir_if_missing
+import datasets.dataset.jde as datasets
+from track import track_and_eval_seq
+from opts import opts
+
+
+def quantized_filename(opt):
+    if opt.export_path != '':
+        return opt.export_path
+    width, height = opt.img_size
+    return '{}_int8_{}x{}.pt'.format(os.path.splitext(opt.load_model)[0], width, height)
+
+
+def calibration_blobs(opt, img_dir):
+    """Input blobs of opt.calib_frames frames of `img_dir`, evenly spaced"""
+    dataloader = datasets.LoadImages(img_dir, opt.img_size, as_uint8=True)
+    frames = np.unique(np.linspace(0, len(dataloader) - 1, opt.calib_frames).round().astype(int))
+    for i in frames:
+        path, img, img0 = dataloader[i]
+        yield datasets.to_blob(img, opt.device)
+
+
+def main(opt):
+    logger.setLevel(logging.INFO)
+    # quantized kernels run on the CPU only
+    opt.gpus = [-1]
+    opt.device = torch.device('cpu')
+    arch = opt.arch[:opt.arch.find('_')] if '_' in opt.arch else opt.arch
+    if arch not in QUANT_ARCHS:
+        raise ValueError('cannot quantize {}, supported are {}'.format(opt.arch, ', '.join(QUANT_ARCHS)))
+    data_root, seq = osp.split(osp.normpath(opt.quant_seq))
+
+    print('Creating model...')
+    model = create_model(opt.arch, opt.heads, opt.head_conv)
+    model = load_model(model, opt.load_model)
+    model.eval()
+
+    logger.info('calibrate on {} frames of {}'.format(opt.calib_frames, seq))
+    qmodel = quantize_int8(model, calibration_blobs(opt, osp.join(opt.quant_seq, 'img1')))
+    filename = quantized_filename(opt)
+    export_torchscript(qmodel, opt, filename, qengine=torch.backends.quantized.engine)
+    logger.info('saved {} for input size {}'.format(filename, tuple(opt.img_size)))
+
+    # track the sequence with both models
+    opt_int8 = copy.copy(opt)
+    opt_int8.backend = 'torchscript'
+    opt_int8.load_model = filename
+    runs = [('fp32', opt, model), ('int8', opt_int8, load_tracking_model(opt_int8))]
+    accs, times = [], []
+    for name, run_opt, run_model in runs:
+        result_root = osp.join(data_root, '..', 'results', 'quantize_{}'.format(name))
+        mkdir_if_missing(result_root)
+        acc, nf, ta, tc = track_and_eval_seq(run_opt, data_root, seq, result_root, show_image=False, model=run_model)
+        accs.append(acc)
+        times.append(ta)
+
+    names = [name for name, _, _ in runs]
+    summary = Evaluator.get_summary(accs, names, metrics=('mota', 'idf1', 'num_switches')).loc[names]
+    summary['ms/frame'] = [t * 1000 for t in times]
+    summary.loc['int8 - fp32'] = summary.loc['int8'] - summary.loc['fp32']
+    print(summary.to_string(float_format='{:.4g}'.format))
+
+
+if __name__ == '__main__':
+    opt = opts().init()
+    main(opt)
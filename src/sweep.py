@@ -0,0 +1,136 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+import os
+import os.path as osp
+import copy
+import time
+import logging
+import itertools
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+from tracker.multitracker import JDETracker, load_tracking_model
+from tracking_utils.detcache import DetectionCache, DetectionCacheWriter, ReplayLoader
+from tracking_utils.evaluation import Evaluator
+from tracking_utils.io import FrameIndexedResults, stack_results
+from tracking_utils.log import logger
+from tracking_utils.utils import mkdir_if_missing
+import datasets.dataset.jde as datasets
+from track import filter_targets, get_eval_seqs, get_frame_rate
+from opts import opts
+
+
+SWEEP_PARAMS = ('conf_thres', 'track_buffer', 'match_thres', 'iou_thres', 'unconfirmed_thres', 'min_box_area')
+
+
+def sweep_configs(opt):
+    """Every combination of the --sweep_* values, as a list of {param: value}"""
+    values = []
+    for name in SWEEP_PARAMS:
+        cast = int if name == 'track_buffer' else float
+        sweep_values = getattr(opt, 'sweep_' + name)
+        values.append([cast(v) for v in sweep_values.split(',')] if sweep_values else [getattr(opt, name)])
+    return [dict(zip(SWEEP_PARAMS, config)) for config in itertools.product(*values)]
+
+
+def cache_detections(opt, data_root, seqs, min_score):
+    """
+    Run the network once over every sequence and cache its detections in
+    opt.det_cache_dir. Caches of the same model and settings are reused.
+    """
+    info = {'load_model': osp.abspath(opt.load_model), 'arch': opt.arch,
+            'img_size': list(opt.img_size), 'K': opt.K}
+    model = None
+    for seq in seqs:
+        cache_dir = osp.join(opt.det_cache_dir, seq)
+        if DetectionCache.exists(cache_dir):
+            meta = DetectionCache(cache_dir).meta
+            if meta['min_score'] <= min_score and all(meta.get(k) == v for k, v in info.items()):
+                logger.info('use cached detections of seq: {}'.format(seq))
+                continue
+        if model is None:
+            model = load_tracking_model(opt)
+        logger.info('cache detections of seq: {}'.format(seq))
+        dataloader = datasets.LoadImages(osp.join(data_root, seq, 'img1'), opt.img_size, as_uint8=True)
+        if opt.prefetch_frames > 0:
+            dataloader = datasets.PrefetchLoader(dataloader, opt.prefetch_frames, opt.prefetch_workers)
+        tracker = JDETracker(opt, model=model)
+        with DetectionCacheWriter(cache_dir, min_score=min_score, info=info) as writer:
+            for path, img, img0 in dataloader:
+                writer.write(*tracker.detect(datasets.to_blob(img, opt.device), img0))
+
+
+def replay_config(opt, data_root, seq, config):
+    """
+    Track `seq` from its detection cache with the parameters of `config`
+    :return: motmetrics accumulator
+    """
+    opt = copy.copy(opt)
+    for k, v in config.items():
+        setattr(opt, k, v)
+    replay_loader = ReplayLoader(osp.join(opt.det_cache_dir, seq))
+    tracker = JDETracker(opt, frame_rate=get_frame_rate(data_root, seq), with_model=False)
+    results = []
+    for frame_id, (dets, id_feature) in enumerate(replay_loader):
+        online_targets = tracker.update_frame(dets, id_feature)
+        online_tlwhs, online_ids = filter_targets(online_targets, opt.min_box_area)
+        results.append((frame_id + 1, online_tlwhs, online_ids))
+
+    frames, ids, tlwhs, _ = stack_results(results)
+    evaluator = Evaluator(data_root, seq, 'mot', cache_dir=opt.gt_cache_dir or None)
+    return evaluator.eval_results(FrameIndexedResults(frames, ids, tlwhs, np.ones(len(ids))))
+
+
+def _init_replay_worker():
+    logger.setLevel(logging.INFO)
+
+
+def _replay_worker(job):
+    return replay_config(*job)
+
+
+def main(opt, data_root='/data/MOT16/train', seqs=('MOT16-05',), exp_name='sweep'):
+    logger.setLevel(logging.INFO)
+    result_root = os.path.join(data_root, '..', 'results', exp_name)
+    mkdir_if_missing(result_root)
+
+    configs = sweep_configs(opt)
+    cache_detections(opt, data_root, seqs, min_score=min(config['conf_thres'] for config in configs))
+
+    # replay every configuration on every sequence
+    start = time.time()
+    jobs = [(opt, data_root, seq, config) for config in configs for seq in seqs]
+    if opt.sweep_workers > 0:
+        with mp.get_context('spawn').Pool(opt.sweep_workers, initializer=_init_replay_worker) as pool:
+            accs = pool.map(_replay_worker, jobs, chunksize=1)
+    else:
+        accs = [replay_config(*job) for job in jobs]
+    logger.info('{} configs x {} seqs replayed in {:.2f} seconds'.format(
+        len(configs), len(seqs), time.time() - start))
+
+    # get summary
+    rows = []
+    for i, config in enumerate(configs):
+        summary = Evaluator.get_summary(accs[i * len(seqs):(i + 1) * len(seqs)], seqs,
+                                        metrics=('mota', 'idf1', 'num_switches'))
+        overall = summary.loc['OVERALL']
+        row = dict(config)
+        row.update({'MOTA': overall['mota'], 'IDF1': overall['idf1'], 'IDs': int(overall['num_switches'])})
+        rows.append(row)
+    table = pd.DataFrame(rows, columns=list(SWEEP_PARAMS) + ['MOTA', 'IDF1', 'IDs'])
+    print(table.to_string(index=False, float_format='{:.4g}'.format))
+    table.to_csv(os.path.join(result_root, 'sweep_{}.csv'.format(exp_name)), index=False)
+
+
+if __name__ == '__main__':
+    opt = opts().init()
+    data_root, seqs = get_eval_seqs(opt)
+
+    main(opt,
+         data_root=data_root,
+         seqs=seqs,
+         exp_name='sweep_{}'.format(opt.exp_id))
@@ -77,7 +77,9 @@ def test_det(
 
     # Get dataloader
     transforms = T.Compose([T.ToTensor()])
-    dataset = DetDataset(dataset_root, test_path, img_size, augment=False, transforms=transforms)
+    # --shard_dir and --image_cache_dir hold the training list, the test images are read from their files
+    dataset = DetDataset(dataset_root, test_path, img_size, augment=False, transforms=transforms,
+                         label_index_dir=opt.label_index_dir)
     dataloader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False,
                                              num_workers=8, drop_last=False, collate_fn=collate_fn)
     mean_mAP, mean_R, mean_P, seen = 0.0, 0.0, 0.0, 0
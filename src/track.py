@@ -8,15 +8,22 @@ import os.path as osp
 import cv2
 import logging
 import argparse
+import time
+import multiprocessing as mp
+from collections import OrderedDict
 import motmetrics as mm
 import numpy as np
 import torch
 
-from tracker.multitracker import JDETracker
+from tracker.multitracker import JDETracker, load_tracking_model
+from tracker.resolution import create_scheduler
+from tracker.frameskip import FrameSkipScheduler
 from tracking_utils import visualization as vis
 from tracking_utils.log import logger
 from tracking_utils.timer import Timer
 from tracking_utils.evaluation import Evaluator
+from tracking_utils.detcache import DetectionCacheWriter, ReplayLoader
+from tracking_utils.io import ResultsWriter, stack_results, write_mot_results, MOT_FORMAT, MOT_SCORE_FORMAT, KITTI_FORMAT
 import datasets.dataset.jde as datasets
 
 from tracking_utils.utils import mkdir_if_missing
@@ -25,54 +32,78 @@ from opts import opts
 
 def write_results(filename, results, data_type):
     if data_type == 'mot':
-        save_format = '{frame},{id},{x1},{y1},{w},{h},1,-1,-1,-1\n'
+        save_format = MOT_FORMAT
     elif data_type == 'kitti':
-        save_format = '{frame} {id} pedestrian 0 0 -10 {x1} {y1} {x2} {y2} -10 -10 -10 -1000 -1000 -1000 -10\n'
+        save_format = KITTI_FORMAT
     else:
         raise ValueError(data_type)
 
-    with open(filename, 'w') as f:
-        for frame_id, tlwhs, track_ids in results:
-            if data_type == 'kitti':
-                frame_id -= 1
-            for tlwh, track_id in zip(tlwhs, track_ids):
-                if track_id < 0:
-                    continue
-                x1, y1, w, h = tlwh
-                x2, y2 = x1 + w, y1 + h
-                line = save_format.format(frame=frame_id, id=track_id, x1=x1, y1=y1, x2=x2, y2=y2, w=w, h=h)
-                f.write(line)
+    frames, ids, tlwhs, _ = stack_results(results)
+    if data_type == 'kitti':
+        frames -= 1
+    write_mot_results(filename, frames, ids, tlwhs, save_format=save_format)
     logger.info('save results to {}'.format(filename))
 
 
 def write_results_score(filename, results, data_type):
     if data_type == 'mot':
-        save_format = '{frame},{id},{x1},{y1},{w},{h},{s},1,-1,-1,-1\n'
+        save_format = MOT_SCORE_FORMAT
     elif data_type == 'kitti':
-        save_format = '{frame} {id} pedestrian 0 0 -10 {x1} {y1} {x2} {y2} -10 -10 -10 -1000 -1000 -1000 -10\n'
+        save_format = KITTI_FORMAT
     else:
         raise ValueError(data_type)
 
-    with open(filename, 'w') as f:
-        for frame_id, tlwhs, track_ids, scores in results:
-            if data_type == 'kitti':
-                frame_id -= 1
-            for tlwh, track_id, score in zip(tlwhs, track_ids, scores):
-                if track_id < 0:
-                    continue
-                x1, y1, w, h = tlwh
-                x2, y2 = x1 + w, y1 + h
-                line = save_format.format(frame=frame_id, id=track_id, x1=x1, y1=y1, x2=x2, y2=y2, w=w, h=h, s=score)
-                f.write(line)
+    frames, ids, tlwhs, scores = stack_results(results)
+    if data_type == 'kitti':
+        frames -= 1
+    write_mot_results(filename, frames, ids, tlwhs, scores, save_format=save_format)
     logger.info('save results to {}'.format(filename))
 
 
-def eval_seq(opt, dataloader, data_type, result_filename, save_dir=None, show_image=True, frame_rate=30, use_cuda=True):
+def filter_targets(online_targets, min_box_area):
+    """Boxes and ids of the tracks passing the box area and aspect ratio filters"""
+    online_tlwhs = []
+    online_ids = []
+    #online_scores = []
+    for t in online_targets:
+        tlwh = t.tlwh
+        tid = t.track_id
+        vertical = tlwh[2] / tlwh[3] > 1.6
+        if tlwh[2] * tlwh[3] > min_box_area and not vertical:
+            online_tlwhs.append(tlwh)
+            online_ids.append(tid)
+            #online_scores.append(t.score)
+    return online_tlwhs, online_ids
+
+
+def open_results(opt, result_filename, data_type):
+    return ResultsWriter(result_filename, data_type, chunk_frames=opt.results_chunk, fsync=opt.results_fsync,
+                         max_bytes=int(opt.results_rotate_mb * 1024 * 1024),
+                         max_seconds=opt.results_rotate_min * 60)
+
+
+def eval_seq(opt, dataloader, data_type, result_filename, save_dir=None, show_image=True, frame_rate=30, use_cuda=True,
+             model=None, det_cache_dir=None):
     if save_dir:
         mkdir_if_missing(save_dir)
-    tracker = JDETracker(opt, frame_rate=frame_rate)
+    tracker = JDETracker(opt, frame_rate=frame_rate, model=model)
+    if opt.prefetch_frames > 0:
+        dataloader = datasets.PrefetchLoader(dataloader, opt.prefetch_frames, opt.prefetch_workers)
+    det_cache = None
+    if det_cache_dir is not None:
+        det_cache = DetectionCacheWriter(det_cache_dir, info={'frame_rate': frame_rate},
+                                         dtype='float16' if opt.det_cache_fp16 else 'float32')
+    scheduler = create_scheduler(opt) if opt.adaptive_res else None
+    # letterbox buffers of the adaptive input sizes
+    buffers = {}
+    frame_skip = None
+    if opt.detect_interval > 1:
+        if det_cache is not None:
+            raise ValueError('a detection cache needs the detections of every frame, '
+                             'it cannot be saved with --detect_interval > 1')
+        frame_skip = FrameSkipScheduler(opt.detect_interval, budget=opt.latency_budget / 1000.)
     timer = Timer()
-    results = []
+    results = open_results(opt, result_filename, data_type)
     frame_id = 0
     #for path, img, img0 in dataloader:
     for i, (path, img, img0) in enumerate(dataloader):
@@ -83,26 +114,37 @@ def eval_seq(opt, dataloader, data_type, result_filename, save_dir=None, show_im
 
         # run tracking
         timer.tic()
-        if use_cuda:
-            blob = torch.from_numpy(img).cuda().unsqueeze(0)
+        start = time.time()
+        detect = frame_skip is None or frame_skip.detect_next()
+        if not detect:
+            # advance the tracks by the Kalman filter only
+            online_targets = tracker.predict_only()
         else:
-            blob = torch.from_numpy(img).unsqueeze(0)
-        online_targets = tracker.update(blob, img0)
-        online_tlwhs = []
-        online_ids = []
-        #online_scores = []
-        for t in online_targets:
-            tlwh = t.tlwh
-            tid = t.track_id
-            vertical = tlwh[2] / tlwh[3] > 1.6
-            if tlwh[2] * tlwh[3] > opt.min_box_area and not vertical:
-                online_tlwhs.append(tlwh)
-                online_ids.append(tid)
-                #online_scores.append(t.score)
+            if scheduler is not None:
+                width, height = scheduler.size
+                if img.dtype != np.uint8 or img.shape[:2] != (height, width):
+                    if scheduler.size not in buffers:
+                        buffers[scheduler.size] = np.empty((height, width, 3), dtype=np.uint8)
+                    img, _, _, _ = datasets.letterbox_into(img0, buffers[scheduler.size])
+            if img.dtype == np.uint8:
+                blob = datasets.to_blob(img, 'cuda' if use_cuda else 'cpu')
+            elif use_cuda:
+                blob = torch.from_numpy(img).cuda().unsqueeze(0)
+            else:
+                blob = torch.from_numpy(img).unsqueeze(0)
+            dets, id_feature = tracker.detect(blob, img0)
+            if scheduler is not None and scheduler.update(dets[dets[:, 4] > opt.conf_thres], img0.shape):
+                logger.info('Frame {}: input size {}x{}'.format(frame_id, *scheduler.size))
+            if det_cache is not None:
+                det_cache.write(dets, id_feature)
+            online_targets = tracker.update_frame(dets, id_feature)
+        online_tlwhs, online_ids = filter_targets(online_targets, opt.min_box_area)
+        if frame_skip is not None:
+            frame_skip.record(detect, time.time() - start)
         timer.toc()
         # save results
-        results.append((frame_id + 1, online_tlwhs, online_ids))
-        #results.append((frame_id + 1, online_tlwhs, online_ids, online_scores))
+        results.write(frame_id + 1, online_tlwhs, online_ids)
+        #results.write(frame_id + 1, online_tlwhs, online_ids, online_scores)
         if show_image or save_dir is not None:
             online_im = vis.plot_tracking(img0, online_tlwhs, online_ids, frame_id=frame_id,
                                           fps=1. / timer.average_time)
@@ -112,11 +154,116 @@ def eval_seq(opt, dataloader, data_type, result_filename, save_dir=None, show_im
             cv2.imwrite(os.path.join(save_dir, '{:05d}.jpg'.format(frame_id)), online_im)
         frame_id += 1
     # save results
-    write_results(result_filename, results, data_type)
-    #write_results_score(result_filename, results, data_type)
+    results.close()
+    if det_cache is not None:
+        det_cache.close()
+    if frame_skip is not None:
+        logger.info('Ran the detector on {} of {} frames'.format(frame_skip.num_detected, frame_skip.num_frames))
+    return frame_id, timer.average_time, timer.calls
+
+
+def replay_seq(opt, replay_loader, data_type, result_filename, frame_rate=30):
+    """Track from the detections of a ReplayLoader, without running the model"""
+    tracker = JDETracker(opt, frame_rate=frame_rate, with_model=False)
+    timer = Timer()
+    results = open_results(opt, result_filename, data_type)
+    frame_id = 0
+    for dets, id_feature in replay_loader:
+        timer.tic()
+        online_targets = tracker.update_frame(dets, id_feature)
+        online_tlwhs, online_ids = filter_targets(online_targets, opt.min_box_area)
+        timer.toc()
+        results.write(frame_id + 1, online_tlwhs, online_ids)
+        frame_id += 1
+    results.close()
+    logger.info('Replayed {} frames ({:.2f} fps)'.format(frame_id, 1. / max(1e-5, timer.average_time)))
     return frame_id, timer.average_time, timer.calls
 
 
+def get_frame_rate(data_root, seq):
+    meta_info = open(os.path.join(data_root, seq, 'seqinfo.ini')).read()
+    return int(meta_info[meta_info.find('frameRate') + 10:meta_info.find('\nseqLength')])
+
+
+def track_and_eval_seq(opt, data_root, seq, result_root, data_type='mot', output_dir=None,
+                       save_videos=False, show_image=True, model=None):
+    """Track one sequence of `data_root` and evaluate the results against its gt
+
+    :return: motmetrics accumulator, number of frames, average time per frame, timer calls
+    """
+    logger.info('start seq: {}'.format(seq))
+    result_filename = os.path.join(result_root, '{}.{}'.format(seq, 'npy' if opt.results_binary else 'txt'))
+    frame_rate = get_frame_rate(data_root, seq)
+    if opt.replay:
+        replay_loader = ReplayLoader(osp.join(opt.det_cache_dir, seq))
+        nf, ta, tc = replay_seq(opt, replay_loader, data_type, result_filename, frame_rate=frame_rate)
+    else:
+        dataloader = datasets.LoadImages(osp.join(data_root, seq, 'img1'), opt.img_size, as_uint8=True)
+        det_cache_dir = osp.join(opt.det_cache_dir, seq) if opt.save_det_cache else None
+        nf, ta, tc = eval_seq(opt, dataloader, data_type, result_filename,
+                              save_dir=output_dir, show_image=show_image, frame_rate=frame_rate,
+                              use_cuda=opt.gpus[0] >= 0, model=model, det_cache_dir=det_cache_dir)
+
+    # eval
+    logger.info('Evaluate seq: {}'.format(seq))
+    evaluator = Evaluator(data_root, seq, data_type, cache_dir=opt.gt_cache_dir or None)
+    acc = evaluator.eval_file(result_filename)
+    if save_videos:
+        output_video_path = osp.join(output_dir, '{}.mp4'.format(seq))
+        cmd_str = 'ffmpeg -f image2 -i {}/%05d.jpg -c:v copy {}'.format(output_dir, output_video_path)
+        os.system(cmd_str)
+    return acc, nf, ta, tc
+
+
+# model of an evaluation worker process, loaded once by _init_eval_worker
+_worker_model = None
+
+
+def _init_eval_worker(opt, gpu_queue):
+    global _worker_model
+    logger.setLevel(logging.INFO)
+    gpu = gpu_queue.get()
+    if gpu >= 0:
+        torch.cuda.set_device(gpu)
+    _worker_model = load_tracking_model(opt)
+
+
+def _eval_worker(job):
+    start = time.time()
+    acc, nf, ta, tc = track_and_eval_seq(*job, model=_worker_model)
+    return os.getpid(), acc, nf, ta, tc, time.time() - start
+
+
+def eval_seqs_parallel(opt, jobs):
+    """Run track_and_eval_seq for every job on a pool of opt.eval_workers processes
+
+    Workers are spread over opt.gpus and each loads the model once.
+
+    :return: list of (acc, nf, ta, tc) in the order of `jobs`
+    """
+    ctx = mp.get_context('spawn')
+    gpu_queue = ctx.Queue()
+    for i in range(opt.eval_workers):
+        gpu_queue.put(opt.gpus[i % len(opt.gpus)])
+    start = time.time()
+    with ctx.Pool(opt.eval_workers, initializer=_init_eval_worker, initargs=(opt, gpu_queue)) as pool:
+        outputs = pool.map(_eval_worker, jobs, chunksize=1)
+    wall_time = time.time() - start
+
+    workers = OrderedDict()
+    for pid, _, nf, ta, tc, seq_time in outputs:
+        stats = workers.setdefault(pid, [0, 0, 0., 0.])
+        stats[0] += 1
+        stats[1] += nf
+        stats[2] += ta * tc
+        stats[3] += seq_time
+    for i, (n_seq, n_frame, track_time, seq_time) in enumerate(workers.values()):
+        logger.info('Worker {}: {} seqs, {} frames, FPS: {:.2f}, wall time: {:.2f} seconds'.format(
+            i, n_seq, n_frame, n_frame / max(1e-5, track_time), seq_time))
+    logger.info('{} seqs evaluated by {} workers in {:.2f} seconds'.format(len(jobs), opt.eval_workers, wall_time))
+    return [output[1:5] for output in outputs]
+
+
 def main(opt, data_root='/data/MOT16/train', det_root=None, seqs=('MOT16-05',), exp_name='demo',
          save_images=False, save_videos=False, show_image=True):
     logger.setLevel(logging.INFO)
@@ -125,32 +272,17 @@ def main(opt, data_root='/data/MOT16/train', det_root=None, seqs=('MOT16-05',),
     data_type = 'mot'
 
     # run tracking
-    accs = []
-    n_frame = 0
-    timer_avgs, timer_calls = [], []
+    jobs = []
     for seq in seqs:
         output_dir = os.path.join(data_root, '..', 'outputs', exp_name, seq) if save_images or save_videos else None
-        logger.info('start seq: {}'.format(seq))
-        dataloader = datasets.LoadImages(osp.join(data_root, seq, 'img1'), opt.img_size)
-        result_filename = os.path.join(result_root, '{}.txt'.format(seq))
-        meta_info = open(os.path.join(data_root, seq, 'seqinfo.ini')).read()
-        frame_rate = int(meta_info[meta_info.find('frameRate') + 10:meta_info.find('\nseqLength')])
-        nf, ta, tc = eval_seq(opt, dataloader, data_type, result_filename,
-                              save_dir=output_dir, show_image=show_image, frame_rate=frame_rate)
-        n_frame += nf
-        timer_avgs.append(ta)
-        timer_calls.append(tc)
-
-        # eval
-        logger.info('Evaluate seq: {}'.format(seq))
-        evaluator = Evaluator(data_root, seq, data_type)
-        accs.append(evaluator.eval_file(result_filename))
-        if save_videos:
-            output_video_path = osp.join(output_dir, '{}.mp4'.format(seq))
-            cmd_str = 'ffmpeg -f image2 -i {}/%05d.jpg -c:v copy {}'.format(output_dir, output_video_path)
-            os.system(cmd_str)
-    timer_avgs = np.asarray(timer_avgs)
-    timer_calls = np.asarray(timer_calls)
+        jobs.append((opt, data_root, seq, result_root, data_type, output_dir, save_videos, show_image))
+    if opt.eval_workers > 0:
+        outputs = eval_seqs_parallel(opt, jobs)
+    else:
+        outputs = [track_and_eval_seq(*job) for job in jobs]
+    accs = [acc for acc, _, _, _ in outputs]
+    timer_avgs = np.asarray([ta for _, _, ta, _ in outputs])
+    timer_calls = np.asarray([tc for _, _, _, tc in outputs])
     all_time = np.dot(timer_avgs, timer_calls)
     avg_time = all_time / np.sum(timer_calls)
     logger.info('Time elapsed: {:.2f} seconds, FPS: {:.2f}'.format(all_time, 1.0 / avg_time))
@@ -168,10 +300,8 @@ def main(opt, data_root='/data/MOT16/train', det_root=None, seqs=('MOT16-05',),
     Evaluator.save_summary(summary, os.path.join(result_root, 'summary_{}.xlsx'.format(exp_name)))
 
 
-if __name__ == '__main__':
-    os.environ['CUDA_VISIBLE_DEVICES'] = '1'
-    opt = opts().init()
-
+def get_eval_seqs(opt):
+    """Data root and sequences of the benchmark split selected in `opt`"""
     if not opt.val_mot16:
         seqs_str = '''KITTI-13
                       KITTI-17
@@ -261,6 +391,14 @@ if __name__ == '__main__':
                       '''
         data_root = os.path.join(opt.data_dir, 'MOT20/images/test')
     seqs = [seq.strip() for seq in seqs_str.split()]
+    return data_root, seqs
+
+
+if __name__ == '__main__':
+    os.environ['CUDA_VISIBLE_DEVICES'] = '1'
+    opt = opts().init()
+
+    data_root, seqs = get_eval_seqs(opt)
 
     main(opt,
          data_root=data_root,
@@ -15,6 +15,7 @@ from models.model import create_model, load_model, save_model
 from models.data_parallel import DataParallel
 from logger import Logger
 from datasets.dataset_factory import get_dataset
+from datasets.dataset.shards import ShardSampler
 from trains.train_factory import train_factory
 
 
@@ -45,11 +46,14 @@ def main(opt):
     start_epoch = 0
 
     # Get dataloader
+    # with image shards read one shard after the other instead of all over them
+    sampler = ShardSampler(dataset.image_shards.shard_of()) if opt.shard_dir else None
 
     train_loader = torch.utils.data.DataLoader(
         dataset,
         batch_size=opt.batch_size,
-        shuffle=True,
+        shuffle=sampler is None,
+        sampler=sampler,
         num_workers=opt.num_workers,
         pin_memory=True,
         drop_last=True